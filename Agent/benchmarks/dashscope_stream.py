@@ -0,0 +1,127 @@
+"""
+Microbenchmark: per-chunk overhead of ChatDashscope streaming.
+
+Replays a recorded stream (JSONL, one raw ChatCompletionChunk dict per line) through
+    - legacy: model_dump() + _convert_chunk_to_generation_chunk, aggregated with ``+=``
+    - lean:   _convert_completion_chunk, aggregated with _generate_from_chunks
+and reports the time per chunk for conversion alone and for conversion plus aggregation.
+Without ``--recording`` a synthetic 10k-chunk DashScope-like stream (role chunk, reasoning phase,
+answer phase, empty keep-alive deltas, finish chunk, usage chunk) is generated; ``--save`` writes
+it out so later runs can replay exactly the same input.
+
+Usage (from the Agent directory):
+    python benchmarks/dashscope_stream.py [--recording stream.jsonl] [--chunks 10000] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+from openai.types.chat import ChatCompletionChunk  # noqa: E402
+
+from src.llms.providers.dashscope import (  # noqa: E402
+    _convert_chunk_to_generation_chunk,
+    _convert_completion_chunk,
+    _generate_from_chunks,
+)
+
+
+def synthesize(num_chunks: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = ["the", "model", "stream", "token", "latency", "agent", "plan", "search", "answer", "因此", "我们"]
+    base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "qwen-plus"}
+
+    def delta_chunk(delta, finish_reason=None):
+        return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    chunks = [delta_chunk({"role": "assistant", "content": ""})]
+    reasoning_chunks = int(num_chunks * 0.4)
+    for index in range(num_chunks - 3):
+        if rng.random() < 0.03:
+            chunks.append(delta_chunk({"content": ""}))
+        elif index < reasoning_chunks:
+            chunks.append(delta_chunk({"content": None, "reasoning_content": rng.choice(words) + " "}))
+        else:
+            chunks.append(delta_chunk({"content": rng.choice(words) + " "}))
+    chunks.append(delta_chunk({"content": ""}, finish_reason="stop"))
+    chunks.append({**base, "choices": [], "usage": {"prompt_tokens": 512, "completion_tokens": num_chunks, "total_tokens": 512 + num_chunks}})
+    return chunks
+
+
+def legacy_convert(objects):
+    for obj in objects:
+        chunk = _convert_chunk_to_generation_chunk(obj.model_dump(), AIMessageChunk, {})
+        if chunk is not None:
+            yield chunk
+
+
+def lean_convert(objects):
+    for obj in objects:
+        chunk = _convert_completion_chunk(obj, AIMessageChunk, {})
+        if chunk is not None:
+            yield chunk
+
+
+def legacy_aggregate(chunks):
+    generation = None
+    for chunk in chunks:
+        generation = chunk if generation is None else generation + chunk
+    return generation.message
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="JSONL file with one raw chunk dict per line")
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the synthetic recording to this file")
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording, encoding="utf-8") as f:
+            raw = [json.loads(line) for line in f if line.strip()]
+    else:
+        raw = synthesize(args.chunks)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in raw)
+    # The client yields parsed objects, so parsing is not part of either path
+    objects = [ChatCompletionChunk.model_validate(chunk) for chunk in raw]
+    n = len(objects)
+
+    legacy_t, legacy_chunks = best_of(args.repeat, lambda: list(legacy_convert(objects)))
+    lean_t, lean_chunks = best_of(args.repeat, lambda: list(lean_convert(objects)))
+    legacy_total, legacy_message = best_of(args.repeat, lambda: legacy_aggregate(legacy_convert(objects)))
+    lean_total, lean_result = best_of(args.repeat, lambda: _generate_from_chunks(lean_convert(objects)))
+
+    lean_message = lean_result.generations[0].message
+    assert lean_message.content == legacy_message.content, "content differs between paths"
+    assert lean_message.additional_kwargs.get("reasoning_content") == legacy_message.additional_kwargs.get(
+        "reasoning_content"
+    ), "reasoning differs between paths"
+
+    print(f"{n} chunks replayed ({len(legacy_chunks)} legacy / {len(lean_chunks)} lean generation chunks)")
+    print(f"{'path':<10}{'convert us/chunk':>20}{'convert+aggregate us/chunk':>30}")
+    print(f"{'legacy':<10}{legacy_t / n * 1e6:>20.2f}{legacy_total / n * 1e6:>30.2f}")
+    print(f"{'lean':<10}{lean_t / n * 1e6:>20.2f}{lean_total / n * 1e6:>30.2f}")
+    print(f"speedup: convert x{legacy_t / lean_t:.2f}, convert+aggregate x{legacy_total / lean_total:.2f}")
+
+
+if __name__ == "__main__":
+    main()
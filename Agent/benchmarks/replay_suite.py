@@ -0,0 +1,180 @@
+"""
+Offline LLM benchmark suite on recorded provider responses (see src/llms/replay.py).
+
+Record fixtures once against the real endpoints, e.g. by running the agents with
+
+    LLM_HTTP_REPLAY=record LLM_HTTP_FIXTURES=fixtures/llm python main.py ...
+
+then replay every recorded streaming call with no network:
+
+    - parse overhead   client + chunk conversion cost per chunk (no delays), compared with just
+                       reading the raw SSE bytes
+    - agent latency    time to first token and total time of a tool-less ReAct agent turn, with
+                       the original or compressed inter-chunk timing
+    - throughput       chunks/s and calls/s with ``--concurrency`` concurrent async streams
+
+Usage (from the Agent directory):
+    python benchmarks/replay_suite.py --fixtures fixtures/llm [--timing compressed] [--speedup 10]
+        [--concurrency 32] [--repeat 3]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+from langchain_core.messages import convert_to_messages  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+from langgraph.prebuilt import create_react_agent  # noqa: E402
+
+from src.llms.providers.dashscope import ChatDashscope  # noqa: E402
+from src.llms.replay import FixtureStore, ReplayConfig, _AsyncReplayStream, _ReplayStream  # noqa: E402
+
+
+class _FixedTransport(httpx.BaseTransport):
+    """Serves one recorded response to every request."""
+
+    def __init__(self, response, config):
+        self.response = response
+        self.config = config
+
+    def handle_request(self, request):
+        request.read()
+        r = self.response
+        return httpx.Response(r["status_code"], headers=r["headers"], stream=_ReplayStream(r["chunks"], self.config), request=request)
+
+
+class _AsyncFixedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, response, config):
+        self.response = response
+        self.config = config
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        r = self.response
+        return httpx.Response(
+            r["status_code"], headers=r["headers"], stream=_AsyncReplayStream(r["chunks"], self.config), request=request
+        )
+
+
+def build_model(interaction, config):
+    request, response = interaction["request"], interaction["response"]
+    base_url = request["url"].rsplit("/chat/completions", 1)[0]
+    model_class = ChatDashscope if "dashscope." in base_url else ChatOpenAI
+    return model_class(
+        model=request["body"].get("model"),
+        api_key="replay",
+        base_url=base_url,
+        streaming=True,
+        max_retries=0,
+        http_client=httpx.Client(transport=_FixedTransport(response, config)),
+        http_async_client=httpx.AsyncClient(transport=_AsyncFixedTransport(response, config)),
+    )
+
+
+def raw_read_seconds(response):
+    """Baseline: iterate the recorded bytes and split the SSE events, without a client."""
+    started = time.perf_counter()
+    buffer = b""
+    events = 0
+    for _, data in response["chunks"]:
+        buffer += data.encode("utf-8", "surrogateescape")
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"data:") and line.strip() != b"data: [DONE]":
+                json.loads(line[5:])
+                events += 1
+    return time.perf_counter() - started, events
+
+
+def bench_parse(interaction, repeat):
+    model = build_model(interaction, ReplayConfig(timing="none"))
+    messages = convert_to_messages(interaction["request"]["body"]["messages"])
+    best, chunks = float("inf"), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = sum(1 for _ in model.stream(messages))
+        best = min(best, time.perf_counter() - started)
+    raw, events = raw_read_seconds(interaction["response"])
+    return {"events": events, "chunks": chunks, "client_us_per_event": best / max(events, 1) * 1e6,
+            "raw_us_per_event": raw / max(events, 1) * 1e6}
+
+
+def bench_agent(interaction, config, repeat):
+    model = build_model(interaction, config)
+    agent = create_react_agent(model, tools=[])
+    messages = convert_to_messages(
+        [m for m in interaction["request"]["body"]["messages"] if m.get("role") != "system"]
+    )
+    ttfts, totals = [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        first = None
+        for _ in agent.stream({"messages": messages}, stream_mode="messages"):
+            if first is None:
+                first = time.perf_counter() - started
+        totals.append(time.perf_counter() - started)
+        ttfts.append(first or totals[-1])
+    return {"ttft": statistics.median(ttfts), "total": statistics.median(totals)}
+
+
+async def bench_throughput(interaction, config, concurrency):
+    model = build_model(interaction, config)
+    messages = convert_to_messages(interaction["request"]["body"]["messages"])
+
+    async def one():
+        return sum([1 async for _ in model.astream(messages)])
+
+    started = time.perf_counter()
+    chunks = await asyncio.gather(*(one() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"calls_per_s": concurrency / elapsed, "chunks_per_s": sum(chunks) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default="fixtures/llm")
+    parser.add_argument("--timing", default="compressed", choices=["original", "compressed", "none"])
+    parser.add_argument("--speedup", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print one JSON line per fixture")
+    args = parser.parse_args()
+
+    config = ReplayConfig(mode="replay", fixtures_dir=args.fixtures, timing=args.timing, speedup=args.speedup)
+    store = FixtureStore(args.fixtures)
+    streaming = [
+        (key, interaction) for key, interaction in store.interactions()
+        if isinstance(interaction["request"].get("body"), dict) and interaction["request"]["body"].get("stream")
+        and interaction["response"]["status_code"] == 200
+    ]
+    if not streaming:
+        sys.exit(f"No recorded streaming calls in {args.fixtures}; record some with LLM_HTTP_REPLAY=record first.")
+
+    for key, interaction in streaming:
+        result = {
+            "fixture": key,
+            "model": interaction["request"]["body"].get("model"),
+            **bench_parse(interaction, args.repeat),
+            **bench_agent(interaction, config, args.repeat),
+            **asyncio.run(bench_throughput(interaction, config, args.concurrency)),
+        }
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{key[:12]} {result['model']:<20} events={result['events']:<6} "
+                f"parse={result['client_us_per_event']:.1f}us/event (raw {result['raw_us_per_event']:.1f}) "
+                f"ttft={result['ttft'] * 1000:.1f}ms total={result['total'] * 1000:.1f}ms "
+                f"throughput={result['calls_per_s']:.1f} calls/s {result['chunks_per_s']:.0f} chunks/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,9 @@ from langgraph.prebuilt import create_react_agent
 from .tool_interceptor import wrap_tools_with_interceptor
 
 from src.config.agents import AGENT_LLM_MAP
-from src.llms.llm import get_llm_by_type
+from src.llms.llm import get_llm_for_agent
 from src.prompts import apply_prompt_template
+from src.utils.context_manager import get_pre_model_hook
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +32,8 @@ def create_agent(
         agent_type: agent的类型（用于映射LLM类型），跟 src\config\AGENT_LLM_MAP 中的key对应
         tools: agent可用的工具列表 （取决于自己定了哪些工具）
         prompt_template: 要使用的提示模板的名称 （根据 src\prompts\ 中的md文件）
-        pre_model_hook: 可选的hook，用于在模型调用之前预处理状态
+        pre_model_hook: 可选的hook，用于在模型调用之前预处理状态。
+            不传时默认按该LLM类型的token上限裁剪消息（src/utils/context_manager.py）
         interrupt_before_tools: 需要在执行前中断的工具名单（可选，自定义）
 
     Returns:
@@ -66,12 +68,16 @@ def create_agent(
     # 根据agent 类型获取对应的LLM类型，默认使用 "basic"
     llm_type = AGENT_LLM_MAP.get(agent_type, "basic")
     logger.debug(f"Agent '{agent_name}' using LLM type: {llm_type}")
+
+    # 默认的 pre_model_hook：调用模型前把消息裁剪到模型的上下文上限以内
+    if pre_model_hook is None:
+        pre_model_hook = get_pre_model_hook(llm_type)
     
     logger.debug(f"Creating ReAct agent '{agent_name}'")
     # 只用LangGraph创建agent，传入包装后的加入了中断逻辑工具列表（如需中断），不需要中断则传入的是没有中断逻辑工具列表  
     agent = create_react_agent(
         name=agent_name,
-        model=get_llm_by_type(llm_type),
+        model=get_llm_for_agent(agent_type, agent_name),
         tools=processed_tools,
         prompt=lambda state: apply_prompt_template(
             prompt_template, state, locale=state.get("locale", "en-US")
@@ -0,0 +1,21 @@
+from .loader import (
+    ConfigSnapshot,
+    clear_config_cache,
+    freeze_config,
+    get_config_file_path,
+    get_config_service,
+    get_config_snapshot,
+    load_yaml_config,
+    subscribe_config,
+)
+
+__all__ = [
+    "ConfigSnapshot",
+    "clear_config_cache",
+    "freeze_config",
+    "get_config_file_path",
+    "get_config_service",
+    "get_config_snapshot",
+    "load_yaml_config",
+    "subscribe_config",
+]
@@ -1,8 +1,16 @@
+import logging
 import os
-from typing import Any, Dict
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
 
 import yaml
 
+logger = logging.getLogger(__name__)
+
 
 def get_bool_env(name: str, default: bool = False) -> bool:
     val = os.getenv(name)
@@ -37,39 +45,213 @@ def replace_env_vars(value: str) -> str:
     return value
 
 
+def process_value(value: Any) -> Any:
+    """Replace environment variables in a value, recursing into dicts and lists."""
+    if isinstance(value, dict):
+        return process_dict(value)
+    if isinstance(value, list):
+        return [process_value(item) for item in value]
+    if isinstance(value, str):
+        return replace_env_vars(value)
+    return value
+
+
 def process_dict(config: Dict[str, Any]) -> Dict[str, Any]:
     """Recursively process dictionary to replace environment variables."""
     if not config:
         return {}
-    result = {}
-    for key, value in config.items():
-        if isinstance(value, dict):
-            result[key] = process_dict(value)
-        elif isinstance(value, str):
-            result[key] = replace_env_vars(value)
-        else:
-            result[key] = value
-    return result
+    return {key: process_value(value) for key, value in config.items()}
 
 
-_config_cache: Dict[str, Dict[str, Any]] = {}
+def freeze_config(value: Any) -> Any:
+    """递归地把 dict 变成只读的 MappingProxyType、list 变成 tuple，快照里的配置任何一层都不能被修改。"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_config(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_config(item) for item in value)
+    return value
 
 
-def load_yaml_config(file_path: str) -> Dict[str, Any]:
-    """加载和处理YAML配置文件。"""
-    # 如果文件不存在，返回{}
-    if not os.path.exists(file_path):
-        return {}
+def get_float_env(name: str, default: float = 0.0) -> float:
+    val = os.getenv(name)
+    if val is None:
+        return default
+    try:
+        return float(val.strip())
+    except ValueError:
+        print(f"Invalid float value for {name}: {val}. Using default {default}.")
+        return default
+
+
+def get_config_file_path() -> str:
+    """Agent 的 conf.yaml 的路径（和工作目录无关）"""
+    return str((Path(__file__).parent.parent.parent / "conf.yaml").resolve())
+
+
+def normalize_config_path(file_path: str) -> str:
+    """统一配置文件路径（绝对路径、解析符号链接），同一个文件无论怎么写路径都只对应一个缓存项。"""
+    return os.path.realpath(os.path.abspath(os.path.expanduser(file_path)))
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    某个配置文件某一次加载的结果，文件变化后生成新的快照（version 加 1）。
+    data 整个是只读的（见 freeze_config：各层 dict 都是 MappingProxyType，list 是 tuple），
+    所有读者共享同一份，需要修改时先复制，例如 {**conf["BASIC_MODEL"], ...}。
+    """
+
+    path: str
+    version: int
+    data: Mapping[str, Any]
+    # (mtime_ns, size, inode)，文件不存在时为 None
+    signature: Optional[Tuple[int, int, int]] = None
+
+
+ConfigSubscriber = Callable[[ConfigSnapshot, Optional[ConfigSnapshot]], None]
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ConfigService:
+    """
+    配置文件服务：
+        - 按规范化后的路径缓存每个文件的快照
+        - 距上次检查超过 check_interval 秒后才 stat 文件，文件变化（mtime/大小/inode）时重新加载，
+          加载完成后整体替换快照，读者要么拿到旧快照要么拿到新快照
+        - 订阅者在文件内容变化时收到 (新快照, 旧快照)；有订阅者时后台线程按 check_interval 轮询，
+          没有读取也能及时通知
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._snapshots: Dict[str, ConfigSnapshot] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._subscribers: List[Tuple[Optional[str], ConfigSubscriber]] = []
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _load(self, path: str, signature: Optional[Tuple[int, int, int]], version: int) -> ConfigSnapshot:
+        if signature is None:
+            return ConfigSnapshot(path, version, MappingProxyType({}), None)
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+        return ConfigSnapshot(path, version, freeze_config(process_dict(config)), signature)
+
+    def get(self, file_path: str) -> ConfigSnapshot:
+        """当前快照；检查间隔内直接返回缓存，不访问文件系统。"""
+        path = normalize_config_path(file_path)
+        snapshot = self._snapshots.get(path)
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at.get(path, float("-inf")) < self.check_interval:
+            return snapshot
+        return self._refresh(path, now)
+
+    def _refresh(self, path: str, now: float) -> ConfigSnapshot:
+        signature = _file_signature(path)
+        with self._lock:
+            previous = self._snapshots.get(path)
+            if previous is not None and previous.signature == signature:
+                self._checked_at[path] = now
+                return previous
+            try:
+                snapshot = self._load(path, signature, previous.version + 1 if previous else 1)
+            except (OSError, yaml.YAMLError) as e:
+                if previous is None:
+                    raise
+                # 文件正在被写入或内容有误时继续使用旧快照，下个检查周期再试
+                logger.warning(f"Failed to reload config {path}, keeping version {previous.version}: {e}")
+                self._checked_at[path] = now
+                return previous
+            self._snapshots[path] = snapshot
+            self._checked_at[path] = now
+            subscribers = [cb for p, cb in self._subscribers if p is None or p == path]
+        if previous is not None:
+            self._notify(subscribers, snapshot, previous)
+        return snapshot
+
+    def _notify(self, subscribers: List[ConfigSubscriber], snapshot: ConfigSnapshot, previous: ConfigSnapshot) -> None:
+        for callback in subscribers:
+            try:
+                callback(snapshot, previous)
+            except Exception:
+                logger.exception(f"Config subscriber {callback!r} failed for {snapshot.path}")
+
+    def invalidate(self, file_path: Optional[str] = None) -> None:
+        """下次读取时重新加载文件（file_path 为空时所有文件），生成新版本。"""
+        with self._lock:
+            paths = list(self._snapshots) if file_path is None else [normalize_config_path(file_path)]
+            for path in paths:
+                self._checked_at.pop(path, None)
+                if path in self._snapshots:
+                    # 清掉文件签名，下次检查时一定会重新加载
+                    self._snapshots[path] = replace(self._snapshots[path], signature=None)
+
+    def subscribe(self, callback: ConfigSubscriber, file_path: Optional[str] = None) -> Callable[[], None]:
+        """订阅配置变化（file_path 为空时订阅所有文件），返回取消订阅的函数。"""
+        path = normalize_config_path(file_path) if file_path else None
+        entry = (path, callback)
+        with self._lock:
+            self._subscribers.append(entry)
+            if path is not None and path not in self._snapshots:
+                # 记下这个文件，使轮询线程从现在开始关注它
+                self._checked_at[path] = float("-inf")
+            self._start_watcher()
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return unsubscribe
+
+    def _start_watcher(self) -> None:
+        if self._watcher is not None or self.check_interval <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.check_interval)
+            with self._lock:
+                paths = set(self._checked_at) | set(self._snapshots)
+            for path in paths:
+                try:
+                    self._refresh(path, time.monotonic())
+                except Exception:
+                    logger.exception(f"Failed to check config {path}")
+
+
+# 全局配置服务，检查间隔可以用 CONFIG_CHECK_INTERVAL 环境变量调整（秒）
+_config_service = ConfigService(get_float_env("CONFIG_CHECK_INTERVAL", 1.0))
+
+
+def get_config_service() -> ConfigService:
+    return _config_service
+
+
+def get_config_snapshot(file_path: str) -> ConfigSnapshot:
+    """配置文件当前的快照（带版本号）。"""
+    return _config_service.get(file_path)
+
+
+def load_yaml_config(file_path: str) -> Mapping[str, Any]:
+    """加载和处理YAML配置文件，返回只读的配置（见 freeze_config）；文件不存在时返回空配置。"""
+    return _config_service.get(file_path).data
+
 
-    # 检查缓存中是否已存在配置
-    if file_path in _config_cache:
-        return _config_cache[file_path]
+def subscribe_config(callback: ConfigSubscriber, file_path: Optional[str] = None) -> Callable[[], None]:
+    """配置文件内容变化时调用 callback(新快照, 旧快照)，返回取消订阅的函数。"""
+    return _config_service.subscribe(callback, file_path)
 
-    # 如果缓存中不存在，则加载并处理配置
-    with open(file_path, "r") as f:
-        config = yaml.safe_load(f)
-    processed_config = process_dict(config)
 
-    # 将处理后的配置存入缓存
-    _config_cache[file_path] = processed_config
-    return processed_config
\ No newline at end of file
+def clear_config_cache(file_path: Optional[str] = None) -> None:
+    """清除配置缓存，下次 load_yaml_config 时重新读取文件。file_path 为空时清除全部。"""
+    _config_service.invalidate(file_path)
@@ -0,0 +1,359 @@
+"""
+Batch / offline execution mode for non-interactive agents.
+
+Agents whose latency does not matter (podcast_script_writer, prose_writer, ppt_composer, ...) can
+send their calls through a ``BatchExecutor`` instead of the interactive endpoint. Calls are
+accumulated and submitted together, and every caller gets a ``concurrent.futures.Future`` that is
+resolved when the batch result comes back:
+
+    - ``OpenAIBatchProvider``  OpenAI compatible Batch API (JSONL upload + /v1/batches + polling)
+    - ``LocalQueueProvider``   for providers without a batch API: a concurrency-limited local queue
+    - ``MockBatchProvider``    deterministic in-process provider for tests and dry runs
+
+Configured in conf.yaml:
+
+    BATCH_MODE:
+      agents: [podcast_script_writer, prose_writer, ppt_composer]
+      provider: openai                  # openai | local | mock
+      max_batch_size: 100               # submit once this many calls are queued ...
+      max_wait: 5                       # ... or once the oldest queued call is this old (seconds)
+      poll_interval: 30                 # seconds between status checks of submitted batches
+      max_concurrency: 4                # local provider only
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+# One queued call: (custom_id, request body, future of the raw response dict)
+BatchItem = Tuple[str, Dict[str, Any], Future]
+
+
+class BatchProvider:
+    """Submits a list of chat-completion request bodies and later returns their results."""
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        """Submit ``(custom_id, body)`` pairs and return a batch id."""
+        raise NotImplementedError
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """None while the batch is running; afterwards custom_id -> response dict or Exception."""
+        raise NotImplementedError
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI compatible Batch API (also offered by DashScope)."""
+
+    def __init__(self, client: Any, endpoint: str = "/v1/chat/completions", completion_window: str = "24h"):
+        self.client = client
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": self.endpoint, "body": body}, ensure_ascii=False)
+            for custom_id, body in requests
+        ]
+        batch_file = self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id, endpoint=self.endpoint, completion_window=self.completion_window
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        results: Dict[str, Any] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code", 200) >= 400:
+                    results[record["custom_id"]] = RuntimeError(
+                        f"Batch request failed: {record.get('error') or response.get('body')}"
+                    )
+                else:
+                    results[record["custom_id"]] = response["body"]
+        if batch.status != "completed" and not results:
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'")
+        return results
+
+
+class LocalQueueProvider(BatchProvider):
+    """
+    For providers without a batch API: runs the queued requests on a local pool with at most
+    ``max_concurrency`` calls in flight, so offline work never floods the interactive quota.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Dict[str, Any]], max_concurrency: int = 4):
+        self.send = send
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-batch")
+        self._batches: Dict[str, List[Tuple[str, Future]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        batch_id = f"local-{uuid.uuid4().hex}"
+        with self._lock:
+            self._batches[batch_id] = [(custom_id, self._pool.submit(self.send, body)) for custom_id, body in requests]
+        return batch_id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            futures = self._batches[batch_id]
+            if not all(future.done() for _, future in futures):
+                return None
+            del self._batches[batch_id]
+        return {custom_id: future.exception() or future.result() for custom_id, future in futures}
+
+
+class MockBatchProvider(BatchProvider):
+    """
+    In-process provider for tests: every request completes after ``completion_delay`` seconds
+    with the text returned by ``respond(body)`` (by default an echo of the last message).
+    """
+
+    def __init__(self, respond: Optional[Callable[[Dict[str, Any]], str]] = None, completion_delay: float = 0.0):
+        self.respond = respond or (lambda body: f"mock: {body['messages'][-1]['content']}")
+        self.completion_delay = completion_delay
+        self.submitted: List[List[Tuple[str, Dict[str, Any]]]] = []
+        self._batches: Dict[str, Tuple[float, List[Tuple[str, Dict[str, Any]]]]] = {}
+
+    def submit(self, requests: List[Tuple[str, Dict[str, Any]]]) -> str:
+        batch_id = f"mock-{len(self.submitted)}"
+        self.submitted.append(list(requests))
+        self._batches[batch_id] = (time.monotonic() + self.completion_delay, list(requests))
+        return batch_id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        ready_at, requests = self._batches[batch_id]
+        if time.monotonic() < ready_at:
+            return None
+        del self._batches[batch_id]
+        results = {}
+        for custom_id, body in requests:
+            try:
+                content = self.respond(body)
+            except Exception as e:
+                results[custom_id] = e
+                continue
+            results[custom_id] = {
+                "id": f"chatcmpl-{custom_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        return results
+
+
+class BatchExecutor:
+    """
+    Accumulates request bodies, submits them to ``provider`` in batches and resolves the callers'
+    futures with the raw response dicts when the batch finishes.
+    """
+
+    def __init__(
+        self, provider: BatchProvider, max_batch_size: int = 100, max_wait: float = 5.0, poll_interval: float = 30.0
+    ):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self._queue: List[BatchItem] = []
+        self._oldest: Optional[float] = None
+        self._running: Dict[str, Dict[str, Future]] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def submit(self, body: Dict[str, Any]) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BatchExecutor is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="llm-batch-executor", daemon=True)
+                self._thread.start()
+            self._queue.append((uuid.uuid4().hex, body, future))
+            self._oldest = self._oldest or time.monotonic()
+            self._condition.notify_all()
+        return future
+
+    def flush(self) -> None:
+        """Submit whatever is queued now instead of waiting for max_batch_size / max_wait."""
+        with self._condition:
+            self._oldest = float("-inf") if self._queue else None
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def pending(self) -> Dict[str, int]:
+        with self._condition:
+            return {"queued": len(self._queue), "running": sum(len(v) for v in self._running.values())}
+
+    def _loop(self) -> None:
+        last_poll = 0.0
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = bool(self._queue) and (
+                    len(self._queue) >= self.max_batch_size or self._closed or now - self._oldest >= self.max_wait
+                )
+                if not due:
+                    if self._closed and not self._queue and not self._running:
+                        return
+                    waits = [self.poll_interval - (now - last_poll)] if self._running else []
+                    if self._queue:
+                        waits.append(self.max_wait - (now - self._oldest))
+                    self._condition.wait(timeout=max(min(waits), 0.01) if waits else None)
+                batch: List[BatchItem] = []
+                if due:
+                    batch, self._queue = self._queue[: self.max_batch_size], self._queue[self.max_batch_size:]
+                    self._oldest = time.monotonic() if self._queue else None
+            if batch:
+                self._submit(batch)
+            if self._running and time.monotonic() - last_poll >= self.poll_interval:
+                last_poll = time.monotonic()
+                self._poll()
+
+    def _submit(self, batch: List[BatchItem]) -> None:
+        try:
+            batch_id = self.provider.submit([(custom_id, body) for custom_id, body, _ in batch])
+        except Exception as e:
+            logger.error(f"Batch submission of {len(batch)} requests failed: {e}")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        logger.info(f"Submitted batch {batch_id} with {len(batch)} requests")
+        with self._condition:
+            self._running[batch_id] = {custom_id: future for custom_id, _, future in batch}
+
+    def _poll(self) -> None:
+        with self._condition:
+            batch_ids = list(self._running)
+        for batch_id in batch_ids:
+            try:
+                results = self.provider.poll(batch_id)
+            except Exception as e:
+                results = {custom_id: e for custom_id in self._running[batch_id]}
+            if results is None:
+                continue
+            with self._condition:
+                futures = self._running.pop(batch_id)
+            for custom_id, future in futures.items():
+                result = results.get(custom_id, RuntimeError(f"No result for request {custom_id} in batch {batch_id}"))
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def provider_model(llm: BaseChatModel) -> BaseChatModel:
+    """The provider model under any number of wrappers (its client and request format are used directly)."""
+    while isinstance(llm, DelegatingChatModel):
+        llm = llm.delegate()
+    return llm
+
+
+class BatchChatModel(DelegatingChatModel):
+    """
+    Sends every call of ``inner`` (an OpenAI compatible chat model) through ``executor``.
+    ``invoke`` blocks until the batch result arrives; ``submit`` returns the future directly so a
+    pipeline can enqueue many calls at once. Streaming is disabled in this mode.
+    """
+
+    executor: BatchExecutor
+    disable_streaming: bool = True
+
+    def _request_body(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        body = provider_model(self.inner)._get_request_payload(messages, stop=stop, **kwargs)
+        body.pop("stream", None)
+        body.pop("stream_options", None)
+        return body
+
+    def _to_result(self, response: Dict[str, Any]) -> ChatResult:
+        return provider_model(self.inner)._create_chat_result(response)
+
+    def submit(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, **kwargs: Any) -> "Future[ChatResult]":
+        """Queue a call and return a future of its ChatResult."""
+        raw = self.executor.submit(self._request_body(messages, stop, kwargs))
+        result: Future = Future()
+
+        def convert(done: Future) -> None:
+            try:
+                result.set_result(self._to_result(done.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        raw.add_done_callback(convert)
+        return result
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.submit(messages, stop=stop, **kwargs).result()
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await asyncio.wrap_future(self.submit(messages, stop=stop, **kwargs))
+
+
+def create_batch_executor(conf: Dict[str, Any], model: BaseChatModel) -> BatchExecutor:
+    """Executor for the BATCH_MODE section of conf.yaml, sending requests with ``model``'s client."""
+    client = getattr(provider_model(model), "root_client", None)
+    provider_name = str(conf.get("provider", "local")).lower()
+    if provider_name in ("openai", "local") and client is None:
+        raise ValueError(f"BATCH_MODE provider '{provider_name}' needs an OpenAI compatible model")
+    if provider_name == "openai":
+        provider: BatchProvider = OpenAIBatchProvider(client)
+    elif provider_name == "mock":
+        provider = MockBatchProvider()
+    elif provider_name == "local":
+        provider = LocalQueueProvider(
+            lambda body: client.chat.completions.create(**body).model_dump(),
+            max_concurrency=int(conf.get("max_concurrency", 4)),
+        )
+    else:
+        raise ValueError(f"Unknown BATCH_MODE provider: {provider_name}")
+    return BatchExecutor(
+        provider,
+        max_batch_size=int(conf.get("max_batch_size", 100)),
+        max_wait=float(conf.get("max_wait", 5)),
+        poll_interval=float(conf.get("poll_interval", 30 if provider_name == "openai" else 0.2)),
+    )
@@ -0,0 +1,291 @@
+"""
+Single-flight request coalescing for identical concurrent LLM calls.
+
+When parallel graph nodes send byte-identical requests at the same moment (same messages, model,
+stop words and call parameters such as bound tools), only the first one goes upstream and the
+others wait for its result. Streaming calls are coalesced too: the first caller drives the
+upstream stream and every chunk is fanned out to the other callers (late joiners replay the
+chunks received so far), each of which reports the tokens to its own callbacks.
+
+Only requests that are in flight at the same time are merged; this is not a cache. Enable it per
+``*_MODEL`` block in conf.yaml with ``coalesce_requests: true``.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage, messages_to_dict
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+
+def make_request_key(
+    model_params: Dict[str, Any], messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]
+) -> str:
+    """sha256 of the canonical JSON of everything that influences the upstream request."""
+    payload = json.dumps(
+        {"model": model_params, "messages": messages_to_dict(messages), "stop": stop, "kwargs": kwargs},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _copy_chunk(chunk: ChatGenerationChunk) -> ChatGenerationChunk:
+    # BaseChatModel.stream sets id/metadata on the message, so every caller (the leader included,
+    # whose chunks are copied before they are yielded to it) needs its own object
+    return ChatGenerationChunk(message=chunk.message.model_copy(), generation_info=chunk.generation_info)
+
+
+class _Broadcast:
+    """Chunks of one upstream stream, replayable by any number of subscribers."""
+
+    def __init__(self):
+        self.chunks: List[ChatGenerationChunk] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+
+
+class CoalescingChatModel(DelegatingChatModel):
+    """Merges identical in-flight calls to ``inner`` into one upstream call."""
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _calls: Dict[str, Future] = PrivateAttr(default_factory=dict)
+    _streams: Dict[str, _Broadcast] = PrivateAttr(default_factory=dict)
+    _stream_condition: threading.Condition = PrivateAttr(default_factory=threading.Condition)
+    _astreams: Dict[tuple, _Broadcast] = PrivateAttr(default_factory=dict)
+    _astream_conditions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Condition]" = PrivateAttr(
+        default_factory=weakref.WeakKeyDictionary
+    )
+    _coalesced: int = PrivateAttr(default=0)
+
+    @property
+    def coalesced_count(self) -> int:
+        """How many calls were served by another caller's upstream request."""
+        return self._coalesced
+
+    def _key(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        return make_request_key(self.delegate()._identifying_params, messages, stop, kwargs)
+
+    def _join_call(self, key: str) -> tuple:
+        """Returns (future, is_leader)."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish_call(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # ------------------------------------------------------------------ non-streaming
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        future, leader = self._join_call(key)
+        if not leader:
+            return future.result().model_copy(deep=True)
+        try:
+            result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as e:
+            self._finish_call(key, future, error=e)
+            raise
+        self._finish_call(key, future, result.model_copy(deep=True))
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        future, leader = self._join_call(key)
+        if not leader:
+            return (await asyncio.wrap_future(future)).model_copy(deep=True)
+        try:
+            result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as e:
+            self._finish_call(key, future, error=e)
+            raise
+        self._finish_call(key, future, result.model_copy(deep=True))
+        return result
+
+    # ------------------------------------------------------------------ streaming
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, kwargs)
+        condition = self._stream_condition
+        with condition:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+            else:
+                self._coalesced += 1
+                broadcast.subscribers += 1
+
+        if leader:
+            yield from self._lead_stream(key, broadcast, messages, stop, run_manager, kwargs)
+            return
+
+        index = 0
+        try:
+            while True:
+                with condition:
+                    condition.wait_for(lambda: index < len(broadcast.chunks) or broadcast.done)
+                    pending = broadcast.chunks[index:]
+                    done, error = broadcast.done, broadcast.error
+                for chunk in pending:
+                    index += 1
+                    chunk = _copy_chunk(chunk)
+                    if run_manager:
+                        run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+                if done and index >= len(broadcast.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with condition:
+                broadcast.subscribers -= 1
+
+    def _lead_stream(self, key, broadcast, messages, stop, run_manager, kwargs) -> Iterator[ChatGenerationChunk]:
+        condition = self._stream_condition
+        iterator = self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            for chunk in iterator:
+                with condition:
+                    broadcast.chunks.append(_copy_chunk(chunk))
+                    condition.notify_all()
+                yield chunk
+        except GeneratorExit:
+            # Our caller stopped reading; keep draining the upstream for the other subscribers
+            with condition:
+                followers = broadcast.subscribers
+            if followers:
+                try:
+                    for chunk in iterator:
+                        with condition:
+                            broadcast.chunks.append(_copy_chunk(chunk))
+                            condition.notify_all()
+                except Exception as e:
+                    broadcast.error = e
+            raise
+        except BaseException as e:
+            broadcast.error = e
+            raise
+        finally:
+            with condition:
+                broadcast.done = True
+                self._streams.pop(key, None)
+                condition.notify_all()
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # Async subscribers share an asyncio.Condition, so they are only merged within one event loop;
+        # the same model is used from the event loops of several threads, hence the thread lock
+        loop = asyncio.get_running_loop()
+        key = (self._key(messages, stop, kwargs), id(loop))
+        with self._lock:
+            condition = self._astream_conditions.get(loop)
+            if condition is None:
+                condition = self._astream_conditions[loop] = asyncio.Condition()
+            broadcast = self._astreams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._astreams[key] = _Broadcast()
+            else:
+                self._coalesced += 1
+                broadcast.subscribers += 1
+
+        if leader:
+            iterator = self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            try:
+                async for chunk in iterator:
+                    async with condition:
+                        broadcast.chunks.append(_copy_chunk(chunk))
+                        condition.notify_all()
+                    yield chunk
+            except GeneratorExit:
+                with self._lock:
+                    followers = broadcast.subscribers
+                if followers:
+                    try:
+                        async for chunk in iterator:
+                            async with condition:
+                                broadcast.chunks.append(_copy_chunk(chunk))
+                                condition.notify_all()
+                    except Exception as e:
+                        broadcast.error = e
+                raise
+            except BaseException as e:
+                broadcast.error = e
+                raise
+            finally:
+                broadcast.done = True
+                with self._lock:
+                    self._astreams.pop(key, None)
+                async with condition:
+                    condition.notify_all()
+            return
+
+        index = 0
+        try:
+            while True:
+                async with condition:
+                    await condition.wait_for(lambda: index < len(broadcast.chunks) or broadcast.done)
+                pending = broadcast.chunks[index:]
+                done, error = broadcast.done, broadcast.error
+                for chunk in pending:
+                    index += 1
+                    chunk = _copy_chunk(chunk)
+                    if run_manager:
+                        await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+                if done and index >= len(broadcast.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._lock:
+                broadcast.subscribers -= 1
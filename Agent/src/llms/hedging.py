@@ -0,0 +1,512 @@
+"""
+Hedged requests for latency-critical agents.
+
+A call is first sent to one endpoint. If it has not produced its first token (or, for
+non-streaming calls, its result) after a delay taken from a high percentile of that endpoint's
+recent latencies, a duplicate is sent to another endpoint (or, with a single endpoint, sent again)
+and whichever answers first wins; the other attempt is cancelled. Failed attempts are replaced
+immediately, so hedging also hides a single failing endpoint.
+
+Latencies are kept in a ``LatencyHistogram`` per endpoint and call kind (``ttft`` for streams,
+``generate`` otherwise), shared by every model in the process. A losing attempt is recorded with
+its elapsed time when it is cancelled (a censored sample: its real latency is at least that long),
+otherwise the slow tail would never be seen and the hedge delay would drift lower and lower.
+Enabled per agent in conf.yaml:
+
+    HEDGING:
+      agents: [coordinator, planner]
+      percentile: 95        # hedge once an attempt is slower than this percentile ...
+      min_delay: 0.2        # ... but never earlier / later than these bounds (seconds)
+      max_delay: 10
+      default_delay: 2      # used until min_samples latencies have been recorded
+      min_samples: 20
+      max_hedges: 1         # extra attempts per call
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from src.llms.router import Endpoint, RoutedChatModel, is_retryable_error
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+# Worker threads for the sync API; every attempt of a sync call runs on one of them
+_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-hedge")
+
+# Marks the end of an attempt's stream
+_DONE = object()
+
+
+class LatencyHistogram:
+    """
+    Log-spaced latency histogram (1 ms to 10 min, about 12% bucket width). Once ``max_samples``
+    latencies have been recorded all counts are halved, so the percentiles follow recent behaviour.
+    """
+
+    def __init__(self, buckets_per_decade: int = 20, max_samples: int = 10000):
+        decades = math.log10(600.0 / 0.001)
+        self.bounds = [0.001 * 10 ** (i / buckets_per_decade) for i in range(int(decades * buckets_per_decade) + 1)]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            if self.total >= self.max_samples:
+                self.counts = [count // 2 for count in self.counts]
+                self.total = sum(self.counts)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the p-th percentile, None when empty."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = p / 100.0 * self.total
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[min(index, len(self.bounds) - 1)]
+            return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "count": self.total,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+_histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def get_latency_histogram(endpoint: str, kind: str) -> LatencyHistogram:
+    """Histogram of ``kind`` latencies ("ttft" or "generate") of ``endpoint``."""
+    key = (endpoint, kind)
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = LatencyHistogram()
+        return histogram
+
+
+def get_latency_stats() -> Dict[str, Dict[str, Optional[float]]]:
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {f"{endpoint}:{kind}": histogram.snapshot() for (endpoint, kind), histogram in items}
+
+
+def _model_name(model: BaseChatModel) -> str:
+    return str(getattr(model, "model_name", None) or getattr(model, "model", None) or model._llm_type)
+
+
+class _Attempt:
+    """One copy of a hedged call, sent to ``model`` (an endpoint of ``router`` if there is one)."""
+
+    def __init__(self, index: int, name: str, model: BaseChatModel, router: Optional[RoutedChatModel], endpoint: Optional[Endpoint]):
+        self.index = index
+        self.name = name
+        self.model = model
+        self.router = router
+        self.endpoint = endpoint
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+        self.finished = False
+        self._recorded = False
+        self._lock = threading.Lock()
+
+    def record(self, kind: str) -> None:
+        """Record the elapsed time in the endpoint's ``kind`` histogram (only the first call counts)."""
+        with self._lock:
+            if self._recorded:
+                return
+            self._recorded = True
+        get_latency_histogram(self.name, kind).record(time.monotonic() - self.started)
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        self.finished = True
+        if self.router is not None:
+            self.router._release(self.endpoint, self.started, error, cancelled=self.cancelled.is_set())
+
+
+class _AttemptRunManager:
+    """
+    Run manager handed to every attempt: it carries the run id (queue wait and retry metrics are
+    recorded against it) but drops token callbacks, which the hedged model reports for the winner only.
+    """
+
+    def __init__(self, run_manager: Any):
+        self._run_manager = run_manager
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._run_manager, name)
+
+    def on_llm_new_token(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+class _AsyncAttemptRunManager(_AttemptRunManager):
+    async def on_llm_new_token(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+
+def _attempt_run_manager(run_manager: Any, async_: bool = False) -> Any:
+    if run_manager is None:
+        return None
+    return _AsyncAttemptRunManager(run_manager) if async_ else _AttemptRunManager(run_manager)
+
+
+class HedgedChatModel(DelegatingChatModel):
+    """Sends a duplicate of a slow call to another endpoint and keeps the first answer."""
+
+    percentile: float = 95.0
+    min_delay: float = 0.2
+    max_delay: float = 10.0
+    default_delay: float = 2.0
+    min_samples: int = 20
+    max_hedges: int = 1
+
+    _hedged: int = PrivateAttr(default=0)
+    _hedge_wins: int = PrivateAttr(default=0)
+
+    def hedging_stats(self) -> Dict[str, int]:
+        """How many calls were hedged and how many of them were won by the duplicate."""
+        return {"hedged": self._hedged, "hedge_wins": self._hedge_wins}
+
+    def _router(self) -> Optional[RoutedChatModel]:
+        model = self.inner
+        while isinstance(model, DelegatingChatModel):
+            if isinstance(model, RoutedChatModel):
+                return model
+            model = model.inner
+        return None
+
+    def _start(self, attempts: List[_Attempt]) -> _Attempt:
+        router = self._router()
+        if router is None:
+            attempt = _Attempt(len(attempts), _model_name(self.delegate()), self.inner, None, None)
+        else:
+            # a different endpoint than the running attempts if one is left, otherwise the best one again
+            endpoint = router._acquire([a.endpoint for a in attempts]) or router._acquire([])
+            attempt = _Attempt(len(attempts), endpoint.name, endpoint.model, router, endpoint)
+        if len(attempts) == 1:
+            self._hedged += 1
+        if attempts:
+            logger.debug(f"Hedging LLM call on '{attempt.name}' (attempt {attempt.index + 1})")
+        attempts.append(attempt)
+        return attempt
+
+    def _delay(self, attempt: _Attempt, kind: str) -> float:
+        histogram = get_latency_histogram(attempt.name, kind)
+        value = histogram.percentile(self.percentile) if histogram.total >= self.min_samples else None
+        return min(max(value if value is not None else self.default_delay, self.min_delay), self.max_delay)
+
+    def _won(self, attempts: List[_Attempt], winner: _Attempt, kind: str) -> None:
+        if winner.index > 0:
+            self._hedge_wins += 1
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancelled.set()
+                if not attempt.finished:
+                    # censored sample: the loser has taken at least this long
+                    attempt.record(kind)
+
+    # ------------------------------------------------------------------ non-streaming
+
+    def _run_generate(self, attempt: _Attempt, messages, stop, run_manager, kwargs) -> ChatResult:
+        try:
+            result = attempt.model._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as e:
+            attempt.release(e)
+            raise
+        attempt.record("generate")
+        attempt.release()
+        return result
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        attempts: List[_Attempt] = []
+        running: Dict[Future, _Attempt] = {}
+        attempt_run_manager = _attempt_run_manager(run_manager)
+
+        def launch() -> None:
+            attempt = self._start(attempts)
+            running[_pool.submit(self._run_generate, attempt, messages, stop, attempt_run_manager, kwargs)] = attempt
+
+        launch()
+        hedge_at = time.monotonic() + self._delay(attempts[0], "generate")
+        while True:
+            can_hedge = len(attempts) <= self.max_hedges
+            timeout = max(hedge_at - time.monotonic(), 0.0) if can_hedge else None
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()
+                hedge_at = time.monotonic() + self._delay(attempts[-1], "generate")
+                continue
+            for future in done:
+                attempt = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    self._won(attempts, attempt, "generate")
+                    for loser in running:
+                        loser.cancel()
+                    return future.result()
+                if not is_retryable_error(error) or (not running and not can_hedge):
+                    raise error
+                logger.warning(f"Hedged attempt on '{attempt.name}' failed: {error!r}")
+            if not running:
+                launch()
+
+    async def _arun_generate(self, attempt: _Attempt, messages, stop, run_manager, kwargs) -> ChatResult:
+        try:
+            result = await attempt.model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except asyncio.CancelledError:
+            attempt.cancelled.set()
+            attempt.release()
+            raise
+        except BaseException as e:
+            attempt.release(e)
+            raise
+        attempt.record("generate")
+        attempt.release()
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        attempts: List[_Attempt] = []
+        running: Dict[asyncio.Task, _Attempt] = {}
+        attempt_run_manager = _attempt_run_manager(run_manager, async_=True)
+
+        def launch() -> None:
+            attempt = self._start(attempts)
+            running[
+                asyncio.ensure_future(self._arun_generate(attempt, messages, stop, attempt_run_manager, kwargs))
+            ] = attempt
+
+        launch()
+        hedge_at = time.monotonic() + self._delay(attempts[0], "generate")
+        try:
+            while True:
+                can_hedge = len(attempts) <= self.max_hedges
+                timeout = max(hedge_at - time.monotonic(), 0.0) if can_hedge else None
+                done, _ = await asyncio.wait(list(running), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    hedge_at = time.monotonic() + self._delay(attempts[-1], "generate")
+                    continue
+                for task in done:
+                    attempt = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self._won(attempts, attempt, "generate")
+                        return task.result()
+                    if not is_retryable_error(error) or (not running and not can_hedge):
+                        raise error
+                    logger.warning(f"Hedged attempt on '{attempt.name}' failed: {error!r}")
+                if not running:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+    # ------------------------------------------------------------------ streaming
+
+    def _run_stream(self, attempt: _Attempt, results: queue.Queue, messages, stop, run_manager, kwargs) -> None:
+        iterator = None
+        try:
+            iterator = attempt.model._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            first = True
+            for chunk in iterator:
+                if first:
+                    attempt.record("ttft")
+                    first = False
+                if attempt.cancelled.is_set():
+                    break
+                results.put((attempt.index, chunk))
+            results.put((attempt.index, _DONE))
+        except Exception as e:
+            attempt.release(e)
+            results.put((attempt.index, e))
+            return
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                # closes the upstream HTTP response of a cancelled attempt
+                iterator.close()
+        attempt.release()
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        results: queue.Queue = queue.Queue()
+        attempts: List[_Attempt] = []
+        live = 0
+        attempt_run_manager = _attempt_run_manager(run_manager)
+
+        def launch() -> None:
+            nonlocal live
+            attempt = self._start(attempts)
+            live += 1
+            _pool.submit(self._run_stream, attempt, results, messages, stop, attempt_run_manager, kwargs)
+
+        try:
+            launch()
+            hedge_at = time.monotonic() + self._delay(attempts[0], "ttft")
+            while True:
+                can_hedge = len(attempts) <= self.max_hedges
+                try:
+                    index, item = results.get(timeout=max(hedge_at - time.monotonic(), 0.0) if can_hedge else None)
+                except queue.Empty:
+                    launch()
+                    hedge_at = time.monotonic() + self._delay(attempts[-1], "ttft")
+                    continue
+                if isinstance(item, BaseException):
+                    live -= 1
+                    if not is_retryable_error(item) or (not live and not can_hedge):
+                        raise item
+                    logger.warning(f"Hedged attempt on '{attempts[index].name}' failed: {item!r}")
+                    if not live:
+                        launch()
+                    continue
+                winner = attempts[index]
+                self._won(attempts, winner, "ttft")
+                break
+
+            while item is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                if run_manager:
+                    run_manager.on_llm_new_token(item.text, chunk=item)
+                yield item
+                index, item = results.get()
+                while index != winner.index:
+                    index, item = results.get()
+        finally:
+            for attempt in attempts:
+                attempt.cancelled.set()
+
+    async def _arun_stream(self, attempt: _Attempt, results: asyncio.Queue, messages, stop, run_manager, kwargs) -> None:
+        iterator = attempt.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            first = True
+            async for chunk in iterator:
+                if first:
+                    attempt.record("ttft")
+                    first = False
+                results.put_nowait((attempt.index, chunk))
+            results.put_nowait((attempt.index, _DONE))
+        except asyncio.CancelledError:
+            attempt.cancelled.set()
+            attempt.release()
+            raise
+        except Exception as e:
+            attempt.release(e)
+            results.put_nowait((attempt.index, e))
+            return
+        finally:
+            await iterator.aclose()
+        attempt.release()
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        results: asyncio.Queue = asyncio.Queue()
+        attempts: List[_Attempt] = []
+        tasks: Dict[int, asyncio.Task] = {}
+        live = 0
+        attempt_run_manager = _attempt_run_manager(run_manager, async_=True)
+
+        def launch() -> None:
+            nonlocal live
+            attempt = self._start(attempts)
+            live += 1
+            tasks[attempt.index] = asyncio.ensure_future(
+                self._arun_stream(attempt, results, messages, stop, attempt_run_manager, kwargs)
+            )
+
+        try:
+            launch()
+            hedge_at = time.monotonic() + self._delay(attempts[0], "ttft")
+            while True:
+                can_hedge = len(attempts) <= self.max_hedges
+                timeout = max(hedge_at - time.monotonic(), 0.0) if can_hedge else None
+                try:
+                    index, item = await asyncio.wait_for(results.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    launch()
+                    hedge_at = time.monotonic() + self._delay(attempts[-1], "ttft")
+                    continue
+                if isinstance(item, BaseException):
+                    live -= 1
+                    if not is_retryable_error(item) or (not live and not can_hedge):
+                        raise item
+                    logger.warning(f"Hedged attempt on '{attempts[index].name}' failed: {item!r}")
+                    if not live:
+                        launch()
+                    continue
+                winner = attempts[index]
+                self._won(attempts, winner, "ttft")
+                for loser, task in tasks.items():
+                    if loser != winner.index:
+                        task.cancel()
+                break
+
+            while item is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                if run_manager:
+                    await run_manager.on_llm_new_token(item.text, chunk=item)
+                yield item
+                index, item = await results.get()
+                while index != winner.index:
+                    index, item = await results.get()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+
+def create_hedged_llm(llm: BaseChatModel, conf: Dict[str, Any]) -> HedgedChatModel:
+    """Wrap ``llm`` with the policy of the HEDGING section of conf.yaml."""
+    options = {
+        key: conf[key]
+        for key in ("percentile", "min_delay", "max_delay", "default_delay", "min_samples", "max_hedges")
+        if conf.get(key) is not None
+    }
+    return HedgedChatModel(inner=llm, **options)
@@ -0,0 +1,236 @@
+"""
+Shared, tuned httpx connection pools for all LLM providers.
+
+Every model created by ``_create_llm_use_conf`` that points at the same endpoint reuses one
+``httpx.Client`` / ``httpx.AsyncClient`` pair, so bursts of parallel research calls reuse warm
+TCP/TLS connections instead of opening new ones. Pool limits come from ``conf.yaml``:
+
+    HTTP_POOL:
+      max_connections: 100
+      max_keepalive_connections: 20
+      keepalive_expiry: 30
+      http2: true
+      connect_timeout: 10
+      read_timeout: 120
+
+Each pool records how many requests it served, how many new connections it had to open
+(reuse rate), and how many requests are in flight or still waiting for a free connection.
+The HTTP_REPLAY section can put a record/replay layer in front of the pools (see replay.py).
+"""
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from src.llms.replay import ReplayConfig, wrap_transports
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HttpPoolConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    connect_timeout: float = 10.0
+    read_timeout: float = 120.0
+
+    @classmethod
+    def from_conf(cls, conf: Optional[Dict[str, Any]]) -> "HttpPoolConfig":
+        """Build the pool configuration from the HTTP_POOL section of conf.yaml."""
+        conf = {k.lower(): v for k, v in (conf or {}).items()}
+        unknown = set(conf) - set(cls.__dataclass_fields__)
+        if unknown:
+            logger.warning(f"Ignoring unknown HTTP_POOL keys: {sorted(unknown)}")
+        values = {}
+        for name, field in cls.__dataclass_fields__.items():
+            if conf.get(name) is None:
+                continue
+            value = conf[name]
+            if field.type is bool and isinstance(value, str):
+                value = value.strip().lower() in {"1", "true", "yes", "y", "on"}
+            values[name] = type(field.default)(value)
+        return cls(**values)
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+
+class PoolMetrics:
+    """Counters shared by the sync and async transports of one pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.waiting = 0
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            reuse_rate = 1 - self.new_connections / self.requests if self.requests else 0.0
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "in_use": self.in_flight - self.waiting,
+                "waiting": self.waiting,
+                "reuse_rate": round(max(reuse_rate, 0.0), 4),
+            }
+
+    def _started(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.waiting += 1
+
+    def _event(self, name: str, state: Dict[str, bool]) -> None:
+        # The pool emits no trace events while a request waits for a connection, so the first
+        # event means a connection was assigned; connect_tcp only happens for a new connection.
+        with self._lock:
+            if state["waiting"]:
+                state["waiting"] = False
+                self.waiting -= 1
+            if name == "connection.connect_tcp.started":
+                self.new_connections += 1
+
+    def _finished(self, state: Dict[str, bool]) -> None:
+        with self._lock:
+            if state["waiting"]:
+                self.waiting -= 1
+            self.in_flight -= 1
+
+
+def _chain_trace(previous: Optional[Callable], metrics: PoolMetrics, state: Dict[str, bool]) -> Callable:
+    def trace(name: str, info: Dict[str, Any]) -> None:
+        metrics._event(name, state)
+        if previous is not None:
+            previous(name, info)
+
+    return trace
+
+
+def _chain_async_trace(previous: Optional[Callable], metrics: PoolMetrics, state: Dict[str, bool]) -> Callable:
+    async def trace(name: str, info: Dict[str, Any]) -> None:
+        metrics._event(name, state)
+        if previous is not None:
+            await previous(name, info)
+
+    return trace
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        state = {"waiting": True}
+        request.extensions["trace"] = _chain_trace(request.extensions.get("trace"), self.metrics, state)
+        self.metrics._started()
+        try:
+            return super().handle_request(request)
+        finally:
+            self.metrics._finished(state)
+
+
+class MeteredAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        state = {"waiting": True}
+        request.extensions["trace"] = _chain_async_trace(request.extensions.get("trace"), self.metrics, state)
+        self.metrics._started()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.metrics._finished(state)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# (endpoint, verify_ssl, pool config, replay config) -> shared clients and their metrics
+_pools: Dict[Tuple[str, bool, HttpPoolConfig, ReplayConfig], Tuple[httpx.Client, httpx.AsyncClient, PoolMetrics]] = {}
+_pools_lock = threading.Lock()
+
+
+def get_http_clients(
+    endpoint: str,
+    verify_ssl: bool = True,
+    conf: Optional[Dict[str, Any]] = None,
+    replay_conf: Optional[Dict[str, Any]] = None,
+) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Get the sync/async clients shared by every model that talks to ``endpoint``.
+
+    Args:
+        endpoint: base_url (or azure_endpoint) of the provider
+        verify_ssl: whether to verify TLS certificates
+        conf: the HTTP_POOL section of conf.yaml
+        replay_conf: the HTTP_REPLAY section of conf.yaml
+    """
+    config = HttpPoolConfig.from_conf(conf)
+    replay = ReplayConfig.from_conf(replay_conf)
+    key = (endpoint, verify_ssl, config, replay)
+    with _pools_lock:
+        if key not in _pools:
+            http2 = config.http2
+            if http2 and not _http2_available():
+                logger.warning("HTTP_POOL.http2 is enabled but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+            metrics = PoolMetrics()
+            transport_kwargs = dict(verify=verify_ssl, http2=http2, limits=config.limits())
+            transport, async_transport = wrap_transports(
+                MeteredTransport(metrics, **transport_kwargs), MeteredAsyncTransport(metrics, **transport_kwargs), replay
+            )
+            client = httpx.Client(transport=transport, timeout=config.timeout(), verify=verify_ssl)
+            async_client = httpx.AsyncClient(transport=async_transport, timeout=config.timeout(), verify=verify_ssl)
+            _pools[key] = (client, async_client, metrics)
+        client, async_client, _ = _pools[key]
+        return client, async_client
+
+
+def get_pool_metrics() -> Dict[str, Dict[str, float]]:
+    """Pool metrics keyed by endpoint (pools for the same endpoint with different settings are summed)."""
+    result: Dict[str, Dict[str, float]] = {}
+    with _pools_lock:
+        pools = list(_pools.items())
+    for (endpoint, _, _, _), (_, _, metrics) in pools:
+        snapshot = metrics.snapshot()
+        if endpoint in result:
+            merged = result[endpoint]
+            for name in ("requests", "new_connections", "in_use", "waiting"):
+                merged[name] += snapshot[name]
+            merged["reuse_rate"] = round(
+                1 - merged["new_connections"] / merged["requests"] if merged["requests"] else 0.0, 4
+            )
+        else:
+            result[endpoint] = snapshot
+    return result
+
+
+def close_http_clients() -> None:
+    """Close the sync clients of every pool (async clients are closed with their event loop)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for client, _, _ in pools:
+        client.close()
@@ -0,0 +1,371 @@
+"""
+Incremental parsing of streamed tool-call arguments.
+
+When a provider streams a tool call, every chunk carries a fragment of the JSON ``args`` string.
+LangChain merges the chunks into one ``AIMessageChunk`` per chunk received and re-parses the
+accumulated ``args`` with ``parse_partial_json`` on every merge, which is quadratic in the length
+of the arguments (large search / crawl / code tool calls).
+
+``StreamingToolArgsMixin`` (applied to the OpenAI compatible provider classes with
+``create_streaming_tool_args_class``) takes the argument fragments out of the chunks that are
+merged and feeds them to one ``IncrementalJSONParser`` per tool-call index instead; the complete
+arguments are emitted once, in a final chunk. Callbacks still receive the original chunks, plus a
+``tool_call_args`` keyword argument (a ``ToolCallArgsAccumulator``) whose ``partial(index)`` gives
+the arguments parsed so far without re-parsing them.
+
+This changes what ``stream()`` / ``astream()`` yield: the chunks carry tool-call names and ids
+but empty ``args`` until the final chunk, so consumers that read the yielded chunks (e.g.
+LangGraph ``stream_mode="messages"`` showing tool args as they arrive) see no incremental args.
+It is therefore opt-in per model:
+
+    BASIC_MODEL:
+      model: qwen-max
+      incremental_tool_args: true
+"""
+
+import json
+import re
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Type
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+_STRING_RUN = re.compile(r'[^"\\]+')
+_TOKEN_CHARS = frozenset("0123456789+-.eEtrufalsn")
+_WHITESPACE = frozenset(" \t\r\n")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_MISSING = object()
+
+
+class IncrementalJSONParser:
+    """
+    Push parser for one JSON document that arrives in fragments. Every character is looked at
+    once; runs of plain string characters are consumed with a single regex match.
+    ``partial()`` returns the value parsed so far (containers are shared with the parser and must
+    not be modified), ``result()`` the complete value.
+    """
+
+    def __init__(self):
+        self._stack: List[Any] = []
+        self._keys: List[Any] = []
+        self._root: Any = _MISSING
+        self._state = "value"
+        self._buffer: List[str] = []
+        self._unicode = ""
+        self._string_is_key = False
+        self._token: List[str] = []
+        self.done = False
+        self.error: Optional[str] = None
+
+    # ------------------------------------------------------------------ value bookkeeping
+
+    def _attach(self, value: Any) -> None:
+        """Put a new value (or a placeholder for an in-progress string) into its parent."""
+        if not self._stack:
+            self._root = value
+        elif isinstance(self._stack[-1], dict):
+            self._stack[-1][self._keys[-1]] = value
+        else:
+            self._stack[-1].append(value)
+
+    def _replace_last(self, value: Any) -> None:
+        if not self._stack:
+            self._root = value
+        elif isinstance(self._stack[-1], dict):
+            self._stack[-1][self._keys[-1]] = value
+        else:
+            self._stack[-1][-1] = value
+
+    def _value_done(self) -> None:
+        if self._stack:
+            self._state = "after_value"
+        else:
+            self._state = "end"
+            self.done = True
+
+    def _finish_string(self) -> None:
+        text = "".join(self._buffer)
+        self._buffer = []
+        if any("\ud800" <= ch <= "\udfff" for ch in text):
+            # \\u escapes of a surrogate pair were decoded one half at a time
+            text = text.encode("utf-16", "surrogatepass").decode("utf-16")
+        if self._string_is_key:
+            self._keys[-1] = text
+            self._state = "colon"
+        else:
+            self._replace_last(text)
+            self._value_done()
+
+    def _finish_token(self) -> None:
+        token = "".join(self._token)
+        self._token = []
+        try:
+            value = json.loads(token)
+        except ValueError:
+            self.error = f"invalid literal {token!r}"
+            return
+        self._attach(value)
+        self._value_done()
+
+    def _open(self, container: Any) -> None:
+        self._attach(container)
+        self._stack.append(container)
+        self._keys.append(None)
+        self._state = "key_or_end" if isinstance(container, dict) else "value_or_end"
+
+    def _close(self, char: str) -> None:
+        container = self._stack[-1]
+        if (char == "}") != isinstance(container, dict):
+            self.error = f"unexpected {char!r}"
+            return
+        self._stack.pop()
+        self._keys.pop()
+        self._value_done()
+
+    # ------------------------------------------------------------------ feeding
+
+    def feed(self, text: str) -> None:
+        """Consume the next fragment of the document."""
+        index, length = 0, len(text)
+        while index < length and self.error is None:
+            state = self._state
+            if state == "string":
+                match = _STRING_RUN.match(text, index)
+                if match:
+                    self._buffer.append(match.group())
+                    index = match.end()
+                    continue
+                char = text[index]
+                index += 1
+                if char == '"':
+                    self._finish_string()
+                else:
+                    self._state = "escape"
+                continue
+
+            char = text[index]
+            if state == "escape":
+                index += 1
+                if char == "u":
+                    self._unicode = ""
+                    self._state = "unicode"
+                elif char in _ESCAPES:
+                    self._buffer.append(_ESCAPES[char])
+                    self._state = "string"
+                else:
+                    self.error = f"invalid escape \\{char}"
+                continue
+            if state == "unicode":
+                index += 1
+                self._unicode += char
+                if len(self._unicode) == 4:
+                    try:
+                        self._buffer.append(chr(int(self._unicode, 16)))
+                    except ValueError:
+                        self.error = f"invalid escape \\u{self._unicode}"
+                    self._state = "string"
+                continue
+            if state == "token":
+                if char in _TOKEN_CHARS:
+                    self._token.append(char)
+                    index += 1
+                else:
+                    self._finish_token()
+                continue
+
+            index += 1
+            if char in _WHITESPACE:
+                continue
+            if state == "value_or_end" and char == "]":
+                self._close(char)
+            elif state in ("value", "value_or_end"):
+                if char == "{":
+                    self._open({})
+                elif char == "[":
+                    self._open([])
+                elif char == '"':
+                    self._string_is_key = False
+                    self._attach("")
+                    self._state = "string"
+                elif char in _TOKEN_CHARS:
+                    self._token.append(char)
+                    self._state = "token"
+                else:
+                    self.error = f"unexpected {char!r}"
+            elif state in ("key", "key_or_end"):
+                if char == '"':
+                    self._string_is_key = True
+                    self._state = "string"
+                elif char == "}" and state == "key_or_end":
+                    self._close(char)
+                else:
+                    self.error = f"expected a key, got {char!r}"
+            elif state == "colon":
+                if char == ":":
+                    self._state = "value"
+                else:
+                    self.error = f"expected ':', got {char!r}"
+            elif state == "after_value":
+                if char == ",":
+                    self._state = "key" if isinstance(self._stack[-1], dict) else "value"
+                elif char in "]}":
+                    self._close(char)
+                else:
+                    self.error = f"expected ',' or a closing bracket, got {char!r}"
+            else:
+                self.error = f"unexpected {char!r} after the end of the document"
+
+    def partial(self) -> Any:
+        """The value parsed so far (None before anything was parsed), including an unfinished string."""
+        if self._state in ("string", "escape", "unicode") and not self._string_is_key:
+            self._replace_last("".join(self._buffer))
+        return None if self._root is _MISSING else self._root
+
+    def result(self) -> Any:
+        """The complete value; raises ValueError for an incomplete or invalid document."""
+        if self._state == "token" and len(self._stack) == 0:
+            self._finish_token()
+        if self.error is not None:
+            raise ValueError(f"Invalid JSON: {self.error}")
+        if not self.done:
+            raise ValueError("Incomplete JSON document")
+        return self._root
+
+
+class ToolCallArgsAccumulator:
+    """Argument fragments and parsers of every tool call of one streamed response, by index."""
+
+    def __init__(self):
+        self._fragments: Dict[int, List[str]] = {}
+        self._parsers: Dict[int, IncrementalJSONParser] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def indexes(self) -> List[int]:
+        return sorted(self._fragments)
+
+    def feed(self, index: int, fragment: str) -> None:
+        with self._lock:
+            if index not in self._fragments:
+                self._fragments[index] = []
+                self._parsers[index] = IncrementalJSONParser()
+            self._fragments[index].append(fragment)
+            self._parsers[index].feed(fragment)
+
+    def partial(self, index: int) -> Any:
+        """Arguments of tool call ``index`` parsed so far."""
+        with self._lock:
+            parser = self._parsers.get(index)
+            return parser.partial() if parser else None
+
+    def final(self, index: int) -> Any:
+        """Complete parsed arguments of tool call ``index``."""
+        with self._lock:
+            return self._parsers[index].result()
+
+    def args(self, index: int) -> str:
+        """Complete raw arguments string of tool call ``index``."""
+        with self._lock:
+            return "".join(self._fragments[index])
+
+
+def _strip_args(chunk: ChatGenerationChunk, accumulator: ToolCallArgsAccumulator) -> ChatGenerationChunk:
+    """Feed the argument fragments of ``chunk`` to ``accumulator`` and remove them from the chunk."""
+    message = chunk.message
+    tool_call_chunks = getattr(message, "tool_call_chunks", None)
+    if not tool_call_chunks:
+        return chunk
+    stripped_chunks = []
+    for tool_call in tool_call_chunks:
+        index = tool_call.get("index") or 0
+        if tool_call.get("args"):
+            accumulator.feed(index, tool_call["args"])
+        stripped_chunks.append({**tool_call, "args": ""})
+    additional_kwargs = message.additional_kwargs
+    if additional_kwargs.get("tool_calls"):
+        raw_calls = []
+        for raw in additional_kwargs["tool_calls"]:
+            function = raw.get("function")
+            if function and function.get("arguments"):
+                raw = {**raw, "function": {**function, "arguments": ""}}
+            raw_calls.append(raw)
+        additional_kwargs = {**additional_kwargs, "tool_calls": raw_calls}
+    stripped = message.model_copy(
+        update={
+            "tool_call_chunks": stripped_chunks,
+            "tool_calls": [],
+            "invalid_tool_calls": [],
+            "additional_kwargs": additional_kwargs,
+        }
+    )
+    return ChatGenerationChunk(message=stripped, generation_info=chunk.generation_info)
+
+
+def _args_chunk(accumulator: ToolCallArgsAccumulator) -> Optional[ChatGenerationChunk]:
+    """One chunk carrying the complete arguments of every tool call, merged in by index."""
+    indexes = accumulator.indexes
+    if not indexes:
+        return None
+    message = AIMessageChunk(
+        content="",
+        additional_kwargs={
+            "tool_calls": [{"index": index, "function": {"arguments": accumulator.args(index)}} for index in indexes]
+        },
+        tool_call_chunks=[
+            {"name": None, "args": accumulator.args(index), "id": None, "index": index, "type": "tool_call_chunk"}
+            for index in indexes
+        ],
+    )
+    return ChatGenerationChunk(message=message)
+
+
+class StreamingToolArgsMixin:
+    """
+    Streams tool-call arguments through ``ToolCallArgsAccumulator`` instead of letting every
+    chunk merge re-parse them. This mixin reports the chunks to the callbacks itself (the
+    provider's ``_stream`` runs without a run manager) so it can pass ``tool_call_args``.
+    """
+
+    def _stream(self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        accumulator = ToolCallArgsAccumulator()
+        for chunk in super()._stream(messages, stop=stop, run_manager=None, **kwargs):
+            stripped = _strip_args(chunk, accumulator)
+            if run_manager:
+                logprobs = (chunk.generation_info or {}).get("logprobs")
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk, logprobs=logprobs, tool_call_args=accumulator)
+            yield stripped
+        final = _args_chunk(accumulator)
+        if final is not None:
+            yield final
+
+    async def _astream(
+        self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        accumulator = ToolCallArgsAccumulator()
+        async for chunk in super()._astream(messages, stop=stop, run_manager=None, **kwargs):
+            stripped = _strip_args(chunk, accumulator)
+            if run_manager:
+                logprobs = (chunk.generation_info or {}).get("logprobs")
+                await run_manager.on_llm_new_token(
+                    chunk.text, chunk=chunk, logprobs=logprobs, tool_call_args=accumulator
+                )
+            yield stripped
+        final = _args_chunk(accumulator)
+        if final is not None:
+            yield final
+
+
+_streaming_classes: Dict[Type, Type] = {}
+_streaming_classes_lock = threading.Lock()
+
+
+def create_streaming_tool_args_class(base: Type) -> Type:
+    """Subclass of the provider class ``base`` with ``StreamingToolArgsMixin`` applied."""
+    with _streaming_classes_lock:
+        cls = _streaming_classes.get(base)
+        if cls is None:
+            cls = _streaming_classes[base] = type(
+                base.__name__, (StreamingToolArgsMixin, base), {"__module__": base.__module__}
+            )
+        return cls
@@ -1,22 +1,43 @@
+import hashlib
+import json
 import logging
 import os
-from pathlib import Path
-from typing import Any, Dict, get_args
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Mapping, Optional, Tuple, get_args
 
-import httpx
 from langchain_core.language_models import BaseChatModel
 from langchain_deepseek import ChatDeepSeek
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import AzureChatOpenAI, ChatOpenAI
 
-from src.config import load_yaml_config
-from src.config.agents import LLMType
+from src.config import load_yaml_config, subscribe_config
+from src.config.agents import AGENT_LLM_MAP, LLMType
+from src.config.loader import ConfigSnapshot, clear_config_cache, get_config_file_path
+from src.llms.batch import BatchChatModel, BatchExecutor, create_batch_executor
+from src.llms.coalescing import CoalescingChatModel
+from src.llms.hedging import create_hedged_llm
+from src.llms.http_pool import get_http_clients
+from src.llms.json_stream import create_streaming_tool_args_class
+from src.llms.metrics import create_metrics_handler
 from src.llms.providers.dashscope import ChatDashscope
+from src.llms.rate_limiter import RateLimitedChatModel, get_rate_limiter
+from src.llms.reasoning import create_reasoning_retention_class, get_reasoning_retention
+from src.llms.router import Endpoint, RoutedChatModel
+from src.llms.semantic_cache import SemanticCache, SemanticCacheChatModel, create_semantic_cache
 
 logger = logging.getLogger(__name__)
 
-# LLM实例的缓存
-_llm_cache: dict[LLMType, BaseChatModel] = {}
+# LLM实例的缓存，key 是 (llm_type, 合并后配置的 hash)，配置变化后自然对应新的实例
+_llm_cache: dict[Tuple[LLMType, str], BaseChatModel] = {}
+# 正在创建中的实例：并发请求同一个 key 时只创建一次，其余线程等待同一个 Future
+_llm_building: dict[Tuple[LLMType, str], Future] = {}
+_llm_cache_lock = threading.Lock()
+
+# 语义缓存，按 (llm_type, SEMANTIC_CACHE 配置的 hash) 共享，同一类型的所有开启了缓存的 agent 共用
+_semantic_caches: dict[Tuple[str, str], SemanticCache] = {}
+# 批处理执行器，按 (llm_type, BATCH_MODE 配置的 hash) 共享，同一类型的离线 agent 的调用合并到同一批里
+_batch_executors: dict[Tuple[str, str], BatchExecutor] = {}
 
 # Allowed LLM configuration keys to prevent unexpected parameters from being passed to LLM constructors (Issue #411 - SEARCH_ENGINE warning fix)
 ALLOWED_LLM_CONFIG_KEYS = {
@@ -61,12 +82,21 @@ ALLOWED_LLM_CONFIG_KEYS = {
     # Default headers
     "default_headers",
     "default_query",
+    # Multiple endpoints for load balancing / failover (see router.py)
+    "endpoints",
+    # Client-side rate limits per endpoint (see rate_limiter.py)
+    "requests_per_minute",
+    "tokens_per_minute",
+    # Merge identical concurrent requests (see coalescing.py)
+    "coalesce_requests",
+    # Parse streamed tool-call args incrementally (see json_stream.py)
+    "incremental_tool_args",
 }
 
 
 def _get_config_file_path() -> str:
     """Get the path to the configuration file."""
-    return str((Path(__file__).parent.parent.parent / "conf.yaml").resolve())
+    return get_config_file_path()
 
 
 def _get_llm_type_config_keys() -> dict[str, str]:
@@ -103,7 +133,7 @@ def _create_llm_use_conf(llm_type: LLMType, conf: Dict[str, Any]) -> BaseChatMod
         raise ValueError(f"Unknown LLM type: {llm_type}")
 
     llm_conf = conf.get(config_key, {})
-    if not isinstance(llm_conf, dict):
+    if not isinstance(llm_conf, Mapping):
         raise ValueError(f"Invalid LLM configuration for {llm_type}: {llm_conf}")
 
     # Get configuration from environment variables
@@ -131,6 +161,73 @@ def _create_llm_use_conf(llm_type: LLMType, conf: Dict[str, Any]) -> BaseChatMod
     if not merged_conf:
         raise ValueError(f"No configuration found for LLM type: {llm_type}")
 
+    coalesce_requests = merged_conf.pop("coalesce_requests", False)
+    endpoints = merged_conf.pop("endpoints", None)
+    if endpoints:
+        llm = _create_routed_llm(llm_type, merged_conf, endpoints, conf)
+    else:
+        llm = _create_llm_from_merged_conf(llm_type, merged_conf, conf)
+
+    if str(coalesce_requests).lower() in ("1", "true", "yes", "on"):
+        llm = CoalescingChatModel(inner=llm)
+
+    # Timing and token metrics of every call (see metrics.py); wrappers call the inner models
+    # directly, so only the outermost model reports and nothing is counted twice
+    llm.callbacks = [create_metrics_handler(llm_type, conf.get("METRICS"))]
+    return llm
+
+
+def _create_routed_llm(
+    llm_type: LLMType, merged_conf: Dict[str, Any], endpoints: List[Dict[str, Any]], conf: Dict[str, Any]
+) -> BaseChatModel:
+    """Create one client per entry of `endpoints` (entries override the shared keys) behind a router."""
+    routed = []
+    for index, endpoint_conf in enumerate(endpoints):
+        endpoint_conf = {k: v for k, v in (endpoint_conf or {}).items() if v is not None}
+        weight = endpoint_conf.pop("weight", 1)
+        name = endpoint_conf.pop("name", None)
+        endpoint_conf.pop("token_limit", None)
+        allowed_keys_lower = {k.lower() for k in ALLOWED_LLM_CONFIG_KEYS} - {"endpoints"}
+        for key in [key for key in endpoint_conf if key.lower() not in allowed_keys_lower]:
+            endpoint_conf.pop(key)
+            logger.warning(f"Removed unexpected key '{key}' from endpoint {index} of LLM type '{llm_type}'.")
+        endpoint_merged = {**merged_conf, **endpoint_conf}
+        name = name or endpoint_merged.get("base_url") or f"{llm_type}-{index}"
+        # Fail over quickly instead of retrying the same unhealthy endpoint several times
+        endpoint_merged.setdefault("max_retries", 1)
+        routed.append(Endpoint(name, _create_llm_from_merged_conf(llm_type, endpoint_merged, conf), weight))
+    logger.info(f"LLM type '{llm_type}' routed over {len(routed)} endpoints")
+    return RoutedChatModel(endpoints=routed)
+
+
+def _create_llm_from_merged_conf(llm_type: LLMType, merged_conf: Dict[str, Any], conf: Dict[str, Any]) -> BaseChatModel:
+    """Create the client for a single endpoint configuration, behind a rate limiter if one is configured."""
+    merged_conf = dict(merged_conf)
+    requests_per_minute = merged_conf.pop("requests_per_minute", None)
+    tokens_per_minute = merged_conf.pop("tokens_per_minute", None)
+    if not requests_per_minute and not tokens_per_minute:
+        return _create_provider_llm(llm_type, merged_conf, conf)
+
+    # The limiter paces calls, so blind retries on 429 are rarely needed
+    merged_conf.setdefault("max_retries", 1)
+    endpoint = merged_conf.get("base_url") or merged_conf.get("azure_endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT", "")
+    limiter = get_rate_limiter(
+        endpoint,
+        str(merged_conf.get("model") or merged_conf.get("azure_deployment") or ""),
+        float(requests_per_minute) if requests_per_minute else None,
+        float(tokens_per_minute) if tokens_per_minute else None,
+    )
+    max_tokens = merged_conf.get("max_tokens")
+    return RateLimitedChatModel(
+        inner=_create_provider_llm(llm_type, merged_conf, conf),
+        limiter=limiter,
+        token_limit=get_llm_token_limit_by_type(llm_type),
+        max_output_tokens=int(max_tokens) if max_tokens else None,
+    )
+
+
+def _create_provider_llm(llm_type: LLMType, merged_conf: Dict[str, Any], conf: Dict[str, Any]) -> BaseChatModel:
+    """Create the provider client (OpenAI/DeepSeek/Dashscope/Azure/Gemini) for one endpoint."""
     # Add max_retries to handle rate limit errors
     if "max_retries" not in merged_conf:
         merged_conf["max_retries"] = 3
@@ -138,10 +235,20 @@ def _create_llm_use_conf(llm_type: LLMType, conf: Dict[str, Any]) -> BaseChatMod
     # Handle SSL verification settings
     verify_ssl = merged_conf.pop("verify_ssl", True)
 
-    # Create custom HTTP client if SSL verification is disabled
-    if not verify_ssl:
-        http_client = httpx.Client(verify=False)
-        http_async_client = httpx.AsyncClient(verify=False)
+    # Opt-in: parse streamed tool-call args incrementally (see json_stream.py)
+    incremental_tool_args = merged_conf.pop("incremental_tool_args", False)
+    if isinstance(incremental_tool_args, str):
+        incremental_tool_args = incremental_tool_args.strip().lower() in {"1", "true", "yes", "y", "on"}
+
+    def tool_args_class(base):
+        return create_streaming_tool_args_class(base) if incremental_tool_args else base
+
+    # Reuse one tuned connection pool per endpoint (see http_pool.py) for every provider branch
+    endpoint = merged_conf.get("base_url") or merged_conf.get("azure_endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT", "")
+    if "http_client" not in merged_conf:
+        http_client, http_async_client = get_http_clients(
+            endpoint, bool(verify_ssl), conf.get("HTTP_POOL"), conf.get("HTTP_REPLAY")
+        )
         merged_conf["http_client"] = http_client
         merged_conf["http_async_client"] = http_async_client
 
@@ -168,7 +275,7 @@ def _create_llm_use_conf(llm_type: LLMType, conf: Dict[str, Any]) -> BaseChatMod
         return ChatGoogleGenerativeAI(**gemini_conf)
 
     if "azure_endpoint" in merged_conf or os.getenv("AZURE_OPENAI_ENDPOINT"):
-        return AzureChatOpenAI(**merged_conf)
+        return tool_args_class(AzureChatOpenAI)(**merged_conf)
 
     # Check if base_url is dashscope endpoint
     if "base_url" in merged_conf and "dashscope." in merged_conf["base_url"]:
@@ -176,28 +283,150 @@ def _create_llm_use_conf(llm_type: LLMType, conf: Dict[str, Any]) -> BaseChatMod
             merged_conf["extra_body"] = {"enable_thinking": True}
         else:
             merged_conf["extra_body"] = {"enable_thinking": False}
-        return ChatDashscope(**merged_conf)
+        retention = get_reasoning_retention(conf.get("REASONING_RETENTION") or {})
+        return create_reasoning_retention_class(tool_args_class(ChatDashscope), retention)(**merged_conf)
 
     if llm_type == "reasoning":
         merged_conf["api_base"] = merged_conf.pop("base_url", None)
-        return ChatDeepSeek(**merged_conf)
+        retention = get_reasoning_retention(conf.get("REASONING_RETENTION") or {})
+        return create_reasoning_retention_class(tool_args_class(ChatDeepSeek), retention)(**merged_conf)
     else:
-        return ChatOpenAI(**merged_conf)
+        return tool_args_class(ChatOpenAI)(**merged_conf)
+
+
+def _load_llm_config() -> Mapping[str, Any]:
+    """Current conf.yaml snapshot (the config service re-reads the file when it changes)."""
+    return load_yaml_config(_get_config_file_path())
+
+
+def _json_default(value: Any) -> Any:
+    """conf.yaml sections are read-only mappings (see freeze_config); hash them like dicts."""
+    return dict(value) if isinstance(value, Mapping) else str(value)
+
+
+# Top-level conf.yaml sections that are baked into every model instance
+_SHARED_MODEL_CONFIG_KEYS = ("HTTP_POOL", "METRICS", "REASONING_RETENTION", "HTTP_REPLAY")
+
+
+def _get_llm_config_hash(llm_type: LLMType, conf: Dict[str, Any]) -> str:
+    """Hash of the yaml section merged with the {TYPE}_MODEL__* env vars for this LLM type."""
+    config_key = _get_llm_type_config_keys().get(llm_type, "")
+    merged_conf = {**(conf.get(config_key) or {}), **_get_env_llm_conf(llm_type)}
+    shared = {key: conf.get(key) for key in _SHARED_MODEL_CONFIG_KEYS}
+    payload = json.dumps([merged_conf, shared], sort_keys=True, default=_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 
 def get_llm_by_type(llm_type: LLMType) -> BaseChatModel:
     """
     Get LLM instance by type. Returns cached instance if available.
+
+    The cache key includes a hash of the merged configuration, so edits to conf.yaml or to the
+    {TYPE}_MODEL__* env vars produce a new instance. Concurrent callers asking for the same key
+    wait for a single construction instead of building duplicate clients.
     """
-    if llm_type in _llm_cache:
-        return _llm_cache[llm_type]
+    conf = _load_llm_config()
+    key = (llm_type, _get_llm_config_hash(llm_type, conf))
+
+    with _llm_cache_lock:
+        if key in _llm_cache:
+            return _llm_cache[key]
+        future = _llm_building.get(key)
+        owner = future is None
+        if owner:
+            future = _llm_building[key] = Future()
+
+    if not owner:
+        return future.result()
 
-    conf = load_yaml_config(_get_config_file_path())
-    llm = _create_llm_use_conf(llm_type, conf)
-    _llm_cache[llm_type] = llm
+    try:
+        llm = _create_llm_use_conf(llm_type, conf)
+    except BaseException as e:
+        with _llm_cache_lock:
+            _llm_building.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _llm_cache_lock:
+        # Drop instances built from an outdated configuration of the same type
+        for stale in [k for k in _llm_cache if k[0] == llm_type]:
+            del _llm_cache[stale]
+        _llm_cache[key] = llm
+        _llm_building.pop(key, None)
+    future.set_result(llm)
     return llm
 
 
+def _conf_hash(conf: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(conf, sort_keys=True, default=_json_default).encode("utf-8")).hexdigest()
+
+
+def get_llm_for_agent(agent_type: str, agent_name: Optional[str] = None) -> BaseChatModel:
+    """
+    Get the LLM for an agent in AGENT_LLM_MAP. Agents listed in BATCH_MODE.agents of conf.yaml
+    send their calls through a shared batch executor (see batch.py), agents listed in
+    HEDGING.agents get hedged requests (see hedging.py), and agents listed in
+    SEMANTIC_CACHE.agents get the model wrapped in a semantic response cache (see semantic_cache.py).
+    The returned model is tagged with the agent name, so its call metrics are reported per agent.
+    """
+    llm_type = AGENT_LLM_MAP.get(agent_type, "basic")
+    base_llm = llm = get_llm_by_type(llm_type)
+    conf = _load_llm_config()
+
+    batch_conf = conf.get("BATCH_MODE") or {}
+    if agent_type in (batch_conf.get("agents") or []):
+        key = (llm_type, _conf_hash(batch_conf))
+        with _llm_cache_lock:
+            executor = _batch_executors.get(key)
+            if executor is None:
+                for stale in [k for k in _batch_executors if k[0] == llm_type]:
+                    _batch_executors.pop(stale).close()
+                executor = _batch_executors[key] = create_batch_executor(batch_conf, llm)
+        llm = BatchChatModel(inner=llm, executor=executor)
+
+    hedging_conf = conf.get("HEDGING") or {}
+    if agent_type in (hedging_conf.get("agents") or []):
+        llm = create_hedged_llm(llm, hedging_conf)
+
+    cache_conf = conf.get("SEMANTIC_CACHE") or {}
+    if agent_type in (cache_conf.get("agents") or []):
+        key = (llm_type, _conf_hash(cache_conf))
+        with _llm_cache_lock:
+            cache = _semantic_caches.get(key)
+            if cache is None:
+                for stale in [k for k in _semantic_caches if k[0] == llm_type]:
+                    del _semantic_caches[stale]
+                cache = _semantic_caches[key] = create_semantic_cache(cache_conf)
+        llm = SemanticCacheChatModel(inner=llm, cache=cache, disable_streaming=llm.disable_streaming)
+
+    metadata = {**(base_llm.metadata or {}), "agent_name": agent_name or agent_type, "agent_type": agent_type}
+    return llm.model_copy(update={"callbacks": base_llm.callbacks, "metadata": metadata})
+
+
+def invalidate_llm_cache(llm_type: Optional[LLMType] = None) -> None:
+    """
+    Drop cached LLM instances (all of them, or only those of ``llm_type``) and force conf.yaml
+    to be re-read on the next ``get_llm_by_type`` call. Shared HTTP pools are kept.
+    """
+    with _llm_cache_lock:
+        for key in [k for k in _llm_cache if llm_type is None or k[0] == llm_type]:
+            del _llm_cache[key]
+    clear_config_cache(_get_config_file_path())
+
+
+def _on_config_change(snapshot: ConfigSnapshot, previous: Optional[ConfigSnapshot]) -> None:
+    """Release cached instances whose configuration changed with the new conf.yaml version."""
+    with _llm_cache_lock:
+        stale = [k for k in _llm_cache if k[1] != _get_llm_config_hash(k[0], snapshot.data)]
+        for key in stale:
+            del _llm_cache[key]
+    if stale:
+        logger.info(f"conf.yaml version {snapshot.version}: dropped {len(stale)} outdated LLM instance(s)")
+
+
+subscribe_config(_on_config_change, _get_config_file_path())
+
+
 def get_configured_llm_models() -> dict[str, list[str]]:
     """
     Get all configured LLM models grouped by type.
@@ -206,7 +435,7 @@ def get_configured_llm_models() -> dict[str, list[str]]:
         Dictionary mapping LLM type to list of configured model names.
     """
     try:
-        conf = load_yaml_config(_get_config_file_path())
+        conf = _load_llm_config()
         llm_type_config_keys = _get_llm_type_config_keys()
 
         configured_models: dict[str, list[str]] = {}
@@ -222,10 +451,13 @@ def get_configured_llm_models() -> dict[str, list[str]]:
             # Merge configurations, with environment variables taking precedence
             merged_conf = {**yaml_conf, **env_conf}
 
-            # Check if model is configured
-            model_name = merged_conf.get("model")
-            if model_name:
-                configured_models.setdefault(llm_type, []).append(model_name)
+            # Check if model is configured (endpoints may override the shared model)
+            model_names = [merged_conf.get("model")]
+            for endpoint_conf in merged_conf.get("endpoints") or []:
+                model_names.append((endpoint_conf or {}).get("model"))
+            for model_name in model_names:
+                if model_name and model_name not in configured_models.get(llm_type, []):
+                    configured_models.setdefault(llm_type, []).append(model_name)
 
         return configured_models
 
@@ -243,6 +475,7 @@ def _get_model_token_limit_defaults() -> dict[str, int]:
     """
     return {
         # OpenAI models
+        "gpt-4o-mini": 120000,
         "gpt-4o": 120000,
         "gpt-4-turbo": 120000,
         "gpt-4": 8000,
@@ -283,16 +516,32 @@ def _infer_token_limit_from_model(model_name: str) -> int:
     
     model_name_lower = model_name.lower()
     defaults = _get_model_token_limit_defaults()
-    
-    # Try exact or prefix matches
-    for key, limit in defaults.items():
+    # Longest key first, so "gpt-4o" wins over "gpt-4" regardless of dict order
+    keys = sorted((key for key in defaults if key != "default"), key=len, reverse=True)
+
+    # Prefix match on the name, also without a provider prefix such as "openai/" or "Qwen/"
+    candidates = (model_name_lower, model_name_lower.rsplit("/", 1)[-1])
+    for key in keys:
+        if any(candidate.startswith(key) for candidate in candidates):
+            return defaults[key]
+
+    # Fall back to the longest key contained anywhere in the name (e.g. "ep-xxx-doubao-pro")
+    for key in keys:
         if key in model_name_lower:
-            return limit
-    
+            return defaults[key]
+
     # Return safe default if no match found
     return defaults["default"]
 
 
+def get_llm_model_name_by_type(llm_type: str) -> str:
+    """Get the configured model name (yaml merged with env vars) of an LLM type, or "" if unset."""
+    config_key = _get_llm_type_config_keys().get(llm_type, "")
+    conf = _load_llm_config()
+    merged_conf = {**(conf.get(config_key) or {}), **_get_env_llm_conf(llm_type)}
+    return str(merged_conf.get("model") or "")
+
+
 def get_llm_token_limit_by_type(llm_type: str) -> int:
     """
     Get the maximum token limit for a given LLM type.
@@ -313,7 +562,7 @@ def get_llm_token_limit_by_type(llm_type: str) -> int:
     llm_type_config_keys = _get_llm_type_config_keys()
     config_key = llm_type_config_keys.get(llm_type)
 
-    conf = load_yaml_config(_get_config_file_path())
+    conf = _load_llm_config()
     model_config = conf.get(config_key, {})
     
     # First priority: explicitly configured token_limit
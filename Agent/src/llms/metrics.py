@@ -0,0 +1,347 @@
+"""
+Per-call latency and token metrics for every LLM built by ``llm.py``.
+
+``LLMMetricsCallbackHandler`` is attached as a callback to each model returned by
+``get_llm_by_type``. For every chat model call it records, tagged by agent and LLM type:
+
+    - queue wait            time spent waiting for the client-side rate limiter
+    - time to first token   streaming calls only
+    - inter-token latency   gap between consecutive streamed chunks
+    - duration              total call time
+    - input / output tokens from the provider's usage data
+    - reasoning tokens      usage details, or the streamed ``reasoning_content`` (DashScope, DeepSeek)
+    - retries               failovers between endpoints
+
+Aggregates go to the process-wide ``MetricsRegistry`` (``get_metrics_registry``), which renders the
+Prometheus text format or JSONL. Per-call records can additionally be appended to a JSONL file:
+
+    METRICS:
+      jsonl_path: logs/llm_calls.jsonl
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets (seconds) for all latency metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """In-process counters and histograms keyed by metric name and labels."""
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, labels: Dict[str, Any], value: float = 1.0) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Dict[str, Any], value: float, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+
+        def fmt(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.buckets, list(h.counts), h.count, h.sum)) for key, h in self._histograms.items())
+        lines: List[str] = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{fmt(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total:g}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        """One JSON object per series (counters with their value, histograms with count/sum/buckets)."""
+        now = time.time()
+        with self._lock:
+            records = [
+                {"ts": now, "name": name, "type": "counter", "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            records += [
+                {
+                    "ts": now,
+                    "name": name,
+                    "type": "histogram",
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "buckets": dict(zip((f"{b:g}" for b in h.buckets), h.counts)),
+                }
+                for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+
+_registry = MetricsRegistry()
+for _name, _help in (
+    ("llm_requests_total", "LLM calls by final status"),
+    ("llm_retries_total", "Endpoint failovers during LLM calls"),
+    ("llm_input_tokens_total", "Prompt tokens reported by the provider"),
+    ("llm_output_tokens_total", "Completion tokens reported by the provider"),
+    ("llm_reasoning_tokens_total", "Reasoning tokens (usage details or streamed reasoning_content chunks)"),
+    ("llm_queue_wait_seconds", "Time spent waiting for the client-side rate limiter"),
+    ("llm_time_to_first_token_seconds", "Time from call start to the first streamed chunk"),
+    ("llm_inter_token_latency_seconds", "Time between consecutive streamed chunks"),
+    ("llm_request_duration_seconds", "Total LLM call duration"),
+):
+    _registry.describe(_name, _help)
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+class JsonlExporter:
+    """Appends one JSON line per finished LLM call to ``path``."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class _CallRecord:
+    def __init__(self, agent: str, llm_type: str, model: str):
+        self.agent = agent
+        self.llm_type = llm_type
+        self.model = model
+        self.started = time.monotonic()
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.chunks = 0
+        self.reasoning_chunks = 0
+        self.queue_wait = 0.0
+        self.retries = 0
+
+
+# Calls in flight, by LangChain run id; wrappers deeper in the stack report into them
+_active_calls: Dict[UUID, _CallRecord] = {}
+_active_calls_lock = threading.Lock()
+
+
+def record_queue_wait(run_id: Optional[UUID], seconds: float) -> None:
+    """Called by the rate limiter with the time the call ``run_id`` waited for admission."""
+    with _active_calls_lock:
+        record = _active_calls.get(run_id)
+        if record is not None:
+            record.queue_wait += seconds
+
+
+def record_retry(run_id: Optional[UUID]) -> None:
+    """Called when the call ``run_id`` is retried on another endpoint."""
+    with _active_calls_lock:
+        record = _active_calls.get(run_id)
+        if record is not None:
+            record.retries += 1
+
+
+def _agent_name(metadata: Optional[Dict[str, Any]]) -> str:
+    metadata = metadata or {}
+    return str(metadata.get("agent_name") or metadata.get("lc_agent_name") or metadata.get("langgraph_node") or "unknown")
+
+
+def _usage(response: LLMResult) -> Dict[str, Any]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return dict(usage)
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return {
+        "input_tokens": token_usage.get("prompt_tokens", 0),
+        "output_tokens": token_usage.get("completion_tokens", 0),
+        "output_token_details": {
+            "reasoning": (token_usage.get("completion_tokens_details") or {}).get("reasoning_tokens", 0)
+        },
+    }
+
+
+class LLMMetricsCallbackHandler(BaseCallbackHandler):
+    """Records timing and token metrics of every chat model call of one LLM type."""
+
+    # Timestamps must be taken when the event happens, not when a thread pool gets to it
+    run_inline = True
+
+    def __init__(self, llm_type: str, registry: Optional[MetricsRegistry] = None, exporter: Optional[JsonlExporter] = None):
+        self.llm_type = llm_type
+        self.registry = registry or _registry
+        self.exporter = exporter
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name") or ""
+        with _active_calls_lock:
+            _active_calls[run_id] = _CallRecord(_agent_name(metadata), self.llm_type, str(model))
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, run_id: UUID, **kwargs: Any) -> None:
+        with _active_calls_lock:
+            record = _active_calls.get(run_id)
+        if record is None:
+            return
+        now = time.monotonic()
+        labels = {"agent": record.agent, "llm_type": record.llm_type}
+        if record.first_token is None:
+            record.first_token = now
+            self.registry.observe("llm_time_to_first_token_seconds", labels, now - record.started)
+        else:
+            self.registry.observe("llm_inter_token_latency_seconds", labels, now - record.last_token)
+        record.last_token = now
+        record.chunks += 1
+        message = getattr(chunk, "message", None)
+        if message is not None and message.additional_kwargs.get("reasoning_content"):
+            record.reasoning_chunks += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, "ok", response)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, type(error).__name__, None)
+
+    def _finish(self, run_id: UUID, status: str, response: Optional[LLMResult]) -> None:
+        with _active_calls_lock:
+            record = _active_calls.pop(run_id, None)
+        if record is None:
+            return
+        duration = time.monotonic() - record.started
+        labels = {"agent": record.agent, "llm_type": record.llm_type}
+        registry = self.registry
+        registry.inc("llm_requests_total", {**labels, "status": status})
+        registry.observe("llm_request_duration_seconds", labels, duration)
+        registry.observe("llm_queue_wait_seconds", labels, record.queue_wait)
+        if record.retries:
+            registry.inc("llm_retries_total", labels, record.retries)
+
+        usage = _usage(response) if response is not None else {}
+        input_tokens = usage.get("input_tokens") or 0
+        output_tokens = usage.get("output_tokens") or 0
+        reasoning_tokens = (usage.get("output_token_details") or {}).get("reasoning") or record.reasoning_chunks
+        registry.inc("llm_input_tokens_total", labels, input_tokens)
+        registry.inc("llm_output_tokens_total", labels, output_tokens)
+        registry.inc("llm_reasoning_tokens_total", labels, reasoning_tokens)
+
+        if self.exporter is not None:
+            try:
+                self.exporter.export(
+                    {
+                        "ts": time.time(),
+                        "agent": record.agent,
+                        "llm_type": record.llm_type,
+                        "model": record.model,
+                        "status": status,
+                        "duration": duration,
+                        "queue_wait": record.queue_wait,
+                        "ttft": record.first_token - record.started if record.first_token is not None else None,
+                        "chunks": record.chunks,
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "reasoning_tokens": reasoning_tokens,
+                        "retries": record.retries,
+                    }
+                )
+            except OSError as e:
+                logger.warning(f"Failed to write LLM call metrics: {e}")
+
+
+_exporters: Dict[str, JsonlExporter] = {}
+_exporters_lock = threading.Lock()
+
+
+def create_metrics_handler(llm_type: str, conf: Optional[Dict[str, Any]] = None) -> LLMMetricsCallbackHandler:
+    """Handler for ``llm_type`` configured by the METRICS section of conf.yaml."""
+    path = (conf or {}).get("jsonl_path")
+    exporter = None
+    if path:
+        with _exporters_lock:
+            exporter = _exporters.get(path)
+            if exporter is None:
+                exporter = _exporters[path] = JsonlExporter(path)
+    return LLMMetricsCallbackHandler(llm_type, exporter=exporter)
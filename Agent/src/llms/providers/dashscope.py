@@ -1,9 +1,9 @@
 # Standard library imports
-from typing import Any, Dict, Iterator, List, Mapping, Optional, Type, Union, cast
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Mapping, Optional, Type, Union, cast
 
 # Third-party imports
 import openai
-from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_core.messages import (
     AIMessageChunk,
     BaseMessage,
@@ -13,11 +13,13 @@ from langchain_core.messages import (
     HumanMessageChunk,
     SystemMessageChunk,
     ToolMessageChunk,
+    message_chunk_to_message,
 )
 from langchain_core.messages.ai import UsageMetadata
 from langchain_core.messages.tool import tool_call_chunk
-from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_openai import ChatOpenAI
+from openai.types.chat import ChatCompletionChunk
 from langchain_openai.chat_models.base import (
     _create_usage_metadata,
     _handle_openai_bad_request,
@@ -172,6 +174,172 @@ def _convert_chunk_to_generation_chunk(
     return generation_chunk
 
 
+def _convert_completion_chunk(
+    chunk: ChatCompletionChunk,
+    default_chunk_class: Type[BaseMessageChunk],
+    base_generation_info: Optional[Dict[str, Any]],
+) -> Optional[ChatGenerationChunk]:
+    """Lean variant of `_convert_chunk_to_generation_chunk` for `ChatCompletionChunk` objects.
+
+    Fields are read as attributes instead of `model_dump()`-ing every chunk, deltas that carry
+    nothing (no content, reasoning, tool call, finish reason, logprobs or usage) are skipped, and
+    the common text / reasoning chunks are built without re-running pydantic validation. Rare
+    chunks (tool calls, usage, non-assistant roles) take the full conversion path.
+
+    Args:
+        chunk: Chunk object from the OpenAI streaming response
+        default_chunk_class: Default message chunk class to use
+        base_generation_info: Base generation information to include
+
+    Returns:
+        Optional[ChatGenerationChunk]: Generated chunk or None if chunk should be skipped
+    """
+    choices = chunk.choices
+    if not choices:
+        if chunk.usage is None:
+            return None
+        return _convert_chunk_to_generation_chunk(chunk.model_dump(), default_chunk_class, base_generation_info)
+
+    choice = choices[0]
+    delta = choice.delta
+    if delta is None:
+        return None
+    content = delta.content
+    # reasoning_content is not part of the OpenAI schema; it is kept as an extra field
+    reasoning_content = getattr(delta, "reasoning_content", None)
+    finish_reason = choice.finish_reason
+    logprobs = choice.logprobs
+    if (
+        delta.tool_calls
+        or delta.function_call
+        or chunk.usage is not None
+        or (delta.role and delta.role != "assistant")
+        or default_chunk_class is not AIMessageChunk
+    ):
+        return _convert_chunk_to_generation_chunk(chunk.model_dump(), default_chunk_class, base_generation_info)
+    if not (content or reasoning_content or finish_reason or logprobs or base_generation_info):
+        return None
+
+    generation_info = None
+    if finish_reason or logprobs or base_generation_info:
+        generation_info = dict(base_generation_info) if base_generation_info else {}
+        if finish_reason:
+            generation_info["finish_reason"] = finish_reason
+            if chunk.model:
+                generation_info["model_name"] = chunk.model
+            if chunk.system_fingerprint:
+                generation_info["system_fingerprint"] = chunk.system_fingerprint
+        if logprobs:
+            generation_info["logprobs"] = logprobs.model_dump()
+
+    content = content or ""
+    if reasoning_content:
+        message = AIMessageChunk.model_construct(
+            content=content, additional_kwargs={"reasoning_content": reasoning_content}
+        )
+    else:
+        message = AIMessageChunk.model_construct(content=content)
+    return ChatGenerationChunk.model_construct(
+        message=message, generation_info=generation_info or None, text=content
+    )
+
+
+def _to_generation_chunk(
+    chunk: Any,
+    default_chunk_class: Type[BaseMessageChunk],
+    base_generation_info: Optional[Dict[str, Any]],
+) -> Optional[ChatGenerationChunk]:
+    """Convert any item of a (beta) streaming response, using the lean path where possible."""
+    if isinstance(chunk, ChatCompletionChunk):
+        return _convert_completion_chunk(chunk, default_chunk_class, base_generation_info)
+    if not isinstance(chunk, dict):
+        chunk = chunk.model_dump()
+    return _convert_chunk_to_generation_chunk(chunk, default_chunk_class, base_generation_info)
+
+
+class _StreamChunkConverter:
+    """Per-stream conversion state shared by `_stream` and `_astream`.
+
+    Tracks the message chunk class of the previous chunk and attaches the response's base
+    generation info (e.g. headers) to the first non-empty chunk only.
+    """
+
+    def __init__(self, base_generation_info: Dict[str, Any]):
+        self.default_chunk_class: Type[BaseMessageChunk] = AIMessageChunk
+        self.base_generation_info = base_generation_info
+        self.is_first_chunk = True
+
+    def convert(self, chunk: Any) -> Optional[ChatGenerationChunk]:
+        generation_chunk = _to_generation_chunk(
+            chunk,
+            self.default_chunk_class,
+            self.base_generation_info if self.is_first_chunk else {},
+        )
+        if generation_chunk is None:
+            return None
+        self.default_chunk_class = generation_chunk.message.__class__
+        self.is_first_chunk = False
+        return generation_chunk
+
+    @staticmethod
+    def logprobs(generation_chunk: ChatGenerationChunk) -> Any:
+        return (generation_chunk.generation_info or {}).get("logprobs")
+
+
+def _generate_from_chunks(chunks: Iterable[ChatGenerationChunk]) -> ChatResult:
+    """Aggregate streamed chunks into a ChatResult.
+
+    Same result as langchain's `generate_from_stream`, but content and reasoning are collected
+    incrementally and joined once at the end instead of being re-concatenated on every chunk
+    (which is quadratic in the length of long reasoning traces). Only chunks that carry tool
+    calls, usage or generation info are merged the regular way.
+
+    Only `ChatDashscope._generate` / `_agenerate` of a model created with `streaming=True` use it.
+    Streams that LangChain aggregates itself (`stream()`, `astream()`, and `invoke` while a
+    streaming callback handler is attached) still go through `generate_from_stream`; those only
+    benefit from the lean per-chunk conversion (`_convert_completion_chunk`).
+
+    Args:
+        chunks: Generation chunks of one streaming response
+
+    Returns:
+        ChatResult: The aggregated chat result
+    """
+    content_parts: List[str] = []
+    reasoning_parts: List[str] = []
+    merged: Optional[ChatGenerationChunk] = None
+    for chunk in chunks:
+        message = chunk.message
+        if message.content:
+            content_parts.append(cast(str, message.content))
+        extra = message.additional_kwargs
+        if "reasoning_content" in extra:
+            reasoning_parts.append(extra["reasoning_content"])
+            extra = {k: v for k, v in extra.items() if k != "reasoning_content"}
+        if merged is not None and not (
+            extra or getattr(message, "tool_call_chunks", None) or getattr(message, "usage_metadata", None)
+            or chunk.generation_info
+        ):
+            continue
+        stripped = ChatGenerationChunk(
+            message=message.model_copy(update={"content": "", "additional_kwargs": extra}),
+            generation_info=chunk.generation_info,
+        )
+        merged = stripped if merged is None else merged + stripped
+
+    if merged is None:
+        raise ValueError("No generations found in stream.")
+    additional_kwargs = dict(merged.message.additional_kwargs)
+    if reasoning_parts:
+        additional_kwargs["reasoning_content"] = "".join(reasoning_parts)
+    message = merged.message.model_copy(
+        update={"content": "".join(content_parts), "additional_kwargs": additional_kwargs}
+    )
+    return ChatResult(
+        generations=[ChatGeneration(message=message_chunk_to_message(message), generation_info=merged.generation_info)]
+    )
+
+
 class ChatDashscope(ChatOpenAI):
     """具有推理能力的扩展后的ChatOpenAI模型。
 
@@ -219,6 +387,25 @@ class ChatDashscope(ChatOpenAI):
 
         return chat_result
 
+    def _stream_payload(
+        self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Build the request payload of a streaming call.
+
+        Requests with `response_format` go through the beta streaming helper, which sets
+        `stream` itself and cannot return response headers.
+        """
+        kwargs["stream"] = True
+        payload = self._get_request_payload(messages, stop=stop, **kwargs)
+        if "response_format" in payload:
+            if self.include_response_headers:
+                warnings.warn(
+                    "Cannot currently include response headers when response_format is "
+                    "specified."
+                )
+            payload.pop("stream")
+        return payload
+
     def _stream(
         self,
         messages: List[BaseMessage],
@@ -240,78 +427,110 @@ class ChatDashscope(ChatOpenAI):
         Raises:
             openai.BadRequestError: If the API request is invalid
         """
-        kwargs["stream"] = True
-        payload = self._get_request_payload(messages, stop=stop, **kwargs)
-        default_chunk_class: Type[BaseMessageChunk] = AIMessageChunk
+        payload = self._stream_payload(messages, stop, kwargs)
         base_generation_info: Dict[str, Any] = {}
-
-        # Handle response format for beta completions
         if "response_format" in payload:
-            if self.include_response_headers:
-                warnings.warn(
-                    "Cannot currently include response headers when response_format is "
-                    "specified."
-                )
-            payload.pop("stream")
-            response_stream = self.root_client.beta.chat.completions.stream(**payload)
-            context_manager = response_stream
+            response = self.root_client.beta.chat.completions.stream(**payload)
+        elif self.include_response_headers:
+            raw_response = self.client.with_raw_response.create(**payload)
+            response = raw_response.parse()
+            base_generation_info = {"headers": dict(raw_response.headers)}
         else:
-            # Handle regular streaming with optional response headers
-            if self.include_response_headers:
-                raw_response = self.client.with_raw_response.create(**payload)
-                response = raw_response.parse()
-                base_generation_info = {"headers": dict(raw_response.headers)}
-            else:
-                response = self.client.create(**payload)
-            context_manager = response
+            response = self.client.create(**payload)
+        converter = _StreamChunkConverter(base_generation_info)
 
         try:
-            with context_manager as response:
-                is_first_chunk = True
-                for chunk in response:
-                    # Convert chunk to dict if it's a model object
-                    if not isinstance(chunk, dict):
-                        chunk = chunk.model_dump()
-
-                    generation_chunk = _convert_chunk_to_generation_chunk(
-                        chunk,
-                        default_chunk_class,
-                        base_generation_info if is_first_chunk else {},
-                    )
-
+            with response as stream:
+                for chunk in stream:
+                    generation_chunk = converter.convert(chunk)
                     if generation_chunk is None:
                         continue
-
-                    # Update default chunk class for subsequent chunks
-                    default_chunk_class = generation_chunk.message.__class__
-
-                    # Handle log probabilities for callback
-                    logprobs = (generation_chunk.generation_info or {}).get("logprobs")
                     if run_manager:
                         run_manager.on_llm_new_token(
                             generation_chunk.text,
                             chunk=generation_chunk,
-                            logprobs=logprobs,
+                            logprobs=converter.logprobs(generation_chunk),
                         )
-
-                    is_first_chunk = False
                     yield generation_chunk
-
+                if "response_format" in payload:
+                    generation_chunk = self._get_generation_chunk_from_completion(
+                        stream.get_final_completion()
+                    )
+                    if run_manager:
+                        run_manager.on_llm_new_token(generation_chunk.text, chunk=generation_chunk)
+                    yield generation_chunk
         except openai.BadRequestError as e:
             _handle_openai_bad_request(e)
 
-        # Handle final completion for response_format requests
-        if hasattr(response, "get_final_completion") and "response_format" in payload:
-            try:
-                final_completion = response.get_final_completion()
-                generation_chunk = self._get_generation_chunk_from_completion(
-                    final_completion
-                )
-                if run_manager:
-                    run_manager.on_llm_new_token(
-                        generation_chunk.text, chunk=generation_chunk
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Async counterpart of `_stream`, on the async OpenAI client."""
+        payload = self._stream_payload(messages, stop, kwargs)
+        base_generation_info: Dict[str, Any] = {}
+        if "response_format" in payload:
+            response = self.root_async_client.beta.chat.completions.stream(**payload)
+        elif self.include_response_headers:
+            raw_response = await self.async_client.with_raw_response.create(**payload)
+            response = raw_response.parse()
+            base_generation_info = {"headers": dict(raw_response.headers)}
+        else:
+            response = await self.async_client.create(**payload)
+        converter = _StreamChunkConverter(base_generation_info)
+
+        try:
+            async with response as stream:
+                async for chunk in stream:
+                    generation_chunk = converter.convert(chunk)
+                    if generation_chunk is None:
+                        continue
+                    if run_manager:
+                        await run_manager.on_llm_new_token(
+                            generation_chunk.text,
+                            chunk=generation_chunk,
+                            logprobs=converter.logprobs(generation_chunk),
+                        )
+                    yield generation_chunk
+                if "response_format" in payload:
+                    generation_chunk = self._get_generation_chunk_from_completion(
+                        await stream.get_final_completion()
                     )
-                yield generation_chunk
-            except AttributeError:
-                # If get_final_completion method doesn't exist, continue without it
-                pass
\ No newline at end of file
+                    if run_manager:
+                        await run_manager.on_llm_new_token(generation_chunk.text, chunk=generation_chunk)
+                    yield generation_chunk
+        except openai.BadRequestError as e:
+            _handle_openai_bad_request(e)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate a chat result; with `streaming=True` the stream is aggregated by `_generate_from_chunks`."""
+        if self.streaming:
+            return _generate_from_chunks(
+                self._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            )
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Async variant of `_generate`."""
+        if self.streaming:
+            chunks = [
+                chunk
+                async for chunk in self._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            ]
+            return _generate_from_chunks(chunks)
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
@@ -0,0 +1,293 @@
+"""
+Client-side admission control for LLM endpoints.
+
+Every endpoint (base_url + model) gets one ``RateLimiter`` shared by all agents in the process,
+holding two token buckets: requests per minute and tokens per minute. A call reserves one request
+and its estimated tokens (prompt estimate + max output, capped by the model's token limit)
+before it is sent. Reservations are handed out in arrival order: when a bucket is empty the
+reservation goes into debt and the caller sleeps until the debt is repaid, so callers queue
+fairly and the endpoint is paced at its limit instead of being hit by retry storms. After the
+call the estimate is reconciled with the real ``usage_metadata``.
+
+Configured per ``*_MODEL`` block (or per entry in its ``endpoints``) in conf.yaml:
+
+    BASIC_MODEL:
+      requests_per_minute: 60
+      tokens_per_minute: 100000
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from src.llms.metrics import record_queue_wait
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+# Output tokens assumed for a call that does not set max_tokens
+DEFAULT_OUTPUT_TOKENS = 1024
+
+
+class TokenBucket:
+    """Token bucket that may go into debt; the debt is the wait time of the latest reservation."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def set_rate(self, per_minute: float, now: float) -> None:
+        """Change the rate, keeping the current level (and any debt) within the new capacity."""
+        self._refill(now)
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * self.burst_seconds)
+        self.level = min(self.level, self.capacity)
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take ``amount`` now and return how long the caller has to wait for it."""
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float, now: float) -> None:
+        """Give back (or, if negative, additionally charge) ``amount``."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits of one endpoint."""
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @staticmethod
+    def _updated_bucket(bucket: Optional[TokenBucket], per_minute: Optional[float], now: float) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        if bucket is None:
+            return TokenBucket(per_minute)
+        if bucket.per_minute != per_minute:
+            bucket.set_rate(per_minute, now)
+        return bucket
+
+    def set_limits(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float]) -> None:
+        """Apply changed limits (e.g. after conf.yaml was edited) without dropping queued reservations."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests = self._updated_bucket(self.requests, requests_per_minute, now)
+            self.tokens = self._updated_bucket(self.tokens, tokens_per_minute, now)
+
+    def limits(self) -> Tuple[Optional[float], Optional[float]]:
+        with self._lock:
+            return (
+                self.requests.per_minute if self.requests else None,
+                self.tokens.per_minute if self.tokens else None,
+            )
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1, now))
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.reserve(tokens, now))
+            self.acquired += 1
+            self.total_wait += delay
+            self.max_wait = max(self.max_wait, delay)
+            if delay > 0:
+                self.waiting += 1
+            return delay
+
+    def _done_waiting(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self, tokens: int) -> float:
+        """Block until the call may be sent; returns the time waited."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done_waiting()
+        return delay
+
+    async def aacquire(self, tokens: int) -> float:
+        delay = self._reserve(tokens)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done_waiting()
+        return delay
+
+    def reconcile(self, estimated: int, actual: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        if self.tokens is None or actual is None:
+            return
+        with self._lock:
+            self.tokens.refund(estimated - actual, time.monotonic())
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "queue_depth": self.waiting,
+                "acquired": self.acquired,
+                "avg_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    endpoint: str, model: str, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None
+) -> RateLimiter:
+    """
+    Get the limiter shared by every model that calls ``model`` on ``endpoint``. The limits are
+    those of the endpoint, so the most recently configured values replace the previous ones.
+    """
+    key = (endpoint, model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(f"{endpoint}/{model}", requests_per_minute, tokens_per_minute)
+            return limiter
+    if limiter.limits() != (requests_per_minute or None, tokens_per_minute or None):
+        logger.info(
+            f"Rate limits of {limiter.name} changed to {requests_per_minute} requests/min, "
+            f"{tokens_per_minute} tokens/min"
+        )
+        limiter.set_limits(requests_per_minute, tokens_per_minute)
+    return limiter
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, float]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def estimate_message_tokens(messages: List[BaseMessage]) -> int:
+    """Cheap prompt size estimate (about 4 characters per token plus per-message overhead)."""
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+def _usage_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    if not usage:
+        return None
+    return usage.get("total_tokens") or (usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+
+
+class RateLimitedChatModel(DelegatingChatModel):
+    """Wraps a provider model so every call first takes a reservation from ``limiter``."""
+
+    limiter: RateLimiter
+    token_limit: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+
+    def _estimate(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> int:
+        output = kwargs.get("max_tokens") or self.max_output_tokens or DEFAULT_OUTPUT_TOKENS
+        estimate = estimate_message_tokens(messages) + output
+        return min(estimate, self.token_limit) if self.token_limit else estimate
+
+    @staticmethod
+    def _result_tokens(result: ChatResult) -> Optional[int]:
+        usage = (result.llm_output or {}).get("token_usage")
+        if result.generations:
+            usage = getattr(result.generations[0].message, "usage_metadata", None) or usage
+        return _usage_tokens(usage)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        estimate = self._estimate(messages, kwargs)
+        waited = self.limiter.acquire(estimate)
+        if run_manager:
+            record_queue_wait(run_manager.run_id, waited)
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self.limiter.reconcile(estimate, self._result_tokens(result))
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        estimate = self._estimate(messages, kwargs)
+        waited = await self.limiter.aacquire(estimate)
+        if run_manager:
+            record_queue_wait(run_manager.run_id, waited)
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self.limiter.reconcile(estimate, self._result_tokens(result))
+        return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        estimate = self._estimate(messages, kwargs)
+        waited = self.limiter.acquire(estimate)
+        if run_manager:
+            record_queue_wait(run_manager.run_id, waited)
+        used = None
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            tokens = _usage_tokens(getattr(chunk.message, "usage_metadata", None))
+            if tokens is not None:
+                used = (used or 0) + tokens
+            yield chunk
+        self.limiter.reconcile(estimate, used)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        estimate = self._estimate(messages, kwargs)
+        waited = await self.limiter.aacquire(estimate)
+        if run_manager:
+            record_queue_wait(run_manager.run_id, waited)
+        used = None
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            tokens = _usage_tokens(getattr(chunk.message, "usage_metadata", None))
+            if tokens is not None:
+                used = (used or 0) + tokens
+            yield chunk
+        self.limiter.reconcile(estimate, used)
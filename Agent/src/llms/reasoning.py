@@ -0,0 +1,353 @@
+"""
+Retention policy for the reasoning content of reasoning models (DashScope, DeepSeek).
+
+Providers put the full chain of thought into ``additional_kwargs["reasoning_content"]`` of every
+answer, from where it travels through LangGraph state, the checkpointer and every later prompt.
+``ReasoningRetention`` decides what is kept once an answer is complete:
+
+    keep        leave it as is (default)
+    drop        remove it
+    truncate    keep the head and tail, max_chars in total
+    summarize   keep an extractive summary (first and last sentences, summary_chars in total)
+    offload     move it to a side store and keep only ``additional_kwargs["reasoning_ref"]``
+                (the message id), see ``get_reasoning(ref)``
+
+The policy is applied at the provider boundary by ``create_reasoning_retention_class``: the
+streamed chunks still reach the callbacks (and so the UI) with their reasoning deltas, while the
+chunks that are aggregated into the message only carry what the policy keeps.
+``apply_prompt_template`` applies the same policy to history that is sent again. Configured in
+conf.yaml:
+
+    REASONING_RETENTION:
+      mode: offload
+      max_chars: 2000
+      summary_chars: 600
+      store_dir: .reasoning          # offload only; in-memory LRU when not set
+      max_entries: 1000
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, ClassVar, Dict, Iterable, Iterator, List, Optional, Type
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+RETENTION_MODES = ("keep", "drop", "truncate", "summarize", "offload")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？\n])\s*")
+
+
+class ReasoningStore:
+    """
+    Side store for offloaded reasoning: in-memory LRU, or one file per entry under ``directory``
+    (least recently used files are deleted beyond ``max_entries``). The use order of the files is
+    read from their mtimes once, then kept in memory, so a write only evicts the overflow.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 1000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        # directory mode: file path -> None, least recently used first
+        self._files: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_files()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".txt")
+
+    def _load_files(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".txt"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        for _, path in sorted(entries):
+            self._files[path] = None
+
+    def _touch_file(self, path: str) -> None:
+        self._files[path] = None
+        self._files.move_to_end(path)
+
+    def __contains__(self, key: str) -> bool:
+        if self.directory:
+            return os.path.exists(self._path(key))
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: str, text: str) -> None:
+        if self.directory:
+            path = self._path(key)
+            with self._lock:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                self._touch_file(path)
+                while len(self._files) > self.max_entries:
+                    evicted, _ = self._files.popitem(last=False)
+                    try:
+                        os.remove(evicted)
+                    except FileNotFoundError:
+                        pass
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+                # reading counts as a use for eviction
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._touch_file(path)
+            return text
+        with self._lock:
+            return self._entries.get(key)
+
+
+class ReasoningRetention:
+    """What to keep of ``reasoning_content`` once an answer is complete."""
+
+    def __init__(
+        self,
+        mode: str = "keep",
+        max_chars: int = 2000,
+        summary_chars: int = 600,
+        store: Optional[ReasoningStore] = None,
+    ):
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"Unknown reasoning retention mode '{mode}', expected one of {RETENTION_MODES}")
+        self.mode = mode
+        self.max_chars = max_chars
+        self.summary_chars = summary_chars
+        self.store = store or ReasoningStore()
+
+    @property
+    def active(self) -> bool:
+        return self.mode != "keep"
+
+    def _truncate(self, text: str) -> str:
+        if len(text) <= self.max_chars:
+            return text
+        head = self.max_chars * 2 // 3
+        tail = self.max_chars - head
+        return f"{text[:head]}\n[... {len(text) - head - tail} characters of reasoning omitted ...]\n{text[-tail:]}"
+
+    def _summarize(self, text: str) -> str:
+        if len(text) <= self.summary_chars:
+            return text
+        sentences = [s for s in _SENTENCE_END.split(text) if s.strip()]
+        budget = self.summary_chars // 2
+        head: List[str] = []
+        used = 0
+        for sentence in sentences:
+            if head and used + len(sentence) > budget:
+                break
+            head.append(sentence)
+            used += len(sentence)
+        tail: List[str] = []
+        used = 0
+        for sentence in reversed(sentences[len(head):]):
+            if tail and used + len(sentence) > budget:
+                break
+            tail.insert(0, sentence)
+            used += len(sentence)
+        return self._truncate(" ".join(head) + " [...] " + " ".join(tail))
+
+    def retain(self, reasoning: str, key: Optional[str] = None) -> Dict[str, Any]:
+        """The additional_kwargs entries to keep for the full ``reasoning`` of one message."""
+        if self.mode == "keep":
+            return {"reasoning_content": reasoning}
+        if self.mode == "drop":
+            return {}
+        if self.mode == "truncate":
+            return {"reasoning_content": self._truncate(reasoning)}
+        if self.mode == "summarize":
+            return {"reasoning_content": self._summarize(reasoning)}
+        key = key or f"reasoning-{uuid.uuid4().hex}"
+        self.store.put(key, reasoning)
+        return {"reasoning_ref": key}
+
+    def apply(self, message: BaseMessage) -> BaseMessage:
+        """Copy of ``message`` with its reasoning retained according to the policy."""
+        reasoning = message.additional_kwargs.get("reasoning_content") if isinstance(message, AIMessage) else None
+        if not self.active or not reasoning:
+            return message
+        additional_kwargs = {k: v for k, v in message.additional_kwargs.items() if k != "reasoning_content"}
+        if self.mode == "offload" and (
+            "reasoning_ref" in additional_kwargs or (message.id and message.id in self.store)
+        ):
+            # already offloaded (history is rendered again for every prompt): don't store it again
+            additional_kwargs.setdefault("reasoning_ref", message.id)
+        else:
+            additional_kwargs.update(self.retain(reasoning, message.id))
+        return message.model_copy(update={"additional_kwargs": additional_kwargs})
+
+    def apply_history(self, messages: Iterable[Any]) -> List[Any]:
+        """Apply the policy to every message of a history that is about to be sent again."""
+        if not self.active:
+            return list(messages)
+        return [self.apply(m) if isinstance(m, AIMessage) else m for m in messages]
+
+    # ------------------------------------------------------------------ streaming
+
+    def _strip(self, chunk: ChatGenerationChunk, parts: List[str], ids: List[str]) -> ChatGenerationChunk:
+        message = chunk.message
+        if message.id and not ids:
+            ids.append(message.id)
+        reasoning = message.additional_kwargs.get("reasoning_content")
+        if not reasoning:
+            return chunk
+        parts.append(reasoning)
+        additional_kwargs = {k: v for k, v in message.additional_kwargs.items() if k != "reasoning_content"}
+        return ChatGenerationChunk(
+            message=message.model_copy(update={"additional_kwargs": additional_kwargs}),
+            generation_info=chunk.generation_info,
+        )
+
+    def _final_chunk(self, parts: List[str], ids: List[str], key: Optional[str]) -> Optional[ChatGenerationChunk]:
+        if not parts:
+            return None
+        # same key as a non-streamed answer (the message id) when the provider sets one
+        retained = self.retain("".join(parts), ids[0] if ids else key)
+        if not retained:
+            return None
+        return ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs=retained))
+
+    def filter_stream(
+        self, chunks: Iterator[ChatGenerationChunk], key: Optional[str] = None
+    ) -> Iterator[ChatGenerationChunk]:
+        """
+        Strip reasoning deltas from ``chunks`` and append one chunk with the retained reasoning.
+        Offloaded reasoning is stored under the message id, or ``key`` when the chunks have none.
+        """
+        parts: List[str] = []
+        ids: List[str] = []
+        for chunk in chunks:
+            yield self._strip(chunk, parts, ids)
+        final = self._final_chunk(parts, ids, key)
+        if final is not None:
+            yield final
+
+    async def afilter_stream(
+        self, chunks: AsyncIterator[ChatGenerationChunk], key: Optional[str] = None
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        parts: List[str] = []
+        ids: List[str] = []
+        async for chunk in chunks:
+            yield self._strip(chunk, parts, ids)
+        final = self._final_chunk(parts, ids, key)
+        if final is not None:
+            yield final
+
+
+class ReasoningRetentionMixin:
+    """
+    Applies ``reasoning_retention`` to the results of a provider model. The provider's own
+    ``_stream`` reports every chunk to the callbacks before it is filtered here.
+    """
+
+    reasoning_retention: ClassVar[ReasoningRetention]
+
+    def _create_chat_result(self, response: Any, generation_info: Optional[Dict[str, Any]] = None) -> ChatResult:
+        result = super()._create_chat_result(response, generation_info)
+        for generation in result.generations:
+            generation.message = self.reasoning_retention.apply(generation.message)
+        return result
+
+    def _stream(self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        chunks = super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        yield from self.reasoning_retention.filter_stream(chunks, _run_key(run_manager))
+
+    async def _astream(
+        self, messages: Any, stop: Any = None, run_manager: Any = None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        async for chunk in self.reasoning_retention.afilter_stream(chunks, _run_key(run_manager)):
+            yield chunk
+
+
+def _run_key(run_manager: Any) -> Optional[str]:
+    """Key of a streamed answer without a provider message id: its run id, as LangChain ids the message."""
+    return f"run-{run_manager.run_id}" if run_manager else None
+
+
+_retention_classes: Dict[tuple, type] = {}
+_retention_classes_lock = threading.Lock()
+
+
+def create_reasoning_retention_class(base: Type, retention: ReasoningRetention) -> Type:
+    """Subclass of the provider class ``base`` that applies ``retention`` (``base`` itself for keep)."""
+    if not retention.active:
+        return base
+    key = (base, id(retention))
+    with _retention_classes_lock:
+        cls = _retention_classes.get(key)
+        if cls is None:
+            cls = _retention_classes[key] = type(
+                base.__name__,
+                (ReasoningRetentionMixin, base),
+                {
+                    "__module__": base.__module__,
+                    "__annotations__": {"reasoning_retention": ClassVar[ReasoningRetention]},
+                    "reasoning_retention": retention,
+                },
+            )
+        return cls
+
+
+_retentions: Dict[str, ReasoningRetention] = {}
+_retentions_lock = threading.Lock()
+
+
+def get_reasoning_retention(conf: Optional[Dict[str, Any]] = None) -> ReasoningRetention:
+    """
+    The policy of the REASONING_RETENTION section of conf.yaml (``conf``, or the current conf.yaml).
+    Policies are shared per configuration so offloaded reasoning stays retrievable.
+    """
+    if conf is None:
+        from src.llms.llm import _load_llm_config
+
+        conf = _load_llm_config().get("REASONING_RETENTION") or {}
+    key = json.dumps(dict(conf), sort_keys=True, default=str)
+    with _retentions_lock:
+        retention = _retentions.get(key)
+        if retention is None:
+            retention = _retentions[key] = ReasoningRetention(
+                mode=str(conf.get("mode", "keep")).lower(),
+                max_chars=int(conf.get("max_chars", 2000)),
+                summary_chars=int(conf.get("summary_chars", 600)),
+                store=ReasoningStore(conf.get("store_dir"), int(conf.get("max_entries", 1000))),
+            )
+        return retention
+
+
+def get_reasoning(ref: str) -> Optional[str]:
+    """Full reasoning of an offloaded message, by its ``reasoning_ref``."""
+    with _retentions_lock:
+        retentions = list(_retentions.values())
+    for retention in retentions:
+        text = retention.store.get(ref)
+        if text is not None:
+            return text
+    return None
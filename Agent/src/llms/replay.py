@@ -0,0 +1,327 @@
+"""
+Record/replay HTTP transport for deterministic, offline LLM runs.
+
+In ``record`` mode every provider request goes to the real endpoint and its (streaming) response
+is captured chunk by chunk, with the delay before each chunk, into a JSON fixture. In ``replay``
+mode no network is used: responses are served from the fixtures, byte for byte (Dashscope
+``reasoning_content`` and tool-call deltas included), with the recorded timing, a compressed
+timing, or no delays at all.
+
+Fixtures are matched by a hash of the method, URL path, model, messages, tools and stream flag;
+repeated identical requests replay their recordings in order. Authorization headers are never
+written. Enabled in conf.yaml (or with the LLM_HTTP_REPLAY / LLM_HTTP_FIXTURES /
+LLM_HTTP_REPLAY_TIMING environment variables, which take precedence):
+
+    HTTP_REPLAY:
+      mode: replay                  # off | record | replay
+      fixtures_dir: fixtures/llm
+      timing: compressed            # original | compressed | none
+      speedup: 10                   # compressed timing: delays divided by this factor
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Request body fields that identify an LLM call
+_KEY_FIELDS = ("model", "messages", "tools", "tool_choice", "stream", "response_format")
+# Response headers that are not worth keeping in a fixture
+_DROPPED_HEADERS = {"date", "set-cookie", "x-request-id", "req-cost-time", "req-arrive-time", "resp-start-time"}
+
+
+class FixtureNotFoundError(RuntimeError):
+    """Replay mode found no recorded response for a request."""
+
+
+@dataclass(frozen=True)
+class ReplayConfig:
+    mode: str = "off"
+    fixtures_dir: str = "fixtures/llm"
+    timing: str = "compressed"
+    speedup: float = 10.0
+
+    @classmethod
+    def from_conf(cls, conf: Optional[Dict[str, Any]]) -> "ReplayConfig":
+        """The HTTP_REPLAY section of conf.yaml, overridden by LLM_HTTP_REPLAY* environment variables."""
+        conf = {k.lower(): v for k, v in (conf or {}).items()}
+        env = {
+            "mode": os.getenv("LLM_HTTP_REPLAY"),
+            "fixtures_dir": os.getenv("LLM_HTTP_FIXTURES"),
+            "timing": os.getenv("LLM_HTTP_REPLAY_TIMING"),
+        }
+        conf.update({k: v for k, v in env.items() if v})
+        config = cls(
+            mode=str(conf.get("mode", cls.mode)).lower(),
+            fixtures_dir=str(conf.get("fixtures_dir", cls.fixtures_dir)),
+            timing=str(conf.get("timing", cls.timing)).lower(),
+            speedup=float(conf.get("speedup", cls.speedup)),
+        )
+        if config.mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unknown HTTP_REPLAY mode '{config.mode}'")
+        if config.timing not in ("original", "compressed", "none"):
+            raise ValueError(f"Unknown HTTP_REPLAY timing '{config.timing}'")
+        return config
+
+    def delay(self, recorded: float) -> float:
+        if self.timing == "original":
+            return recorded
+        if self.timing == "compressed":
+            return recorded / self.speedup
+        return 0.0
+
+
+def request_key(request: httpx.Request) -> str:
+    """Hash of the parts of a request that identify the LLM call."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except ValueError:
+        body = {"raw": hashlib.sha256(request.content).hexdigest()}
+    if isinstance(body, dict):
+        body = {k: body.get(k) for k in _KEY_FIELDS}
+    payload = json.dumps([request.method, request.url.path, body], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _encode(data: bytes) -> str:
+    # surrogateescape keeps arbitrary bytes (e.g. a UTF-8 character split across chunks) lossless
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _decode(text: str) -> bytes:
+    return text.encode("utf-8", "surrogateescape")
+
+
+class FixtureStore:
+    """One JSON file per request key, holding every recorded interaction for that key."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._replayed: Dict[str, int] = {}
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def save(self, key: str, interaction: Dict[str, Any]) -> None:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            interactions = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+            interactions.append(interaction)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(interactions, ensure_ascii=True, indent=1), encoding="utf-8")
+            os.replace(tmp, path)
+
+    def next(self, key: str) -> Dict[str, Any]:
+        """The next recorded interaction for ``key`` (cycling when they are exhausted)."""
+        path = self._path(key)
+        if not path.exists():
+            raise FixtureNotFoundError(f"No recorded LLM response for request {key} in {self.directory}")
+        interactions = json.loads(path.read_text(encoding="utf-8"))
+        with self._lock:
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+        return interactions[index % len(interactions)]
+
+    def interactions(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for path in sorted(self.directory.glob("*.json")):
+            for interaction in json.loads(path.read_text(encoding="utf-8")):
+                yield path.stem, interaction
+
+
+def _request_record(request: httpx.Request) -> Dict[str, Any]:
+    try:
+        body: Any = json.loads(request.content or b"{}")
+    except ValueError:
+        body = _encode(request.content)
+    return {"method": request.method, "url": str(request.url), "body": body}
+
+
+def _response_headers(response: httpx.Response) -> List[Tuple[str, str]]:
+    return [(k, v) for k, v in response.headers.multi_items() if k.lower() not in _DROPPED_HEADERS]
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.chunks: List[Tuple[float, str]] = []
+
+    def __iter__(self) -> Iterator[bytes]:
+        last = time.monotonic()
+        for data in self.stream:
+            now = time.monotonic()
+            self.chunks.append((round(now - last, 6), _encode(data)))
+            last = now
+            yield data
+
+    def close(self) -> None:
+        self.stream.close()
+        self.on_close(self.chunks)
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.chunks: List[Tuple[float, str]] = []
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        last = time.monotonic()
+        async for data in self.stream:
+            now = time.monotonic()
+            self.chunks.append((round(now - last, 6), _encode(data)))
+            last = now
+            yield data
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+        self.on_close(self.chunks)
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, chunks: List[Tuple[float, str]], config: ReplayConfig):
+        self.chunks = chunks
+        self.config = config
+
+    def __iter__(self) -> Iterator[bytes]:
+        for delay, data in self.chunks:
+            delay = self.config.delay(delay)
+            if delay > 0:
+                time.sleep(delay)
+            yield _decode(data)
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[Tuple[float, str]], config: ReplayConfig):
+        self.chunks = chunks
+        self.config = config
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for delay, data in self.chunks:
+            delay = self.config.delay(delay)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield _decode(data)
+
+
+def _recorder(store: FixtureStore, request: httpx.Request, response: httpx.Response, started: float):
+    key = request_key(request)
+    head = {
+        "status_code": response.status_code,
+        "headers": _response_headers(response),
+        "first_byte": round(time.monotonic() - started, 6),
+    }
+
+    def on_close(chunks: List[Tuple[float, str]]) -> None:
+        if chunks:
+            # the first chunk's delay is measured from the response headers
+            chunks[0] = (round(chunks[0][0] + head["first_byte"], 6), chunks[0][1])
+        store.save(key, {"request": _request_record(request), "response": {**head, "chunks": chunks}})
+
+    return on_close
+
+
+def _replayed_response(store: FixtureStore, request: httpx.Request, stream_class, config: ReplayConfig) -> httpx.Response:
+    recorded = store.next(request_key(request))["response"]
+    return httpx.Response(
+        recorded["status_code"],
+        headers=recorded["headers"],
+        stream=stream_class(recorded["chunks"], config),
+        request=request,
+    )
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Passes requests to ``transport`` and writes every response to ``store``."""
+
+    def __init__(self, transport: httpx.BaseTransport, store: FixtureStore):
+        self.transport = transport
+        self.store = store
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        response = self.transport.handle_request(request)
+        stream = _RecordingStream(response.stream, _recorder(self.store, request, response, started))
+        return httpx.Response(
+            response.status_code, headers=response.headers, stream=stream, extensions=response.extensions
+        )
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, store: FixtureStore):
+        self.transport = transport
+        self.store = store
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        stream = _AsyncRecordingStream(response.stream, _recorder(self.store, request, response, started))
+        return httpx.Response(
+            response.status_code, headers=response.headers, stream=stream, extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """Serves responses from ``store`` without any network access."""
+
+    def __init__(self, store: FixtureStore, config: ReplayConfig):
+        self.store = store
+        self.config = config
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        return _replayed_response(self.store, request, _ReplayStream, self.config)
+
+
+class AsyncReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, store: FixtureStore, config: ReplayConfig):
+        self.store = store
+        self.config = config
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        return _replayed_response(self.store, request, _AsyncReplayStream, self.config)
+
+
+_stores: Dict[str, FixtureStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_fixture_store(directory: str) -> FixtureStore:
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = FixtureStore(directory)
+        return store
+
+
+def wrap_transports(
+    transport: httpx.BaseTransport, async_transport: httpx.AsyncBaseTransport, config: ReplayConfig
+) -> Tuple[httpx.BaseTransport, httpx.AsyncBaseTransport]:
+    """Put the record or replay layer configured by ``config`` in front of the pool transports."""
+    if config.mode == "off":
+        return transport, async_transport
+    store = get_fixture_store(config.fixtures_dir)
+    if config.mode == "record":
+        logger.info(f"Recording LLM responses to {config.fixtures_dir}")
+        return RecordingTransport(transport, store), AsyncRecordingTransport(async_transport, store)
+    logger.info(f"Replaying LLM responses from {config.fixtures_dir} (timing: {config.timing})")
+    return ReplayTransport(store, config), AsyncReplayTransport(store, config)
@@ -0,0 +1,303 @@
+"""
+Load balancing and failover across several endpoints of one LLM type.
+
+A ``*_MODEL`` block in conf.yaml may list several endpoints; keys in each endpoint override the
+shared keys of the block:
+
+    BASIC_MODEL:
+      model: qwen-max
+      endpoints:
+        - base_url: https://dashscope.aliyuncs.com/compatible-mode/v1
+          api_key: $DASHSCOPE_API_KEY
+          weight: 2
+        - base_url: https://backup.example.com/v1
+          api_key: $BACKUP_API_KEY
+          model: qwen-max-backup
+
+``RoutedChatModel`` sends each call to the healthy endpoint with the lowest
+``(outstanding + 1) * latency / weight`` score, where latency is an EWMA of observed call
+durations. Rate limits (429), server errors (5xx) and connection errors count as failures: after
+``failure_threshold`` consecutive failures (or immediately on 429) the endpoint's circuit opens
+for ``cooldown`` seconds (or the server's Retry-After) and the call fails over to the next
+endpoint. Streaming calls only fail over before the first chunk has been yielded.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from src.llms.metrics import record_retry
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """One provider model plus its load/health state (guarded by the router's lock)."""
+
+    def __init__(self, name: str, model: BaseChatModel, weight: float = 1.0):
+        self.name = name
+        self.model = model
+        self.weight = max(float(weight), 1e-6)
+        self.outstanding = 0
+        self.latency: Optional[float] = None  # EWMA of call duration in seconds
+        self.failures = 0
+        self.open_until = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def score(self, default_latency: float) -> float:
+        latency = self.latency if self.latency is not None else default_latency
+        return (self.outstanding + 1) * latency / self.weight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "failures": self.failures,
+            "circuit_open": time.monotonic() < self.open_until,
+        }
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """429, 5xx and transport-level errors are worth retrying on another endpoint."""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, httpx.TransportError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RoutedChatModel(DelegatingChatModel):
+    """Chat model that spreads calls over ``endpoints`` and fails over between them."""
+
+    endpoints: List[Endpoint]
+    failure_threshold: int = 3
+    cooldown: float = 30.0
+    ewma_alpha: float = 0.3
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def delegate(self) -> BaseChatModel:
+        return self.endpoints[0].model
+
+    def endpoint_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+
+    # ------------------------------------------------------------------ endpoint selection
+
+    def _acquire(self, tried: List[Endpoint]) -> Optional[Endpoint]:
+        """Pick the best untried endpoint and count the call as outstanding on it."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in tried]
+            if not candidates:
+                return None
+            available = [e for e in candidates if e.is_available(now)]
+            if available:
+                known = [e.latency for e in available if e.latency is not None]
+                default_latency = sum(known) / len(known) if known else 1.0
+                best = min(e.score(default_latency) for e in available)
+                # weighted random choice among endpoints with (almost) the same score
+                ties = [e for e in available if e.score(default_latency) <= best * 1.05]
+                endpoint = random.choices(ties, weights=[e.weight for e in ties])[0]
+            else:
+                # every circuit is open: try the one that recovers first instead of failing outright
+                endpoint = min(candidates, key=lambda e: e.open_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _release(
+        self, endpoint: Endpoint, started: float, error: Optional[BaseException] = None, cancelled: bool = False
+    ) -> None:
+        """Record the outcome of a call; a cancelled call (e.g. a losing hedge) only frees its slot."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if cancelled:
+                return
+            if error is None:
+                elapsed = time.monotonic() - started
+                endpoint.latency = (
+                    elapsed if endpoint.latency is None
+                    else self.ewma_alpha * elapsed + (1 - self.ewma_alpha) * endpoint.latency
+                )
+                endpoint.failures = 0
+                endpoint.open_until = 0.0
+                return
+            if not is_retryable_error(error):
+                return
+            endpoint.failures += 1
+            if _status_code(error) == 429 or endpoint.failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + (_retry_after(error) or self.cooldown)
+                logger.warning(f"Circuit opened for LLM endpoint '{endpoint.name}': {error!r}")
+
+    def _attempt_failed(self, endpoint: Endpoint, started: float, error: Exception, run_manager: Any) -> Exception:
+        """Record a failed attempt; re-raise unless it is worth failing over."""
+        self._release(endpoint, started, error)
+        if not is_retryable_error(error):
+            raise error
+        if run_manager:
+            record_retry(run_manager.run_id)
+        logger.warning(f"LLM endpoint '{endpoint.name}' failed, failing over: {error!r}")
+        return error
+
+    def _call_with_failover(self, call: Callable[[BaseChatModel], Any], run_manager: Any = None) -> Any:
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("No LLM endpoints configured")
+            tried.append(endpoint)
+            started = time.monotonic()
+            try:
+                result = call(endpoint.model)
+            except Exception as e:
+                last_error = self._attempt_failed(endpoint, started, e, run_manager)
+                continue
+            self._release(endpoint, started)
+            return result
+
+    async def _acall_with_failover(self, call: Callable[[BaseChatModel], Any], run_manager: Any = None) -> Any:
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("No LLM endpoints configured")
+            tried.append(endpoint)
+            started = time.monotonic()
+            try:
+                result = await call(endpoint.model)
+            except Exception as e:
+                last_error = self._attempt_failed(endpoint, started, e, run_manager)
+                continue
+            self._release(endpoint, started)
+            return result
+
+    # ------------------------------------------------------------------ BaseChatModel hooks
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self._call_with_failover(
+            lambda model: model._generate(messages, stop=stop, run_manager=run_manager, **kwargs), run_manager
+        )
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self._acall_with_failover(
+            lambda model: model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs), run_manager
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # fail over only while waiting for the first chunk; later errors go to the caller
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("No LLM endpoints configured")
+            tried.append(endpoint)
+            started = time.monotonic()
+            iterator = endpoint.model._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            try:
+                chunk = next(iterator, None)
+            except Exception as e:
+                last_error = self._attempt_failed(endpoint, started, e, run_manager)
+                continue
+            break
+
+        # the call stays outstanding on the endpoint until the stream ends or is closed
+        error: Optional[BaseException] = None
+        completed = False
+        try:
+            if chunk is not None:
+                yield chunk
+                yield from iterator
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(endpoint, started, error, cancelled=not completed and error is None)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        tried: List[Endpoint] = []
+        last_error: Optional[BaseException] = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("No LLM endpoints configured")
+            tried.append(endpoint)
+            started = time.monotonic()
+            iterator = endpoint.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                chunk = None
+            except Exception as e:
+                last_error = self._attempt_failed(endpoint, started, e, run_manager)
+                continue
+            break
+
+        error: Optional[BaseException] = None
+        completed = False
+        try:
+            if chunk is not None:
+                yield chunk
+                async for chunk in iterator:
+                    yield chunk
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(endpoint, started, error, cancelled=not completed and error is None)
@@ -0,0 +1,399 @@
+"""
+Semantic response cache for agent LLM calls.
+
+Agents such as the planner and coordinator keep receiving near-duplicate questions. For agents that
+opt in, the system prompt plus the final user turn of each call is embedded and looked up in a local
+vector index; when a previous call with the same model/parameters and exactly the same earlier turns
+scores above ``threshold`` (cosine similarity) its completion is returned instead of calling the
+provider. Earlier turns are part of the partition, so a short follow-up ("yes", "continue") only
+matches within the same conversation. Every partition has its own index, so entries of other
+conversations never take the places of a hit among the top ``search_k`` results.
+
+Configured in conf.yaml:
+
+    SEMANTIC_CACHE:
+      agents: [planner, coordinator]     # AGENT_LLM_MAP keys that use the cache
+      provider: dashscope                # dashscope | openai
+      model: text-embedding-v3
+      api_key: $DASHSCOPE_API_KEY
+      base_url:                          # optional, OpenAI compatible endpoints only
+      threshold: 0.95
+      ttl: 86400                         # seconds, 0 disables expiry
+      max_entries: 5000                  # least recently used entries are evicted beyond this
+      index: numpy                       # numpy | faiss
+
+Responses that contain tool calls are never cached (their call ids must not be replayed).
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.llms.wrappers import DelegatingChatModel
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """Inner-product index over L2-normalised vectors, so scores are cosine similarities."""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self.ids: List[int] = []
+        # rows beyond len(ids) are spare capacity; it doubles when full, so adding is amortised O(1)
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: len(self.ids)]
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        size = len(self.ids)
+        if size == self._vectors.shape[0]:
+            grown = np.zeros((max(2 * size, 1), self.dim), dtype=np.float32)
+            grown[:size] = self._vectors
+            self._vectors = grown
+        self._vectors[size] = vector
+        self.ids.append(entry_id)
+
+    def remove(self, entry_ids: List[int]) -> None:
+        drop = set(entry_ids)
+        keep = [i for i, entry_id in enumerate(self.ids) if entry_id not in drop]
+        if len(keep) == len(self.ids):
+            return
+        self._vectors[: len(keep)] = self._vectors[keep]
+        self.ids = [self.ids[i] for i in keep]
+
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not self.ids:
+            return []
+        scores = self.vectors @ vector
+        top = np.argsort(-scores)[:k]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+class FaissVectorIndex(VectorIndex):
+    """Same interface backed by FAISS (IndexFlatIP), for large caches."""
+
+    def __init__(self, dim: int):
+        import faiss
+
+        self.dim = dim
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        self.index.add_with_ids(vector[None, :], np.array([entry_id], dtype=np.int64))
+
+    def remove(self, entry_ids: List[int]) -> None:
+        self.index.remove_ids(np.array(entry_ids, dtype=np.int64))
+
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if self.index.ntotal == 0:
+            return []
+        scores, ids = self.index.search(vector[None, :], min(k, self.index.ntotal))
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+
+class SemanticCache:
+    """
+    Args:
+        embeddings: LangChain embeddings used for the lookup text
+        threshold: minimum cosine similarity for a hit
+        ttl: entry lifetime in seconds (None or 0 = never expires)
+        max_entries: size bound, least recently used entries are evicted first
+        index: "numpy" or "faiss"
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.95,
+        ttl: Optional[float] = 24 * 3600,
+        max_entries: int = 5000,
+        index: str = "numpy",
+        search_k: int = 8,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl or None
+        self.max_entries = max_entries
+        self.index_type = index
+        self.search_k = search_k
+        # one index per partition, so entries of other conversations / parameters never crowd out a hit
+        self._indexes: Dict[str, VectorIndex] = {}
+        # entry id -> (partition, result, created); ordered by last access
+        self._entries: "OrderedDict[int, Tuple[str, ChatResult, float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _new_index(self, dim: int) -> VectorIndex:
+        if self.index_type == "faiss":
+            try:
+                return FaissVectorIndex(dim)
+            except ImportError:
+                logger.warning("SEMANTIC_CACHE.index is 'faiss' but faiss is not installed, using numpy")
+        return VectorIndex(dim)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def embed(self, text: str) -> np.ndarray:
+        return self._normalize(self.embeddings.embed_query(text))
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return self._normalize(await self.embeddings.aembed_query(text))
+
+    def lookup(self, vector: np.ndarray, partition: str) -> Optional[ChatResult]:
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(partition)
+            if index is None:
+                self.misses += 1
+                return None
+            expired = []
+            for entry_id, score in index.search(vector, self.search_k):
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if self.ttl is not None and now - entry[2] > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                if score >= self.threshold:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self._remove(expired)
+                    return entry[1].model_copy(deep=True)
+            self._remove(expired)
+            self.misses += 1
+            return None
+
+    def store(self, vector: np.ndarray, partition: str, result: ChatResult) -> None:
+        with self._lock:
+            index = self._indexes.get(partition)
+            if index is None:
+                index = self._indexes[partition] = self._new_index(vector.shape[0])
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add(entry_id, vector)
+            self._entries[entry_id] = (partition, result.model_copy(deep=True), time.time())
+            if len(self._entries) > self.max_entries:
+                self._remove(list(self._entries)[: len(self._entries) - self.max_entries])
+
+    def _remove(self, entry_ids: List[int]) -> None:
+        by_partition: Dict[str, List[int]] = {}
+        for entry_id in entry_ids:
+            entry = self._entries.pop(entry_id, None)
+            if entry is not None:
+                by_partition.setdefault(entry[0], []).append(entry_id)
+        for partition, ids in by_partition.items():
+            index = self._indexes[partition]
+            index.remove(ids)
+            if not len(index):
+                del self._indexes[partition]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "partitions": len(self._indexes),
+            }
+
+
+def _last_human_index(messages: List[BaseMessage]) -> Optional[int]:
+    return next((i for i in range(len(messages) - 1, -1, -1) if messages[i].type == "human"), None)
+
+
+def lookup_text(messages: List[BaseMessage]) -> str:
+    """System prompt(s) plus the final user turn."""
+    system = [str(m.content) for m in messages if m.type == "system"]
+    last = _last_human_index(messages)
+    user = str(messages[last].content) if last is not None else ""
+    return "\n\n".join(system + [user])
+
+
+def history_key(messages: List[BaseMessage]) -> List[Any]:
+    """The turns that are not embedded (everything but system prompts and the final user turn)."""
+    last = _last_human_index(messages)
+    return [
+        [m.type, m.content, getattr(m, "tool_calls", None)]
+        for i, m in enumerate(messages)
+        if m.type != "system" and i != last
+    ]
+
+
+def _cacheable(result: ChatResult) -> bool:
+    message = result.generations[0].message if result.generations else None
+    return isinstance(message, AIMessage) and not message.tool_calls and bool(message.content)
+
+
+def _chunk_to_result(chunk: ChatGenerationChunk) -> ChatResult:
+    message = chunk.message
+    return ChatResult(
+        generations=[
+            ChatGeneration(
+                message=AIMessage(
+                    content=message.content,
+                    additional_kwargs=dict(message.additional_kwargs),
+                    response_metadata=dict(message.response_metadata),
+                    tool_calls=list(getattr(message, "tool_calls", []) or []),
+                )
+            )
+        ]
+    )
+
+
+def _result_to_chunk(result: ChatResult) -> ChatGenerationChunk:
+    message = result.generations[0].message
+    return ChatGenerationChunk(
+        message=AIMessageChunk(content=message.content, additional_kwargs=dict(message.additional_kwargs)),
+        generation_info={"semantic_cache_hit": True},
+    )
+
+
+class SemanticCacheChatModel(DelegatingChatModel):
+    """Serves near-duplicate calls from ``cache``; everything else goes to ``inner``."""
+
+    cache: SemanticCache
+
+    def _partition(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> str:
+        # Only calls with the same model, parameters, bound tools and earlier turns can share answers
+        payload = json.dumps(
+            {
+                "model": self.delegate()._identifying_params,
+                "stop": stop,
+                "kwargs": kwargs,
+                "history": history_key(messages),
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        vector, partition = self.cache.embed(lookup_text(messages)), self._partition(messages, stop, kwargs)
+        cached = self.cache.lookup(vector, partition)
+        if cached is not None:
+            return cached
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        if _cacheable(result):
+            self.cache.store(vector, partition, result)
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        vector, partition = await self.cache.aembed(lookup_text(messages)), self._partition(messages, stop, kwargs)
+        cached = self.cache.lookup(vector, partition)
+        if cached is not None:
+            return cached
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        if _cacheable(result):
+            self.cache.store(vector, partition, result)
+        return result
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        vector, partition = self.cache.embed(lookup_text(messages)), self._partition(messages, stop, kwargs)
+        cached = self.cache.lookup(vector, partition)
+        if cached is not None:
+            chunk = _result_to_chunk(cached)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+        final: Optional[ChatGenerationChunk] = None
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            final = chunk if final is None else final + chunk
+            yield chunk
+        if final is not None:
+            result = _chunk_to_result(final)
+            if _cacheable(result):
+                self.cache.store(vector, partition, result)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        vector, partition = await self.cache.aembed(lookup_text(messages)), self._partition(messages, stop, kwargs)
+        cached = self.cache.lookup(vector, partition)
+        if cached is not None:
+            chunk = _result_to_chunk(cached)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+        final: Optional[ChatGenerationChunk] = None
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            final = chunk if final is None else final + chunk
+            yield chunk
+        if final is not None:
+            result = _chunk_to_result(final)
+            if _cacheable(result):
+                self.cache.store(vector, partition, result)
+
+
+def create_embeddings(conf: Dict[str, Any]) -> Embeddings:
+    """Embeddings for the SEMANTIC_CACHE section (DashScope like Langchain/LangChain09.py, or OpenAI compatible)."""
+    provider = str(conf.get("provider", "dashscope")).lower()
+    if provider == "dashscope":
+        from langchain_community.embeddings import DashScopeEmbeddings
+
+        return DashScopeEmbeddings(model=conf.get("model", "text-embedding-v3"), dashscope_api_key=conf.get("api_key"))
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(
+            model=conf.get("model", "text-embedding-3-small"), api_key=conf.get("api_key"), base_url=conf.get("base_url")
+        )
+    raise ValueError(f"Unknown SEMANTIC_CACHE provider: {provider}")
+
+
+def create_semantic_cache(conf: Dict[str, Any]) -> SemanticCache:
+    return SemanticCache(
+        create_embeddings(conf),
+        threshold=float(conf.get("threshold", 0.95)),
+        ttl=float(conf.get("ttl", 24 * 3600) or 0),
+        max_entries=int(conf.get("max_entries", 5000)),
+        index=str(conf.get("index", "numpy")).lower(),
+    )
@@ -7,6 +7,7 @@ from jinja2 import Environment, FileSystemLoader, TemplateNotFound, select_autoe
 from langgraph.prebuilt.chat_agent_executor import AgentState
 
 from src.config.configuration import Configuration
+from src.llms.reasoning import get_reasoning_retention
 
 # 初始化Jinja2环境
 env = Environment(
@@ -57,7 +58,8 @@ def apply_prompt_template(
         locale: Language locale for template selection (e.g., en-US, zh-CN)
 
     Returns:
-        List of messages with the system prompt as the first message
+        List of messages with the system prompt as the first message; the reasoning content of
+        earlier AI messages is retained according to REASONING_RETENTION (see src/llms/reasoning.py)
     """
     # Convert state to dict for template rendering
     state_vars = {
@@ -81,6 +83,7 @@ def apply_prompt_template(
             template = env.get_template(f"{prompt_name}.md")
         
         system_prompt = template.render(**state_vars)
-        return [{"role": "system", "content": system_prompt}] + state["messages"]
+        history = get_reasoning_retention().apply_history(state["messages"])
+        return [{"role": "system", "content": system_prompt}] + history
     except Exception as e:
         raise ValueError(f"Error applying template {prompt_name} for locale {locale}: {e}")
\ No newline at end of file
@@ -15,7 +15,7 @@ import aiohttp
 import requests
 from langchain_core.utils import get_from_dict_or_env
 from pydantic import BaseModel, ConfigDict, SecretStr, model_validator
-from src.config import load_yaml_config
+from src.config import get_config_file_path, load_yaml_config
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,9 +35,8 @@ def get_search_config():
         dict: 搜索引擎配置字典，包含 API 密钥、默认参数等配置项。
               如果配置文件中没有 SEARCH_ENGINE 节，则返回空字典。
     """
-    config = load_yaml_config("conf.yaml")
-    search_config = config.get("SEARCH_ENGINE", {})
-    return search_config
+    # 和 llm.py 读同一个 conf.yaml；配置服务有缓存，文件变化后自动读到新版本
+    return load_yaml_config(get_config_file_path()).get("SEARCH_ENGINE", {})
 
 class InfoQuestAPIWrapper(BaseModel):
     """est搜索API的包装"""
@@ -8,14 +8,13 @@ from langchain_tavily.tavily_search import (
     TavilySearchAPIWrapper as OriginalTavilySearchAPIWrapper,
 )
 
-from src.config import load_yaml_config
+from src.config import get_config_file_path, load_yaml_config
 from src.tools.search_postprocessor import SearchResultPostProcessor
 
 
 def get_search_config():
-    config = load_yaml_config("conf.yaml")
-    search_config = config.get("SEARCH_ENGINE", {})
-    return search_config
+    # 和 llm.py 读同一个 conf.yaml；配置服务有缓存，文件变化后自动读到新版本
+    return load_yaml_config(get_config_file_path()).get("SEARCH_ENGINE", {})
 
 
 class EnhancedTavilySearchAPIWrapper(OriginalTavilySearchAPIWrapper):
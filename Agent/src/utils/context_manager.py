@@ -0,0 +1,227 @@
+# context manager 用于在调用模型之前把消息裁剪到模型的 token 上限以内，避免上下文过长导致请求失败，也减少浪费的 prompt token
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+# 每条消息除了内容以外的固定开销（role、分隔符等），和 OpenAI 的计数方式一致
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    没有可用的 tokenizer 时的估算：中日韩字符大约 1 个 token，其余字符大约 4 个字符 1 个 token。
+    """
+    cjk = sum(1 for ch in text if "\u3040" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@lru_cache(maxsize=32)
+def get_token_counter(model_name: str) -> Callable[[str], int]:
+    """
+    按模型名返回一个计数函数，结果按模型缓存（tokenizer 只加载一次）：
+        1. tiktoken 认识的模型（OpenAI 系列）用 tiktoken
+        2. 本地已经缓存了的 HuggingFace tokenizer（Qwen、DeepSeek 等）
+        3. 都没有时退回到 estimate_tokens
+    """
+    name = (model_name or "").split("/")[-1]
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(name)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        pass
+
+    if model_name:
+        try:
+            from transformers import AutoTokenizer
+
+            # 只用本地已有的文件，不在请求路径上联网下载
+            tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            pass
+
+    logger.debug(f"No tokenizer available for model '{model_name}', using the estimator")
+    return estimate_tokens
+
+
+def _message_text(message: BaseMessage) -> str:
+    """消息里需要计数的文本：内容加上工具调用的参数"""
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    text = str(content)
+    if isinstance(message, AIMessage) and message.tool_calls:
+        text += "".join(f"{call['name']}{call['args']}" for call in message.tool_calls)
+    return text
+
+
+class TokenCounter:
+    """
+    带缓存的消息 token 计数。每条消息的计数按 (消息 id, 内容 hash) 缓存，
+    多轮对话里每一轮只需要对新增的消息调用 tokenizer。
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 10000):
+        self.model_name = model_name
+        self.count_text = get_token_counter(model_name)
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, message: BaseMessage) -> int:
+        text = _message_text(message)
+        key = (message.id, message.type, hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        tokens = self.count_text(text) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(message) for message in messages)
+
+
+def _truncate_message(message: BaseMessage, counter: TokenCounter, max_tokens: int) -> BaseMessage:
+    """把单条过长的消息（通常是搜索/爬虫工具的返回）按比例截断到 max_tokens 以内"""
+    tokens = counter.count(message)
+    if tokens <= max_tokens or not isinstance(message.content, str):
+        return message
+    keep = max(int(len(message.content) * max_tokens / tokens) - 50, 0)
+    content = message.content[:keep] + f"\n\n[... truncated {tokens - max_tokens} tokens to fit the context window ...]"
+    return message.model_copy(update={"content": content})
+
+
+def _fit_head(head: List[BaseMessage], counter: TokenCounter, budget: int) -> List[BaseMessage]:
+    """必须保留的开头消息本身就超过 budget 时，从后往前（先任务、再 system）截断到 budget 以内"""
+    head = list(head)
+    for i in range(len(head) - 1, -1, -1):
+        others = counter.count_messages(head[:i] + head[i + 1:])
+        head[i] = _truncate_message(head[i], counter, max(budget - others, MESSAGE_OVERHEAD_TOKENS))
+        if counter.count_messages(head) <= budget:
+            break
+    return head
+
+
+def _with_note(head: List[BaseMessage], note: str) -> List[BaseMessage]:
+    """
+    把省略说明加到开头的 system 消息末尾；不少接口（Gemini、Anthropic 兼容接口等）不接受中间位置的
+    system 消息，所以不单独插一条。没有 system 消息时放一条在最前面。
+    """
+    if head and isinstance(head[0], SystemMessage) and isinstance(head[0].content, str):
+        return [head[0].model_copy(update={"content": f"{head[0].content}\n\n{note}"})] + head[1:]
+    return [SystemMessage(content=note)] + head
+
+
+def fit_messages(
+    messages: List[BaseMessage], counter: TokenCounter, budget: int, max_message_fraction: float = 0.5
+) -> List[BaseMessage]:
+    """
+    把消息裁剪到 budget 个 token 以内：
+        - 开头的 system 消息和第一条用户消息（任务本身）始终保留，它们本身就超过 budget 时截断
+        - 单条超过 budget * max_message_fraction 的消息先截断
+        - 其余的从最新的消息往前保留，放不下的旧消息整体丢弃，并在 system 消息里加一句说明
+        - 不会留下没有对应 tool call 的 ToolMessage（否则接口会报错）
+    """
+    if counter.count_messages(messages) <= budget:
+        return messages
+
+    per_message = max(int(budget * max_message_fraction), 1)
+    messages = [_truncate_message(m, counter, per_message) for m in messages]
+
+    head: List[BaseMessage] = []
+    index = 0
+    while index < len(messages) and isinstance(messages[index], SystemMessage):
+        head.append(messages[index])
+        index += 1
+    if index < len(messages) and messages[index].type == "human":
+        head.append(messages[index])
+        index += 1
+
+    if counter.count_messages(head) > budget:
+        head = _fit_head(head, counter, budget)
+    remaining = budget - counter.count_messages(head)
+    tail: List[BaseMessage] = []
+    for message in reversed(messages[index:]):
+        tokens = counter.count(message)
+        if tokens > remaining:
+            break
+        tail.append(message)
+        remaining -= tokens
+    tail.reverse()
+
+    # 保留下来的最早的消息不能是 ToolMessage（它对应的 AIMessage 已经被丢弃了）
+    while tail and isinstance(tail[0], ToolMessage):
+        tail.pop(0)
+
+    dropped = len(messages) - len(head) - len(tail)
+    if dropped:
+        logger.info(f"Context compression dropped {dropped} messages to fit {budget} tokens")
+        note = f"[{dropped} earlier messages were omitted to fit the context window.]"
+        noted = _with_note(head, note)
+        if counter.count_messages(noted) - counter.count_messages(head) <= remaining:
+            head = noted
+    return head + tail
+
+
+class ContextManager:
+    """
+    Args:
+        model_name: 用来选择 tokenizer 的模型名
+        token_limit: 模型的上下文上限（见 get_llm_token_limit_by_type）
+        reserve_tokens: 预留给 system prompt 模板和模型输出的 token 数
+    """
+
+    def __init__(self, model_name: str, token_limit: int, reserve_tokens: int = 8192):
+        self.counter = TokenCounter(model_name)
+        self.token_limit = token_limit
+        # 上限很小的模型至少留一半给消息
+        self.budget = max(token_limit - reserve_tokens, token_limit // 2)
+
+    def fit(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        return fit_messages(messages, self.counter, self.budget)
+
+    def pre_model_hook(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        create_react_agent 的 pre_model_hook：返回 llm_input_messages，只影响这一次模型调用的输入，
+        state["messages"] 里的完整历史保持不变。
+        """
+        return {"llm_input_messages": self.fit(state.get("messages", []))}
+
+
+_context_managers: Dict[Tuple[str, int, int], ContextManager] = {}
+_context_managers_lock = threading.Lock()
+
+
+def get_context_manager(llm_type: str, reserve_tokens: int = 8192) -> ContextManager:
+    """
+    LLM 类型当前配置的模型对应的 ContextManager（共享 tokenizer 和计数缓存）。
+    缓存按解析出来的模型名和 token 上限区分，conf.yaml 里换了模型或 token_limit 之后会拿到新的实例。
+    """
+    from src.llms.llm import get_llm_model_name_by_type, get_llm_token_limit_by_type
+
+    key = (get_llm_model_name_by_type(llm_type), get_llm_token_limit_by_type(llm_type), reserve_tokens)
+    with _context_managers_lock:
+        manager: Optional[ContextManager] = _context_managers.get(key)
+        if manager is None:
+            manager = _context_managers[key] = ContextManager(*key)
+        return manager
+
+
+def get_pre_model_hook(llm_type: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """create_agent 默认使用的 pre_model_hook"""
+    return get_context_manager(llm_type).pre_model_hook
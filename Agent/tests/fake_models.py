@@ -0,0 +1,91 @@
+"""Chat models with scripted latencies and failures, shared by the wrapper tests."""
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Call ``i`` (counted across all APIs) waits ``delays[i]`` seconds (the last delay repeats), then
+    raises ``errors[i]`` if there is one, otherwise answers ``"<model> <i>"``. Streams yield the answer
+    word by word, waiting ``chunk_delay`` between chunks.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: str = "scripted"
+    delays: List[float] = [0.0]
+    errors: Dict[int, BaseException] = {}
+    chunk_delay: float = 0.0
+    calls: int = 0
+
+    _calls_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model}
+
+    def _next(self) -> int:
+        with self._calls_lock:
+            index = self.calls
+            self.calls += 1
+        return index
+
+    def _delay(self, index: int) -> float:
+        return self.delays[min(index, len(self.delays) - 1)]
+
+    def _answer(self, index: int) -> str:
+        if index in self.errors:
+            raise self.errors[index]
+        return f"{self.model} {index}"
+
+    def _words(self, index: int) -> List[str]:
+        words = self._answer(index).split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        index = self._next()
+        time.sleep(self._delay(index))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(index)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        index = self._next()
+        await asyncio.sleep(self._delay(index))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(index)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        index = self._next()
+        time.sleep(self._delay(index))
+        for i, word in enumerate(self._words(index)):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        index = self._next()
+        await asyncio.sleep(self._delay(index))
+        for i, word in enumerate(self._words(index)):
+            if i:
+                await asyncio.sleep(self.chunk_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class StatusError(Exception):
+    """Provider error carrying an HTTP status code (and optionally Retry-After), like openai.APIStatusError."""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers})()
@@ -0,0 +1,120 @@
+"""Batch mode end to end with the in-process MockBatchProvider: MockBatchProvider -> BatchExecutor -> BatchChatModel."""
+
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+
+from src.llms.batch import BatchChatModel, BatchExecutor, MockBatchProvider  # noqa: E402
+
+TIMEOUT = 5.0
+
+
+def make_model(provider, **executor_options):
+    executor = BatchExecutor(provider, poll_interval=0.01, **executor_options)
+    inner = ChatOpenAI(model="gpt-4o-mini", api_key="test", base_url="http://localhost:9/v1", max_retries=0)
+    return BatchChatModel(inner=inner, executor=executor), executor
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_batches_by_size_and_flush():
+    provider = MockBatchProvider()
+    model, executor = make_model(provider, max_batch_size=3, max_wait=60)
+    try:
+        futures = [model.submit([HumanMessage(content=f"q{i}")]) for i in range(7)]
+        wait_until(lambda: len(provider.submitted) == 2)
+        # the seventh request waits for max_wait until it is flushed
+        assert executor.pending()["queued"] == 1
+        executor.flush()
+        results = [future.result(timeout=TIMEOUT) for future in futures]
+    finally:
+        executor.close()
+    assert [len(batch) for batch in provider.submitted] == [3, 3, 1]
+    assert [r.generations[0].message.content for r in results] == [f"mock: q{i}" for i in range(7)]
+
+
+def test_batches_after_max_wait():
+    provider = MockBatchProvider(completion_delay=0.05)
+    model, executor = make_model(provider, max_batch_size=100, max_wait=0.1)
+    try:
+        started = time.monotonic()
+        futures = [model.submit([HumanMessage(content=text)]) for text in ("a", "b")]
+        results = [future.result(timeout=TIMEOUT) for future in futures]
+        elapsed = time.monotonic() - started
+    finally:
+        executor.close()
+    assert [len(batch) for batch in provider.submitted] == [2]
+    assert elapsed >= 0.1
+    assert [r.generations[0].message.content for r in results] == ["mock: a", "mock: b"]
+
+
+def test_call_queued_while_the_worker_is_idle_waits_for_the_batch():
+    provider = MockBatchProvider()
+    model, executor = make_model(provider, max_batch_size=2, max_wait=60)
+    try:
+        first = [model.submit([HumanMessage(content=text)]) for text in ("a", "b")]
+        for future in first:
+            future.result(timeout=TIMEOUT)
+        # the worker now waits on an empty queue; one more call must not be sent on its own
+        model.submit([HumanMessage(content="c")])
+        time.sleep(0.1)
+        assert [len(batch) for batch in provider.submitted] == [2]
+        assert executor.pending()["queued"] == 1
+    finally:
+        executor.close()
+
+
+def test_invoke_blocks_until_the_batch_completes():
+    model, executor = make_model(MockBatchProvider(), max_batch_size=1, max_wait=60)
+    try:
+        assert model.invoke("hello").content == "mock: hello"
+    finally:
+        executor.close()
+
+
+def test_request_errors_reach_their_callers_only():
+    def respond(body):
+        content = body["messages"][-1]["content"]
+        if content == "boom":
+            raise ValueError("bad request")
+        return content.upper()
+
+    provider = MockBatchProvider(respond=respond)
+    model, executor = make_model(provider, max_batch_size=2, max_wait=60)
+    try:
+        ok = model.submit([HumanMessage(content="fine")])
+        bad = model.submit([HumanMessage(content="boom")])
+        assert ok.result(timeout=TIMEOUT).generations[0].message.content == "FINE"
+        with pytest.raises(ValueError, match="bad request"):
+            bad.result(timeout=TIMEOUT)
+    finally:
+        executor.close()
+
+
+def test_submission_errors_fail_the_whole_batch():
+    class FailingProvider(MockBatchProvider):
+        def submit(self, requests):
+            raise RuntimeError("upload failed")
+
+    model, executor = make_model(FailingProvider(), max_batch_size=2, max_wait=60)
+    try:
+        futures = [model.submit([HumanMessage(content=text)]) for text in ("a", "b")]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="upload failed"):
+                future.result(timeout=TIMEOUT)
+    finally:
+        executor.close()
@@ -0,0 +1,163 @@
+"""CoalescingChatModel: one upstream call per identical in-flight request, replayed to every caller."""
+
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessageChunk, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGenerationChunk  # noqa: E402
+
+from src.llms.coalescing import CoalescingChatModel  # noqa: E402
+from tests.fake_models import ScriptedChatModel, StatusError  # noqa: E402
+
+MESSAGES = [HumanMessage(content="hi")]
+
+
+class FailingStreamModel(ScriptedChatModel):
+    """Streams one chunk, then fails."""
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._next()
+        yield ChatGenerationChunk(message=AIMessageChunk(content="partial"))
+        raise StatusError(500)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._next()
+        yield ChatGenerationChunk(message=AIMessageChunk(content="partial"))
+        raise StatusError(500)
+
+
+def text(chunks):
+    return "".join(chunk.text for chunk in chunks)
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    inner = ScriptedChatModel(model="coalesce-generate", delays=[0.2])
+    model = CoalescingChatModel(inner=inner)
+    barrier = threading.Barrier(3)
+    results = []
+
+    def call():
+        barrier.wait()
+        results.append(model.invoke(MESSAGES))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert inner.calls == 1 and model.coalesced_count == 2
+    assert [result.content for result in results] == ["coalesce-generate 0"] * 3
+    assert len({id(result) for result in results}) == 3
+
+
+def test_late_joiner_replays_the_chunks_so_far():
+    inner = ScriptedChatModel(model="coalesce stream a b")
+    model = CoalescingChatModel(inner=inner)
+
+    leader = model._stream(MESSAGES)
+    first = next(leader)
+    follower = model._stream(MESSAGES)
+    # the follower joins after the first chunk and still starts from the beginning
+    replayed = next(follower)
+    assert replayed.text == first.text == "coalesce"
+    assert replayed is not first
+
+    assert text([first, *leader]) == text([replayed, *follower]) == "coalesce stream a b 0"
+    assert inner.calls == 1 and model.coalesced_count == 1
+
+
+def test_leader_error_reaches_the_followers():
+    inner = FailingStreamModel()
+    model = CoalescingChatModel(inner=inner)
+
+    leader = model._stream(MESSAGES)
+    follower = model._stream(MESSAGES)
+    assert next(leader).text == "partial"
+    assert next(follower).text == "partial"
+    with pytest.raises(StatusError):
+        next(leader)
+    with pytest.raises(StatusError):
+        next(follower)
+    assert inner.calls == 1
+
+
+def test_followers_are_served_after_the_leader_stops_reading():
+    inner = ScriptedChatModel(model="coalesce drain a b")
+    model = CoalescingChatModel(inner=inner)
+
+    leader = model._stream(MESSAGES)
+    next(leader)
+    follower = model._stream(MESSAGES)
+    chunks = [next(follower)]
+    leader.close()
+
+    chunks += list(follower)
+    assert text(chunks) == "coalesce drain a b 0"
+    assert inner.calls == 1
+    # the stream is finished, so an identical call goes upstream again
+    assert text(model._stream(MESSAGES)) == "coalesce drain a b 1"
+
+
+def test_async_late_joiner_and_leader_error():
+    async def late_joiner():
+        inner = ScriptedChatModel(model="coalesce async a b")
+        model = CoalescingChatModel(inner=inner)
+        leader = model._astream(MESSAGES)
+        first = await leader.__anext__()
+        follower = model._astream(MESSAGES)
+        replayed = await follower.__anext__()
+        assert replayed.text == first.text and replayed is not first
+        rest = [chunk async for chunk in leader]
+        replayed_rest = [chunk async for chunk in follower]
+        assert text([first, *rest]) == text([replayed, *replayed_rest]) == "coalesce async a b 0"
+        assert inner.calls == 1 and model.coalesced_count == 1
+
+    async def leader_error():
+        inner = FailingStreamModel()
+        model = CoalescingChatModel(inner=inner)
+        leader = model._astream(MESSAGES)
+        follower = model._astream(MESSAGES)
+        assert (await leader.__anext__()).text == "partial"
+        assert (await follower.__anext__()).text == "partial"
+        with pytest.raises(StatusError):
+            await leader.__anext__()
+        with pytest.raises(StatusError):
+            await follower.__anext__()
+        assert inner.calls == 1
+
+    asyncio.run(late_joiner())
+    asyncio.run(leader_error())
+
+
+def test_calls_from_several_event_loops_do_not_interfere():
+    inner = ScriptedChatModel(model="coalesce loops", chunk_delay=0.01)
+    model = CoalescingChatModel(inner=inner)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def run():
+        async def consume():
+            return text([chunk async for chunk in model._astream(MESSAGES)])
+
+        barrier.wait()
+        results.append(asyncio.run(consume()))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # streams are only merged within one event loop, so every loop went upstream
+    assert inner.calls == 4 and len(results) == 4
+    assert all(result.startswith("coalesce loops ") for result in results)
+    assert not model._astreams
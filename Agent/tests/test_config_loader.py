@@ -0,0 +1,119 @@
+"""ConfigService: frozen snapshots, reloads when the file changes, subscribers."""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("yaml")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config.loader import ConfigService  # noqa: E402
+
+TIMEOUT = 5.0
+
+
+def write(path, text, mtime_ns):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_snapshot_is_frozen_at_every_level(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEST_CONFIG_KEY", "secret")
+    path = tmp_path / "conf.yaml"
+    write(path, "BASIC_MODEL:\n  api_key: $TEST_CONFIG_KEY\n  endpoints:\n    - base_url: a\n", 1_000_000_000)
+
+    data = ConfigService(check_interval=0).get(str(path)).data
+    section = data["BASIC_MODEL"]
+    assert section["api_key"] == "secret"
+    assert section["endpoints"][0]["base_url"] == "a"
+    with pytest.raises(TypeError):
+        data["BASIC_MODEL"] = {}
+    with pytest.raises(TypeError):
+        section["api_key"] = "other"
+    with pytest.raises(TypeError):
+        section["endpoints"][0]["base_url"] = "b"
+    with pytest.raises(AttributeError):
+        section["endpoints"].append({})
+    # copies are ordinary dicts
+    merged = {**section, "model": "m"}
+    assert merged["model"] == "m" and "model" not in section
+
+
+def test_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "conf.yaml"
+    write(path, "A: 1\n", 1_000_000_000)
+    service = ConfigService(check_interval=0)
+
+    first = service.get(str(path))
+    assert (first.version, dict(first.data)) == (1, {"A": 1})
+    # unchanged file: the same snapshot, under any spelling of the path
+    assert service.get(str(tmp_path / "." / "conf.yaml")) is first
+
+    write(path, "A: 2\n", 2_000_000_000)
+    second = service.get(str(path))
+    assert (second.version, dict(second.data)) == (2, {"A": 2})
+    assert dict(first.data) == {"A": 1}
+
+
+def test_check_interval_and_invalidate(tmp_path):
+    path = tmp_path / "conf.yaml"
+    write(path, "A: 1\n", 1_000_000_000)
+    service = ConfigService(check_interval=3600)
+    first = service.get(str(path))
+
+    write(path, "A: 2\n", 2_000_000_000)
+    # within the check interval the file is not looked at
+    assert service.get(str(path)) is first
+    service.invalidate(str(path))
+    assert service.get(str(path)).data["A"] == 2
+
+
+def test_invalid_file_keeps_the_previous_snapshot(tmp_path):
+    path = tmp_path / "conf.yaml"
+    write(path, "A: 1\n", 1_000_000_000)
+    service = ConfigService(check_interval=0)
+    first = service.get(str(path))
+
+    write(path, "A: [unclosed\n", 2_000_000_000)
+    assert service.get(str(path)) is first
+
+
+def test_missing_file_is_empty(tmp_path):
+    snapshot = ConfigService(check_interval=0).get(str(tmp_path / "missing.yaml"))
+    assert (snapshot.version, dict(snapshot.data), snapshot.signature) == (1, {}, None)
+
+
+def test_subscribers_are_notified_by_the_watcher(tmp_path):
+    path = tmp_path / "conf.yaml"
+    other = tmp_path / "other.yaml"
+    write(path, "A: 1\n", 1_000_000_000)
+    write(other, "B: 1\n", 1_000_000_000)
+    service = ConfigService(check_interval=0.02)
+    service.get(str(path))
+    service.get(str(other))
+
+    changes = []
+    changed = threading.Event()
+
+    def on_change(snapshot, previous):
+        changes.append((previous.version, snapshot.version, snapshot.data["A"]))
+        changed.set()
+
+    unsubscribe = service.subscribe(on_change, str(path))
+    write(other, "B: 2\n", 2_000_000_000)
+    write(path, "A: 2\n", 2_000_000_000)
+    # nobody reads the file: the watcher thread notices the change
+    assert changed.wait(TIMEOUT)
+    assert changes == [(1, 2, 2)]
+
+    unsubscribe()
+    write(path, "A: 3\n", 3_000_000_000)
+    deadline = time.monotonic() + TIMEOUT
+    while service.get(str(path)).data["A"] != 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert changes == [(1, 2, 2)]
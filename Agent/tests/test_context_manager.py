@@ -0,0 +1,36 @@
+"""get_context_manager: one manager per configured model and token limit."""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llms import llm  # noqa: E402
+from src.utils.context_manager import get_context_manager  # noqa: E402
+
+
+def test_manager_follows_the_configured_model_and_limit(monkeypatch):
+    conf = {"BASIC_MODEL": {"model": "gpt-4o-mini", "token_limit": 50000}}
+    monkeypatch.setattr(llm, "_load_llm_config", lambda: conf)
+
+    manager = get_context_manager("basic")
+    assert get_context_manager("basic") is manager
+    assert manager.token_limit == 50000
+    assert get_context_manager("basic", reserve_tokens=1024) is not manager
+
+    conf["BASIC_MODEL"] = {"model": "gpt-4o-mini", "token_limit": 20000}
+    smaller = get_context_manager("basic")
+    assert smaller is not manager and smaller.token_limit == 20000
+
+    conf["BASIC_MODEL"] = {"model": "deepseek-chat"}
+    switched = get_context_manager("basic")
+    assert switched.token_limit == 100000 and switched is not manager
+
+    # switching back reuses the first manager and its token-count cache
+    conf["BASIC_MODEL"] = {"model": "gpt-4o-mini", "token_limit": 50000}
+    assert get_context_manager("basic") is manager
@@ -0,0 +1,99 @@
+"""ChatDashscope streaming: the lean chunk conversion and aggregation match the stock LangChain path."""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.chat_models import generate_from_stream  # noqa: E402
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+from openai.types.chat import ChatCompletionChunk  # noqa: E402
+
+from src.llms.providers.dashscope import (  # noqa: E402
+    _convert_chunk_to_generation_chunk,
+    _convert_completion_chunk,
+    _generate_from_chunks,
+)
+
+BASE = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "qwen-plus"}
+
+
+def raw(delta, finish_reason=None, usage=None, choices=True):
+    chunk = dict(BASE, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [])
+    if usage is not None:
+        chunk["usage"] = usage
+    return chunk
+
+
+TOOL_CALL = {"index": 0, "id": "call_1", "type": "function", "function": {"name": "web_search", "arguments": ""}}
+
+STREAM_IDS = ["role", "reasoning", "reasoning-2", "empty", "content", "tool-call", "args", "args-2", "finish", "usage"]
+STREAM = [
+    raw({"role": "assistant", "content": ""}),
+    raw({"reasoning_content": "Let me think"}),
+    raw({"reasoning_content": " about it."}),
+    raw({"content": ""}),
+    raw({"content": "Searching"}),
+    raw({"tool_calls": [TOOL_CALL]}),
+    raw({"tool_calls": [{"index": 0, "function": {"arguments": '{"query": "'}}]}),
+    raw({"tool_calls": [{"index": 0, "function": {"arguments": 'weather"}'}}]}),
+    raw({}, finish_reason="tool_calls"),
+    raw(None, usage={"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}, choices=False),
+]
+
+
+def stock(chunk, base_generation_info=None):
+    # ChatOpenAI model_dump()s every ChatCompletionChunk before converting it
+    dumped = ChatCompletionChunk.model_validate(chunk).model_dump()
+    return _convert_chunk_to_generation_chunk(dumped, AIMessageChunk, base_generation_info)
+
+
+def lean(chunk, base_generation_info=None):
+    return _convert_completion_chunk(ChatCompletionChunk.model_validate(chunk), AIMessageChunk, base_generation_info)
+
+
+def message_fields(generation_chunk):
+    message = generation_chunk.message
+    return {
+        "content": message.content,
+        "additional_kwargs": message.additional_kwargs,
+        "tool_call_chunks": message.tool_call_chunks,
+        "usage_metadata": message.usage_metadata,
+        "generation_info": generation_chunk.generation_info,
+        "text": generation_chunk.text,
+    }
+
+
+@pytest.mark.parametrize("chunk", STREAM, ids=STREAM_IDS)
+def test_lean_conversion_matches_the_stock_conversion(chunk):
+    converted = lean(chunk)
+    if converted is None:
+        # only deltas that carry nothing are skipped
+        assert stock(chunk).message.content == "" and not stock(chunk).message.additional_kwargs
+        return
+    assert message_fields(converted) == message_fields(stock(chunk))
+
+
+def test_lean_conversion_keeps_the_base_generation_info():
+    chunk = raw({"content": ""})
+    assert lean(chunk, {"headers": {"x": "1"}}).generation_info == {"headers": {"x": "1"}}
+
+
+def test_aggregation_matches_generate_from_stream():
+    lean_chunks = [c for c in (lean(chunk) for chunk in STREAM) if c is not None]
+    stock_chunks = [c for c in (stock(chunk) for chunk in STREAM) if c is not None]
+
+    ours = _generate_from_chunks(iter(lean_chunks)).generations[0]
+    theirs = generate_from_stream(iter(stock_chunks)).generations[0]
+
+    assert ours.message.content == theirs.message.content == "Searching"
+    assert ours.message.additional_kwargs["reasoning_content"] == "Let me think about it."
+    assert ours.message.additional_kwargs == theirs.message.additional_kwargs
+    assert ours.message.tool_calls == theirs.message.tool_calls
+    assert ours.message.tool_calls[0]["args"] == {"query": "weather"}
+    assert ours.message.usage_metadata == theirs.message.usage_metadata
+    assert ours.generation_info == theirs.generation_info
@@ -0,0 +1,75 @@
+"""HedgedChatModel: the faster attempt wins, and losers still feed the latency histograms."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from src.llms.hedging import HedgedChatModel, get_latency_histogram  # noqa: E402
+from tests.fake_models import ScriptedChatModel  # noqa: E402
+
+MESSAGES = [HumanMessage(content="hi")]
+
+
+class GenerateOnlyModel(ScriptedChatModel):
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        raise AssertionError("non-streaming attempts must call _generate")
+
+
+def hedged(inner):
+    return HedgedChatModel(inner=inner, min_delay=0.0, default_delay=0.05, max_hedges=1)
+
+
+def test_generate_hedges_through_generate_and_records_the_loser():
+    inner = GenerateOnlyModel(model="hedge-generate", delays=[0.5, 0.0])
+    model = hedged(inner)
+    histogram = get_latency_histogram(inner.model, "generate")
+
+    assert model.invoke(MESSAGES).content == "hedge-generate 1"
+    assert model.hedging_stats() == {"hedged": 1, "hedge_wins": 1}
+    # the winner, plus the loser as a censored sample at the time it was cancelled
+    assert histogram.total == 2
+    time.sleep(0.6)
+    assert histogram.total == 2
+
+
+def test_agenerate_records_the_cancelled_loser():
+    inner = ScriptedChatModel(model="hedge-agenerate", delays=[0.5, 0.0])
+    model = hedged(inner)
+    histogram = get_latency_histogram(inner.model, "generate")
+
+    assert asyncio.run(model.ainvoke(MESSAGES)).content == "hedge-agenerate 1"
+    assert histogram.total == 2
+    # the censored sample is about the hedge delay, far below the loser's 0.5 s
+    assert histogram.percentile(100) < 0.3
+
+
+def test_stream_records_the_loser_ttft():
+    inner = ScriptedChatModel(model="hedge-stream", delays=[0.5, 0.0])
+    model = hedged(inner)
+    histogram = get_latency_histogram(inner.model, "ttft")
+
+    assert "".join(chunk.content for chunk in model.stream(MESSAGES)) == "hedge-stream 1"
+    assert histogram.total == 2
+    time.sleep(0.6)
+    assert histogram.total == 2
+
+
+def test_fast_first_attempt_is_not_hedged():
+    inner = ScriptedChatModel(model="hedge-fast", delays=[0.0])
+    model = hedged(inner)
+
+    assert model.invoke(MESSAGES).content == "hedge-fast 0"
+    assert model.hedging_stats() == {"hedged": 0, "hedge_wins": 0}
+    assert inner.calls == 1
+    assert get_latency_histogram(inner.model, "generate").total == 1
+
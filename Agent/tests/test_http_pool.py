@@ -0,0 +1,87 @@
+"""Shared HTTP pools: HTTP_POOL parsing, one pool per configuration, reuse metrics, and model rebuilds."""
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llms.http_pool import HttpPoolConfig, get_http_clients, get_pool_metrics  # noqa: E402
+
+
+def test_config_from_conf():
+    config = HttpPoolConfig.from_conf(
+        {"MAX_CONNECTIONS": "8", "http2": "off", "read_timeout": 5, "keepalive_expiry": None, "unknown": 1}
+    )
+    assert config == HttpPoolConfig(max_connections=8, http2=False, read_timeout=5.0)
+    assert HttpPoolConfig.from_conf(None) == HttpPoolConfig()
+    assert config.limits().max_connections == 8
+    assert config.timeout().read == 5.0
+
+
+def test_pool_is_shared_until_http_pool_changes():
+    endpoint = "http://http-pool-test.invalid/v1"
+    conf = {"max_connections": 4, "http2": False, "read_timeout": 7}
+    client, async_client = get_http_clients(endpoint, True, conf)
+    # the same settings (however they are spelled) share one pool
+    assert get_http_clients(endpoint, True, {**conf, "read_timeout": "7"}) == (client, async_client)
+
+    changed_client, changed_async_client = get_http_clients(endpoint, True, {**conf, "read_timeout": 9})
+    assert changed_client is not client and changed_async_client is not async_client
+    assert (client.timeout.read, changed_client.timeout.read) == (7.0, 9.0)
+    assert get_http_clients(endpoint, False, conf)[0] is not client
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_metrics_count_reused_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+        client, _ = get_http_clients(endpoint, True, {"http2": False})
+        for _ in range(4):
+            assert client.get(endpoint).text == "ok"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    metrics = get_pool_metrics()[endpoint]
+    assert metrics == {"requests": 4, "new_connections": 1, "in_use": 0, "waiting": 0, "reuse_rate": 0.75}
+
+
+def test_models_are_rebuilt_when_http_pool_changes(monkeypatch):
+    pytest.importorskip("langchain_openai")
+    from src.llms import llm
+
+    conf = {
+        "BASIC_MODEL": {"model": "gpt-4o-mini", "api_key": "test", "base_url": "http://http-pool-model.invalid/v1"},
+        "HTTP_POOL": {"http2": False, "read_timeout": 30},
+    }
+    monkeypatch.setattr(llm, "_load_llm_config", lambda: conf)
+    llm.invalidate_llm_cache("basic")
+
+    first = llm.get_llm_by_type("basic")
+    assert llm.get_llm_by_type("basic") is first
+    conf["HTTP_POOL"] = {"http2": False, "read_timeout": 60}
+    second = llm.get_llm_by_type("basic")
+    assert second is not first
+    assert (first.http_client.timeout.read, second.http_client.timeout.read) == (30.0, 60.0)
+    llm.invalidate_llm_cache("basic")
@@ -0,0 +1,203 @@
+"""IncrementalJSONParser / ToolCallArgsAccumulator, and a model created with incremental_tool_args: true end to end."""
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llms.json_stream import IncrementalJSONParser, ToolCallArgsAccumulator  # noqa: E402
+
+DOCUMENTS = [
+    '{"query": "weather in Paris", "max_results": 5}',
+    '{"a": [1, 2.5, -3e2, true, false, null], "b": {"c": {}}, "d": []}',
+    '{"text": "quote \\" backslash \\\\ slash \\/ \\b\\f\\n\\r\\t"}',
+    '{"unicode": "\\u4f60\\u597d \\ud83d\\ude00", "raw": "你好 😀"}',
+    '  [ {"x" : 1} , [ ] , "s" ]  ',
+    '"just a string"',
+    "42",
+]
+
+
+def parse(fragments):
+    parser = IncrementalJSONParser()
+    for fragment in fragments:
+        parser.feed(fragment)
+    return parser.result()
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_matches_json_loads_for_any_split(document):
+    expected = json.loads(document)
+    assert parse([document]) == expected
+    assert parse(list(document)) == expected
+    rng = random.Random(document)
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(document)), min(3, len(document) - 1)))
+        fragments = [document[i:j] for i, j in zip([0] + cuts, cuts + [len(document)])]
+        assert parse(fragments) == expected
+
+
+def test_partial_includes_the_unfinished_string():
+    parser = IncrementalJSONParser()
+    parser.feed('{"query": "wea')
+    assert parser.partial() == {"query": "wea"}
+    parser.feed('ther", "tags": ["a", "b')
+    assert parser.partial() == {"query": "weather", "tags": ["a", "b"]}
+    parser.feed('"], "limit": 1')
+    # an unfinished number is only attached once it is complete
+    assert parser.partial() == {"query": "weather", "tags": ["a", "b"]}
+    parser.feed("0}")
+    assert parser.partial() == {"query": "weather", "tags": ["a", "b"], "limit": 10}
+    assert parser.done
+
+
+def test_partial_before_anything_was_parsed():
+    parser = IncrementalJSONParser()
+    assert parser.partial() is None
+    parser.feed("  ")
+    assert parser.partial() is None
+
+
+@pytest.mark.parametrize(
+    "document",
+    ['{"a" 1}', '{"a": 1,, "b": 2}', "[1, 2}", '{"a": tru}', '"bad \\x escape"', "{} {}", "{1: 2}"],
+)
+def test_invalid_documents_raise(document):
+    with pytest.raises(ValueError, match="Invalid JSON"):
+        parse([document])
+
+
+def test_incomplete_document_raises():
+    with pytest.raises(ValueError, match="Incomplete"):
+        parse(['{"query": "weather'])
+
+
+def test_accumulator_keeps_tool_calls_apart():
+    accumulator = ToolCallArgsAccumulator()
+    accumulator.feed(1, '{"b": ')
+    accumulator.feed(0, '{"a": "x')
+    accumulator.feed(1, "2}")
+    assert accumulator.indexes == [0, 1]
+    assert accumulator.partial(0) == {"a": "x"}
+    assert accumulator.partial(2) is None
+    accumulator.feed(0, '"}')
+    assert accumulator.final(0) == {"a": "x"}
+    assert accumulator.final(1) == {"b": 2}
+    assert accumulator.args(1) == '{"b": 2}'
+
+
+# ---------------------------------------------------------------------- end to end
+
+ARGUMENT_FRAGMENTS = ['{"query', '": "wea', 'ther in', ' Paris", "max_', 'results": 5}']
+
+
+def _sse_body():
+    def event(delta, finish_reason=None):
+        chunk = {
+            "id": "chatcmpl-1",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    events = [
+        event(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {"index": 0, "id": "call_1", "type": "function", "function": {"name": "web_search", "arguments": ""}}
+                ],
+            }
+        )
+    ]
+    events += [event({"tool_calls": [{"index": 0, "function": {"arguments": f}}]}) for f in ARGUMENT_FRAGMENTS]
+    events.append(event({}, finish_reason="tool_calls"))
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode("utf-8")
+
+
+def _create_model(incremental_tool_args):
+    httpx = pytest.importorskip("httpx")
+    pytest.importorskip("langchain_openai")
+    from src.llms.llm import _create_llm_use_conf
+
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, headers={"content-type": "text/event-stream"}, content=_sse_body())
+    )
+    conf = {
+        "BASIC_MODEL": {
+            "model": "gpt-4o-mini",
+            "api_key": "test",
+            "base_url": "http://localhost:9/v1",
+            "max_retries": 0,
+            "http_client": httpx.Client(transport=transport),
+            "incremental_tool_args": incremental_tool_args,
+        }
+    }
+    return _create_llm_use_conf("basic", conf)
+
+
+def test_incremental_tool_args_streams_partial_args_to_callbacks():
+    model = _create_model("true")
+
+    from langchain_core.callbacks import BaseCallbackHandler, CallbackManager
+    from langchain_core.messages import HumanMessage
+
+    from src.llms.json_stream import StreamingToolArgsMixin
+
+    class PartialArgs(BaseCallbackHandler):
+        def __init__(self):
+            self.partials = []
+
+        def on_llm_new_token(self, token, **kwargs):
+            accumulator = kwargs.get("tool_call_args")
+            if accumulator is None or not accumulator.indexes:
+                return
+            partial = json.loads(json.dumps(accumulator.partial(0)))
+            # chunks without argument fragments (e.g. the finish_reason chunk) repeat the last value
+            if not self.partials or self.partials[-1] != partial:
+                self.partials.append(partial)
+
+    assert isinstance(model, StreamingToolArgsMixin)
+
+    handler = PartialArgs()
+    messages = [HumanMessage(content="weather?")]
+    run_manager = CallbackManager(handlers=[handler]).on_chat_model_start({"name": "test"}, [messages])[0]
+    chunks = list(model._stream(messages, run_manager=run_manager))
+
+    assert handler.partials == [
+        {},
+        {"query": "wea"},
+        {"query": "weather in"},
+        {"query": "weather in Paris"},
+        {"query": "weather in Paris", "max_results": 5},
+    ]
+    # the merged chunks carry no args; the complete args arrive once, at the end
+    assert all(c["args"] == "" for chunk in chunks[:-1] for c in chunk.message.tool_call_chunks)
+    assert chunks[-1].message.tool_call_chunks[0]["args"] == "".join(ARGUMENT_FRAGMENTS)
+
+    message = None
+    for chunk in model.stream("weather?"):
+        message = chunk if message is None else message + chunk
+    assert message.tool_calls == [
+        {"name": "web_search", "args": {"query": "weather in Paris", "max_results": 5}, "id": "call_1", "type": "tool_call"}
+    ]
+
+
+def test_tool_args_are_streamed_unchanged_by_default():
+    model = _create_model(False)
+
+    from src.llms.json_stream import StreamingToolArgsMixin
+
+    assert not isinstance(model, StreamingToolArgsMixin)
+    args = [c["args"] for chunk in model.stream("weather?") for c in chunk.tool_call_chunks if c["args"]]
+    assert args == ARGUMENT_FRAGMENTS
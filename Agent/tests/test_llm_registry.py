@@ -0,0 +1,91 @@
+"""get_llm_by_type: single-flight construction and instances keyed by the current configuration."""
+
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llms import llm  # noqa: E402
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Config read from ``state.conf``; models are plain objects counted in ``state.built``."""
+    state = SimpleNamespace(conf={"BASIC_MODEL": {"model": "m1"}}, built=[], fail=False)
+
+    def create(llm_type, conf):
+        time.sleep(0.1)
+        if state.fail:
+            raise RuntimeError("bad config")
+        model = SimpleNamespace(llm_type=llm_type, model=conf["BASIC_MODEL"]["model"])
+        state.built.append(model)
+        return model
+
+    monkeypatch.setattr(llm, "_load_llm_config", lambda: state.conf)
+    monkeypatch.setattr(llm, "_create_llm_use_conf", create)
+    llm.invalidate_llm_cache("basic")
+    yield state
+    llm.invalidate_llm_cache("basic")
+
+
+def concurrently(function, count=8):
+    barrier = threading.Barrier(count)
+    results = []
+
+    def run():
+        barrier.wait()
+        try:
+            results.append(function())
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_share_one_construction(registry):
+    results = concurrently(lambda: llm.get_llm_by_type("basic"))
+    assert len(registry.built) == 1
+    assert all(result is registry.built[0] for result in results)
+    assert llm.get_llm_by_type("basic") is registry.built[0]
+
+
+def test_failed_construction_reaches_every_waiter_and_is_not_cached(registry):
+    registry.fail = True
+    results = concurrently(lambda: llm.get_llm_by_type("basic"))
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    registry.fail = False
+    assert llm.get_llm_by_type("basic").model == "m1"
+
+
+def test_config_change_builds_a_new_instance(registry):
+    first = llm.get_llm_by_type("basic")
+    registry.conf = {"BASIC_MODEL": {"model": "m1"}, "SEARCH_ENGINE": {"engine": "tavily"}}
+    # sections that are not baked into the model keep the instance
+    assert llm.get_llm_by_type("basic") is first
+
+    registry.conf = {"BASIC_MODEL": {"model": "m2"}}
+    second = llm.get_llm_by_type("basic")
+    assert (first.model, second.model) == ("m1", "m2")
+    # the outdated instance of the same type was released
+    assert [key for key in llm._llm_cache if key[0] == "basic"] == [("basic", llm._get_llm_config_hash("basic", registry.conf))]
+
+
+def test_config_subscriber_drops_outdated_instances(registry):
+    llm.get_llm_by_type("basic")
+    registry.conf = {"BASIC_MODEL": {"model": "m1"}, "HTTP_POOL": {"max_connections": 4}}
+    llm._on_config_change(SimpleNamespace(data=registry.conf, version=2), None)
+    assert not [key for key in llm._llm_cache if key[0] == "basic"]
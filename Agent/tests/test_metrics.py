@@ -0,0 +1,132 @@
+"""LLMMetricsCallbackHandler: TTFT, inter-token latency, durations, tokens and retries per call."""
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from src.llms.metrics import JsonlExporter, LLMMetricsCallbackHandler, MetricsRegistry  # noqa: E402
+from tests.fake_models import ScriptedChatModel, StatusError  # noqa: E402
+
+MESSAGES = [HumanMessage(content="hi")]
+LABELS = {"agent": "researcher", "llm_type": "basic"}
+
+
+class UsageModel(ScriptedChatModel):
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._next()
+        usage = {
+            "input_tokens": 12,
+            "output_tokens": 7,
+            "total_tokens": 19,
+            "output_token_details": {"reasoning": 3},
+        }
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok", usage_metadata=usage))])
+
+
+def series(registry):
+    """{name: record} for the series labelled LABELS (plus status for the request counter)."""
+    result = {}
+    for line in registry.to_jsonl().splitlines():
+        record = json.loads(line)
+        labels = dict(record["labels"])
+        status = labels.pop("status", None)
+        if labels == LABELS:
+            result[record["name"] if status is None else f"{record['name']}:{status}"] = record
+    return result
+
+
+def with_metrics(model, tmp_path):
+    registry = MetricsRegistry()
+    handler = LLMMetricsCallbackHandler("basic", registry=registry, exporter=JsonlExporter(str(tmp_path / "calls.jsonl")))
+    model = model.model_copy(update={"callbacks": [handler], "metadata": {"agent_name": "researcher"}})
+    return model, registry
+
+
+def exported(tmp_path):
+    with open(tmp_path / "calls.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_streamed_call_records_ttft_and_inter_token_latency(tmp_path):
+    model, registry = with_metrics(
+        ScriptedChatModel(model="metrics stream a b", delays=[0.05], chunk_delay=0.02), tmp_path
+    )
+    assert "".join(chunk.content for chunk in model.stream(MESSAGES)) == "metrics stream a b 0"
+
+    metrics = series(registry)
+    [call] = exported(tmp_path)
+    chunks = call["chunks"]
+    assert chunks >= 5
+
+    ttft = metrics["llm_time_to_first_token_seconds"]
+    assert ttft["count"] == 1 and ttft["sum"] >= 0.05
+    assert call["ttft"] == pytest.approx(ttft["sum"])
+    # one gap per chunk after the first, each at least the scripted chunk delay
+    inter_token = metrics["llm_inter_token_latency_seconds"]
+    assert inter_token["count"] == chunks - 1
+    assert inter_token["sum"] >= 0.02 * 4
+    duration = metrics["llm_request_duration_seconds"]
+    assert duration["count"] == 1 and duration["sum"] >= ttft["sum"] + inter_token["sum"] - 1e-6
+    assert metrics["llm_requests_total:ok"]["value"] == 1
+    assert (call["agent"], call["llm_type"], call["status"]) == ("researcher", "basic", "ok")
+
+
+def test_non_streamed_call_records_usage_without_ttft(tmp_path):
+    model, registry = with_metrics(UsageModel(), tmp_path)
+    model.invoke(MESSAGES)
+
+    metrics = series(registry)
+    assert "llm_time_to_first_token_seconds" not in metrics
+    assert "llm_inter_token_latency_seconds" not in metrics
+    assert metrics["llm_input_tokens_total"]["value"] == 12
+    assert metrics["llm_output_tokens_total"]["value"] == 7
+    assert metrics["llm_reasoning_tokens_total"]["value"] == 3
+    [call] = exported(tmp_path)
+    assert (call["ttft"], call["chunks"], call["input_tokens"]) == (None, 0, 12)
+
+
+def test_failed_call_is_counted_by_error_type(tmp_path):
+    model, registry = with_metrics(ScriptedChatModel(errors={0: StatusError(500)}), tmp_path)
+    with pytest.raises(StatusError):
+        model.invoke(MESSAGES)
+
+    metrics = series(registry)
+    assert metrics["llm_requests_total:StatusError"]["value"] == 1
+    assert exported(tmp_path)[0]["status"] == "StatusError"
+
+
+def test_failovers_are_counted_as_retries(tmp_path):
+    pytest.importorskip("openai")
+    from src.llms.router import Endpoint, RoutedChatModel
+
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(503)})
+    endpoints = [Endpoint("primary", primary), Endpoint("backup", ScriptedChatModel(model="backup"))]
+    endpoints[0].latency, endpoints[1].latency = 0.001, 1.0
+    model, registry = with_metrics(RoutedChatModel(inner=primary, endpoints=endpoints), tmp_path)
+
+    assert model.invoke(MESSAGES).content == "backup 0"
+    assert series(registry)["llm_retries_total"]["value"] == 1
+    assert exported(tmp_path)[0]["retries"] == 1
+
+
+def test_prometheus_rendering():
+    registry = MetricsRegistry()
+    registry.describe("llm_request_duration_seconds", "Total LLM call duration")
+    registry.observe("llm_request_duration_seconds", LABELS, 0.2, buckets=(0.1, 1.0))
+    registry.inc("llm_requests_total", {**LABELS, "status": "ok"})
+
+    text = registry.to_prometheus()
+    assert '# TYPE llm_requests_total counter\nllm_requests_total{agent="researcher",llm_type="basic",status="ok"} 1' in text
+    assert "# HELP llm_request_duration_seconds Total LLM call duration" in text
+    assert 'llm_request_duration_seconds_bucket{agent="researcher",llm_type="basic",le="0.1"} 0' in text
+    assert 'llm_request_duration_seconds_bucket{agent="researcher",llm_type="basic",le="1"} 1' in text
+    assert 'llm_request_duration_seconds_count{agent="researcher",llm_type="basic"} 1' in text
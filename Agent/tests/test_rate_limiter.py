@@ -0,0 +1,103 @@
+"""TokenBucket / RateLimiter: refill, debt as wait time, TPM reconciliation and shared endpoint limiters."""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from src.llms.rate_limiter import RateLimitedChatModel, RateLimiter, TokenBucket, get_rate_limiter  # noqa: E402
+from tests.fake_models import ScriptedChatModel  # noqa: E402
+
+
+def test_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(60, burst_seconds=10)
+    now = bucket.updated
+    assert (bucket.rate, bucket.capacity) == (1.0, 10.0)
+
+    assert bucket.reserve(10, now) == 0.0
+    # empty: the next request waits for one token at 1 token/s
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    # 5 s later the debt of 1 is repaid and 4 tokens are available
+    assert bucket.reserve(4, now + 5) == 0.0
+    assert bucket.level == pytest.approx(0.0)
+    # never more than the burst capacity
+    bucket.refund(0, now + 3600)
+    assert bucket.level == bucket.capacity
+
+
+def test_reservations_queue_in_arrival_order():
+    bucket = TokenBucket(60, burst_seconds=1)
+    now = bucket.updated
+    waits = [bucket.reserve(1, now) for _ in range(4)]
+    assert waits == pytest.approx([0.0, 1.0, 2.0, 3.0])
+
+
+def test_set_rate_keeps_the_debt():
+    bucket = TokenBucket(60, burst_seconds=10)
+    now = bucket.updated
+    bucket.reserve(12, now)
+    bucket.set_rate(120, now)
+    assert bucket.level == pytest.approx(-2.0)
+    assert bucket.reserve(0, now) == pytest.approx(1.0)
+
+
+def test_limiter_waits_for_the_fuller_bucket():
+    limiter = RateLimiter("test", requests_per_minute=60, tokens_per_minute=600)
+    # 10 requests of burst; 100 tokens of burst at 10 tokens/s
+    assert limiter._reserve(100) == 0.0
+    assert limiter._reserve(50) == pytest.approx(5.0, abs=0.01)
+    stats = limiter.stats()
+    assert (stats["acquired"], stats["queue_depth"]) == (2, 1)
+    assert stats["max_wait"] == pytest.approx(5.0, abs=0.01)
+
+
+class UsageModel(ScriptedChatModel):
+    """Reports ``total_tokens`` usage like the OpenAI-compatible providers."""
+
+    total_tokens: int = 20
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._next()
+        usage = {"input_tokens": 5, "output_tokens": self.total_tokens - 5, "total_tokens": self.total_tokens}
+        message = AIMessage(content="ok", usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def test_tpm_is_debited_by_the_estimate_and_reconciled_with_usage():
+    limiter = RateLimiter("test", tokens_per_minute=600)
+    model = RateLimitedChatModel(inner=UsageModel(total_tokens=20), limiter=limiter, max_output_tokens=50)
+    messages = [HumanMessage(content="hi")]
+    estimate = model._estimate(messages, {})
+    assert estimate == 54
+
+    model.invoke(messages)
+    # capacity 100, minus the 20 tokens really used (plus a few milliseconds of refill)
+    assert limiter.tokens.level == pytest.approx(80, abs=0.5)
+
+    # the estimate is capped by the model's token limit
+    capped = RateLimitedChatModel(inner=UsageModel(), limiter=limiter, max_output_tokens=50, token_limit=30)
+    assert capped._estimate(messages, {}) == 30
+    assert model._estimate(messages, {"max_tokens": 10}) == 14
+
+
+def test_endpoint_limiter_is_shared_and_follows_changed_limits():
+    limiter = get_rate_limiter("http://rate-limiter-test", "m", requests_per_minute=60)
+    assert get_rate_limiter("http://rate-limiter-test", "m", requests_per_minute=60) is limiter
+    assert limiter.limits() == (60, None)
+
+    limiter._reserve(0)
+    assert get_rate_limiter("http://rate-limiter-test", "m", 120, 6000) is limiter
+    assert limiter.limits() == (120, 6000)
+    # the reservation taken before the change is kept
+    assert limiter.requests.level < limiter.requests.capacity
+    assert limiter.tokens is not None
+
+    get_rate_limiter("http://rate-limiter-test", "m")
+    assert limiter.limits() == (None, None)
@@ -0,0 +1,147 @@
+"""ReasoningRetention: the five modes, streamed vs non-streamed results, history re-rendering and the file store."""
+
+import os
+import sys
+from typing import Any, Dict, Optional
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # noqa: E402
+
+from src.llms.reasoning import (  # noqa: E402
+    RETENTION_MODES,
+    ReasoningRetention,
+    ReasoningStore,
+    create_reasoning_retention_class,
+)
+
+REASONING = " ".join(f"Step {i} of the plan checks one more source." for i in range(1, 41))
+REASONING_PARTS = [REASONING[i : i + 37] for i in range(0, len(REASONING), 37)]
+
+
+class ReasoningProvider(BaseChatModel):
+    """Answers with REASONING in additional_kwargs, like the DashScope / DeepSeek providers."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "reasoning-provider"
+
+    def _create_chat_result(self, response: Any, generation_info: Optional[Dict[str, Any]] = None) -> ChatResult:
+        message = AIMessage(content="answer", additional_kwargs={"reasoning_content": response}, id="msg-1")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self._create_chat_result(REASONING)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for part in REASONING_PARTS:
+            message = AIMessageChunk(content="", additional_kwargs={"reasoning_content": part}, id="msg-1")
+            yield ChatGenerationChunk(message=message)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="answer", id="msg-1"))
+
+
+def retention(mode, **options):
+    return ReasoningRetention(mode=mode, max_chars=200, summary_chars=120, **options)
+
+
+def test_modes():
+    message = AIMessage(content="answer", additional_kwargs={"reasoning_content": REASONING, "other": 1}, id="m")
+
+    assert retention("keep").apply(message) is message
+    assert retention("drop").apply(message).additional_kwargs == {"other": 1}
+
+    truncated = retention("truncate").apply(message).additional_kwargs["reasoning_content"]
+    assert truncated.startswith(REASONING[:100]) and truncated.endswith(REASONING[-50:])
+    assert "characters of reasoning omitted" in truncated
+    assert len(truncated) < len(REASONING)
+
+    summary = retention("summarize").apply(message).additional_kwargs["reasoning_content"]
+    assert summary.startswith("Step 1 of the plan") and summary.endswith("Step 40 of the plan checks one more source.")
+    assert "[...]" in summary and len(summary) < 200
+
+    offload = retention("offload")
+    offloaded = offload.apply(message)
+    assert offloaded.additional_kwargs == {"other": 1, "reasoning_ref": "m"}
+    assert offload.store.get("m") == REASONING
+    # the original message is left alone
+    assert message.additional_kwargs["reasoning_content"] == REASONING
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError, match="Unknown reasoning retention mode"):
+        ReasoningRetention(mode="forget")
+
+
+@pytest.mark.parametrize("mode", RETENTION_MODES)
+def test_streamed_and_generated_results_match(mode):
+    policy = retention(mode)
+    model = create_reasoning_retention_class(ReasoningProvider, policy)()
+
+    generated = model.invoke([HumanMessage(content="hi")])
+    streamed = None
+    for chunk in model.stream([HumanMessage(content="hi")]):
+        streamed = chunk if streamed is None else streamed + chunk
+
+    assert streamed.content == generated.content == "answer"
+    assert streamed.additional_kwargs == generated.additional_kwargs
+    if mode == "offload":
+        assert policy.store.get(generated.additional_kwargs["reasoning_ref"]) == REASONING
+
+
+class CountingStore(ReasoningStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.puts = 0
+
+    def put(self, key, text):
+        self.puts += 1
+        super().put(key, text)
+
+
+def test_history_is_offloaded_once():
+    store = CountingStore()
+    policy = retention("offload", store=store)
+    history = [
+        HumanMessage(content="hi"),
+        AIMessage(content="a", additional_kwargs={"reasoning_content": REASONING}, id="m1"),
+        AIMessage(content="b", additional_kwargs={"reasoning_content": "r2", "reasoning_ref": "m2"}, id="m2"),
+    ]
+    for _ in range(3):
+        rendered = policy.apply_history(history)
+    assert store.puts == 1
+    assert [m.additional_kwargs for m in rendered[1:]] == [{"reasoning_ref": "m1"}, {"reasoning_ref": "m2"}]
+
+
+def test_file_store_evicts_least_recently_used(tmp_path):
+    store = ReasoningStore(str(tmp_path), max_entries=3)
+    for key in "abc":
+        store.put(key, f"reasoning {key}")
+    # reading "a" makes "b" the least recently used entry
+    assert store.get("a") == "reasoning a"
+    store.put("d", "reasoning d")
+
+    assert store.get("b") is None
+    assert [store.get(key) for key in "acd"] == ["reasoning a", "reasoning c", "reasoning d"]
+    assert len(os.listdir(tmp_path)) == 3
+    assert "a" in store and "b" not in store
+
+    # a new store over the same directory continues with the files already there
+    reopened = ReasoningStore(str(tmp_path), max_entries=3)
+    reopened.put("e", "reasoning e")
+    assert len(os.listdir(tmp_path)) == 3
+    assert reopened.get("e") == "reasoning e"
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = ReasoningStore(max_entries=2)
+    store.put("a", "1")
+    store.put("b", "2")
+    store.put("c", "3")
+    assert store.get("a") is None
+    assert [store.get("b"), store.get("c")] == ["2", "3"]
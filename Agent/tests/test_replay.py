@@ -0,0 +1,146 @@
+"""Record/replay transport: a recorded exchange replays byte for byte, offline, with the chosen timing."""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llms.replay import FixtureNotFoundError, ReplayConfig, request_key, wrap_transports  # noqa: E402
+
+URL = "http://replay-test.invalid/v1/chat/completions"
+# a UTF-8 character split across chunks must survive the round trip
+CHUNKS = [b'data: {"delta": "hel', b'lo \xe4\xbd', b'\xa0\xe5\xa5\xbd"}\n\n', b"data: [DONE]\n\n"]
+
+
+@pytest.fixture(autouse=True)
+def no_replay_env(monkeypatch):
+    for name in ("LLM_HTTP_REPLAY", "LLM_HTTP_FIXTURES", "LLM_HTTP_REPLAY_TIMING"):
+        monkeypatch.delenv(name, raising=False)
+
+
+class ChunkStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield chunk
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+def upstream(calls, delay=0.0):
+    def handler(request):
+        calls.append(json.loads(request.content))
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream", "x-request-id": "abc"},
+            stream=ChunkStream(CHUNKS, delay),
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def body(content, **extra):
+    return {"model": "qwen-max", "messages": [{"role": "user", "content": content}], "stream": True, **extra}
+
+
+def clients(mode, tmp_path, transport=None, timing="none"):
+    config = ReplayConfig.from_conf({"mode": mode, "fixtures_dir": str(tmp_path), "timing": timing, "speedup": 2})
+    transport = transport or httpx.MockTransport(lambda request: pytest.fail("replay must not reach the network"))
+    sync_transport, async_transport = wrap_transports(transport, transport, config)
+    return httpx.Client(transport=sync_transport), httpx.AsyncClient(transport=async_transport)
+
+
+def stream_chunks(client, payload, headers=None):
+    with client.stream("POST", URL, json=payload, headers=headers) as response:
+        return response.status_code, response.headers, list(response.iter_raw())
+
+
+def test_record_then_replay_round_trip(tmp_path):
+    calls = []
+    recorder, _ = clients("record", tmp_path, upstream(calls))
+    status, _, recorded = stream_chunks(recorder, body("hi"), headers={"Authorization": "Bearer secret"})
+    assert (status, recorded) == (200, CHUNKS)
+    assert len(calls) == 1
+
+    [fixture] = list(tmp_path.glob("*.json"))
+    text = fixture.read_text(encoding="utf-8")
+    assert "secret" not in text and "x-request-id" not in text
+    assert json.loads(text)[0]["request"]["body"]["messages"][0]["content"] == "hi"
+
+    replayer, async_replayer = clients("replay", tmp_path)
+    status, headers, replayed = stream_chunks(replayer, body("hi"))
+    assert (status, replayed) == (200, CHUNKS)
+    assert headers["content-type"] == "text/event-stream"
+    assert b"".join(replayed).decode("utf-8").count("你好") == 1
+
+    async def replay_async():
+        async with async_replayer.stream("POST", URL, json=body("hi")) as response:
+            return [chunk async for chunk in response.aiter_raw()]
+
+    assert asyncio.run(replay_async()) == CHUNKS
+
+
+def test_requests_are_matched_by_their_llm_fields(tmp_path):
+    calls = []
+    recorder, _ = clients("record", tmp_path, upstream(calls))
+    stream_chunks(recorder, body("first"))
+    stream_chunks(recorder, body("second"))
+
+    replayer, _ = clients("replay", tmp_path)
+    # fields that do not identify the call (e.g. temperature) are ignored
+    assert stream_chunks(replayer, body("second", temperature=0.3))[2] == CHUNKS
+    with pytest.raises(FixtureNotFoundError):
+        stream_chunks(replayer, body("never recorded"))
+
+    a = httpx.Request("POST", URL, json=body("x", temperature=0))
+    b = httpx.Request("POST", URL, json=body("x", temperature=1))
+    c = httpx.Request("POST", URL, json=body("y"))
+    assert request_key(a) == request_key(b) != request_key(c)
+
+
+def test_repeated_requests_replay_in_recorded_order(tmp_path):
+    responses = iter([b"one", b"two"])
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=next(responses)))
+    recorder, _ = clients("record", tmp_path, transport)
+    assert [recorder.post(URL, json=body("same")).content for _ in range(2)] == [b"one", b"two"]
+
+    replayer, _ = clients("replay", tmp_path)
+    assert [replayer.post(URL, json=body("same")).content for _ in range(3)] == [b"one", b"two", b"one"]
+
+
+def test_replay_timing(tmp_path):
+    recorder, _ = clients("record", tmp_path, upstream([], delay=0.05))
+    stream_chunks(recorder, body("slow"))
+
+    def replay_time(timing):
+        replayer, _ = clients("replay", tmp_path, timing=timing)
+        started = time.monotonic()
+        stream_chunks(replayer, body("slow"))
+        return time.monotonic() - started
+
+    assert replay_time("original") >= 0.2
+    assert 0.1 <= replay_time("compressed") < 0.2
+    assert replay_time("none") < 0.1
+
+
+def test_config_validation(monkeypatch):
+    with pytest.raises(ValueError, match="mode"):
+        ReplayConfig.from_conf({"mode": "rewind"})
+    with pytest.raises(ValueError, match="timing"):
+        ReplayConfig.from_conf({"timing": "fast"})
+    monkeypatch.setenv("LLM_HTTP_REPLAY", "replay")
+    assert ReplayConfig.from_conf({"MODE": "record"}).mode == "replay"
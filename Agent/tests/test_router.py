@@ -0,0 +1,122 @@
+"""RoutedChatModel: failover, circuit breaking and recovery across endpoints."""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("openai")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from src.llms.router import Endpoint, RoutedChatModel  # noqa: E402
+from tests.fake_models import ScriptedChatModel, StatusError  # noqa: E402
+
+MESSAGES = [HumanMessage(content="hi")]
+
+
+def routed(primary, backup, **options):
+    endpoints = [Endpoint("primary", primary), Endpoint("backup", backup)]
+    # the primary is preferred while its circuit is closed
+    endpoints[0].latency, endpoints[1].latency = 0.001, 1.0
+    return RoutedChatModel(inner=primary, endpoints=endpoints, **options)
+
+
+def test_server_error_fails_over_without_opening_the_circuit():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(500)})
+    backup = ScriptedChatModel(model="backup")
+    model = routed(primary, backup, failure_threshold=3)
+
+    assert model.invoke(MESSAGES).content == "backup 0"
+    stats = model.endpoint_stats()
+    assert stats["primary"]["failures"] == 1 and not stats["primary"]["circuit_open"]
+    assert stats["primary"]["outstanding"] == stats["backup"]["outstanding"] == 0
+
+    # the primary is still preferred, and a success resets its failure count
+    assert model.invoke(MESSAGES).content == "primary 1"
+    assert model.endpoint_stats()["primary"]["failures"] == 0
+
+
+def test_circuit_opens_after_the_threshold_and_recovers_after_the_cooldown():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(502), 1: StatusError(503)})
+    backup = ScriptedChatModel(model="backup")
+    model = routed(primary, backup, failure_threshold=2, cooldown=0.2)
+
+    assert model.invoke(MESSAGES).content == "backup 0"
+    assert not model.endpoint_stats()["primary"]["circuit_open"]
+    assert model.invoke(MESSAGES).content == "backup 1"
+    assert model.endpoint_stats()["primary"]["circuit_open"]
+
+    # while the circuit is open the primary is skipped
+    assert model.invoke(MESSAGES).content == "backup 2"
+    assert primary.calls == 2
+
+    time.sleep(0.25)
+    assert model.invoke(MESSAGES).content == "primary 2"
+    stats = model.endpoint_stats()["primary"]
+    assert (stats["failures"], stats["circuit_open"], stats["outstanding"]) == (0, False, 0)
+
+
+def test_rate_limit_opens_the_circuit_for_retry_after():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(429, retry_after=0.2)})
+    backup = ScriptedChatModel(model="backup")
+    model = routed(primary, backup, failure_threshold=5, cooldown=60)
+
+    assert model.invoke(MESSAGES).content == "backup 0"
+    assert model.endpoint_stats()["primary"]["circuit_open"]
+    assert model.invoke(MESSAGES).content == "backup 1"
+    time.sleep(0.25)
+    assert model.invoke(MESSAGES).content == "primary 1"
+
+
+def test_client_errors_are_not_failed_over():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(400)})
+    backup = ScriptedChatModel(model="backup")
+    model = routed(primary, backup)
+
+    with pytest.raises(StatusError):
+        model.invoke(MESSAGES)
+    assert backup.calls == 0
+    assert model.endpoint_stats()["primary"]["failures"] == 0
+
+
+def test_last_error_is_raised_when_every_endpoint_fails():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(500)})
+    backup = ScriptedChatModel(model="backup", errors={0: StatusError(503)})
+    model = routed(primary, backup)
+
+    with pytest.raises(StatusError, match="503"):
+        model.invoke(MESSAGES)
+
+
+def test_streams_fail_over_before_the_first_chunk():
+    primary = ScriptedChatModel(model="primary", errors={0: StatusError(500), 1: StatusError(500)})
+    backup = ScriptedChatModel(model="backup")
+    model = routed(primary, backup)
+
+    assert "".join(chunk.content for chunk in model.stream(MESSAGES)) == "backup 0"
+
+    async def consume():
+        return "".join([chunk.content async for chunk in model.astream(MESSAGES)])
+
+    assert asyncio.run(consume()) == "backup 1"
+    stats = model.endpoint_stats()
+    assert stats["primary"]["failures"] == 2
+    assert stats["primary"]["outstanding"] == stats["backup"]["outstanding"] == 0
+
+
+def test_closed_stream_frees_the_endpoint_without_a_failure():
+    primary = ScriptedChatModel(model="primary several words")
+    model = routed(primary, ScriptedChatModel(model="backup"))
+
+    stream = model.stream(MESSAGES)
+    next(stream)
+    assert model.endpoint_stats()["primary"]["outstanding"] == 1
+    stream.close()
+    assert model.endpoint_stats()["primary"]["outstanding"] == 0
+    assert model.endpoint_stats()["primary"]["failures"] == 0
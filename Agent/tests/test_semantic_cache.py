@@ -0,0 +1,68 @@
+"""SemanticCache partitions and the numpy VectorIndex."""
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from src.llms.semantic_cache import SemanticCache, VectorIndex  # noqa: E402
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def result(text):
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def test_vector_index_grows_and_removes():
+    index = VectorIndex(2, capacity=1)
+    for entry_id in range(10):
+        index.add(entry_id, unit(1, entry_id))
+    assert len(index) == 10
+    assert index.search(unit(1, 3), 1)[0][0] == 3
+
+    index.remove([0, 3, 9])
+    assert index.ids == [1, 2, 4, 5, 6, 7, 8]
+    assert index.vectors.shape == (7, 2)
+    assert index.search(unit(1, 4), 1) == [(4, pytest.approx(1.0))]
+    assert 3 not in [entry_id for entry_id, _ in index.search(unit(1, 3), 10)]
+
+
+def test_other_partitions_do_not_hide_a_hit():
+    cache = SemanticCache(embeddings=None, threshold=0.95, search_k=2)
+    query = unit(1, 0)
+    # exact matches from other conversations outrank the hit in a shared top-k search
+    for i in range(10):
+        cache.store(query, f"other-{i}", result(f"other {i}"))
+    cache.store(unit(1, 0.1), "mine", result("mine"))
+
+    hit = cache.lookup(query, "mine")
+    assert hit is not None and hit.generations[0].message.content == "mine"
+    assert cache.lookup(unit(0, 1), "mine") is None
+    assert cache.lookup(query, "unknown") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 11, "partitions": 11}
+
+
+def test_eviction_and_expiry_drop_empty_partitions():
+    cache = SemanticCache(embeddings=None, max_entries=2)
+    cache.store(unit(1, 0), "a", result("a"))
+    cache.store(unit(1, 0), "b", result("b"))
+    cache.store(unit(1, 0), "c", result("c"))
+    assert cache.lookup(unit(1, 0), "a") is None
+    assert cache.stats()["partitions"] == 2
+
+    cache.ttl = 1e-9
+    assert cache.lookup(unit(1, 0), "b") is None
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["partitions"] == 1
@@ -2,36 +2,118 @@
 #************************************************************************    模型加载     ************************************************************************
 #****************************************************************************************************************************************************************
 # load the tokenizer and the model
-from modelscope import AutoModelForCausalLM, AutoTokenizer
+import os
+import threading
+from model_loader import load_model
 #model_name ="E:\Code\PythonCode\Qwen\model\Qwen\Qwen3-0___6B"
-model_name = "E:\pythonCode\Qwen\model"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    torch_dtype="auto",
-    device_map="auto"
-)
+model_name = os.getenv("QWEN_MODEL_PATH", r"E:\pythonCode\Qwen\model")
+# 没有 GPU 的机器可以设置 QWEN_QUANTIZATION=int8 / int4，在 CPU 上用量化后的模型推理
+# 量化前后的效果和速度可以用 bench_quant.py 对比
+QUANTIZATION = os.getenv("QWEN_QUANTIZATION") or None
+# 第一次启动时把权重转换成 safetensors 放在这里，之后直接 mmap，多个 worker 共用一份 page cache
+# 设置为空字符串则关闭，按原来的方式 from_pretrained
+MODEL_CACHE_DIR = os.getenv("QWEN_MODEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "qwen_mmap"))
+# 可选的草稿模型（比如 Qwen3-0.6B），设置后请求里可以用 "speculative": true 走投机解码
+DRAFT_MODEL_PATH = os.getenv("QWEN_DRAFT_MODEL_PATH")
+NUM_DRAFT_TOKENS = int(os.getenv("QWEN_NUM_DRAFT_TOKENS", "4"))
+
+# 模型不在 import 时加载，而是服务启动后在后台线程里加载（见 init_model），加载完成前接口返回 503
+model = tokenizer = engine = speculative_decoder = None
+model_ready = threading.Event()
+model_error = None
 
 #****************************************************************************************************************************************************************
 #************************************************************************    后端接口     ************************************************************************
 #****************************************************************************************************************************************************************
 
 
+import asyncio
 import uvicorn
-from fastapi import FastAPI,Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI,Body,HTTPException
+import json
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Dict
+
+from engine import ContinuousBatchingEngine, GenerationRequest
+from kv_cache import RadixKVCache, SessionKVCache
+from speculative import SpeculativeDecoder
+from stopping import DeadlineCriteria, StopStringCriteria, StopStringFilter, ThinkingBudget, truncate_at_stop
+from streaming import ThinkContentStreamer
+
 app = FastAPI()
 
-@app.post("/chat")
-def chat(data: dict = Body(...)):
+MAX_LENGTH = 32768  # prompt + 生成内容的总长度上限
+# 请求没有指定时的默认生成预算，防止个别失控的思考过程长时间占住 decode 循环
+DEFAULT_MAX_NEW_TOKENS = int(os.getenv("QWEN_MAX_NEW_TOKENS", "8192"))
+DEFAULT_THINKING_BUDGET = int(os.getenv("QWEN_THINKING_BUDGET", "4096"))
+DEFAULT_TIMEOUT = float(os.getenv("QWEN_REQUEST_TIMEOUT", "300"))  # 秒
+# 多轮对话复用 KV cache 的总预算（MB），超过后按 LRU 淘汰最久没有继续对话的会话
+KV_CACHE_BUDGET_MB = int(os.getenv("QWEN_KV_CACHE_MB", "2048"))
+session_cache = SessionKVCache(max_bytes=KV_CACHE_BUDGET_MB * 1024 * 1024)
+# 跨会话共享前缀（chat template 开头、system prompt 等）的 KV cache 预算（MB）
+PREFIX_CACHE_BUDGET_MB = int(os.getenv("QWEN_PREFIX_CACHE_MB", "1024"))
+prefix_cache = RadixKVCache(max_bytes=PREFIX_CACHE_BUDGET_MB * 1024 * 1024)
+
+
+def init_model():
+    """加载模型，创建并启动共享的 decode 循环。在后台线程里执行，不阻塞服务启动"""
+    global model, tokenizer, engine, speculative_decoder, model_error
+    try:
+        model, tokenizer = load_model(model_name, quantization=QUANTIZATION, cache_dir=MODEL_CACHE_DIR or None)
+        if DRAFT_MODEL_PATH:
+            draft_model, _ = load_model(DRAFT_MODEL_PATH, quantization=QUANTIZATION, cache_dir=MODEL_CACHE_DIR or None)
+            speculative_decoder = SpeculativeDecoder(model, draft_model, num_draft_tokens=NUM_DRAFT_TOKENS)
+        # 所有请求共享一个 decode 循环，同时参与 decode 的请求数上限
+        engine = ContinuousBatchingEngine(
+            model, tokenizer, max_batch_size=16, session_cache=session_cache, prefix_cache=prefix_cache
+        )
+        engine.start()
+        model_ready.set()
+    except Exception as e:
+        model_error = e
+        raise
+
+
+@app.on_event("startup")
+def start_engine():
+    threading.Thread(target=init_model, name="qwen-model-init", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_engine():
+    if engine is not None:
+        engine.stop()
+
+
+def ensure_ready():
+    """模型还没加载完（或者加载失败）时直接返回 503，前端可以稍后重试"""
+    if not model_ready.is_set():
+        raise HTTPException(status_code=503, detail="model is loading" if model_error is None else f"model failed to load: {model_error}")
+
+
+@app.get("/ready")
+def ready():
+    """就绪检查：模型加载完成返回 200，否则 503"""
+    if model_ready.is_set():
+        return {"status": "ready", "model": model_name, "quantization": QUANTIZATION,
+                "draft_model": DRAFT_MODEL_PATH if speculative_decoder is not None else None}
+    status = "loading" if model_error is None else "error"
+    return JSONResponse(status_code=503, content={"status": status, "error": str(model_error) if model_error else None})
+
+
+def build_input_ids(data: dict) -> list:
+    """把请求体转换成 chat template 之后的 token ids"""
     prompt = data.get("query")
     print("用户输入：", prompt)
     print("类型：", type(prompt))
     history = data.get("history", [])
-    messages = [
+    # 带上历史对话，history 是 [{"role": ..., "content": ...}, ...] 格式
+    messages = history + [
     {"role": "user", "content": prompt}
     ]
+    # 可选的 system prompt（例如角色扮演设定），相同的 system prompt 会命中共享前缀缓存
+    if data.get("system"):
+        messages = [{"role": "system", "content": data["system"]}] + messages
 
     text = tokenizer.apply_chat_template(
         messages,
@@ -39,13 +121,42 @@ def chat(data: dict = Body(...)):
         add_generation_prompt=True,
         enable_thinking=True # 切换是否为思考模式
         )
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
-    generated = model.generate(
-        **model_inputs,
-        max_length=32768,
-        num_return_sequences=1
+    return tokenizer(text).input_ids
+
+
+def stop_strings(data: dict) -> list:
+    stop = data.get("stop") or []
+    return [stop] if isinstance(stop, str) else list(stop)
+
+
+def generation_params(data: dict, input_ids: list) -> dict:
+    """
+    生成参数：会话 id、生成预算和结束条件，以及按模型自带的 generation_config 设置的采样参数。
+    请求体里可选的字段：
+        max_new_tokens   最多生成多少个 token（不会超过 MAX_LENGTH 减去 prompt 长度）
+        thinking_budget  思考部分最多多少个 token，超过后强制结束思考开始回答
+        stop             stop 字符串（str 或 list），回答中出现时结束
+        timeout          墙钟时间上限（秒），超过后直接返回已经生成的内容
+    """
+    generation_config = model.generation_config
+    max_new_tokens = min(int(data.get("max_new_tokens") or DEFAULT_MAX_NEW_TOKENS), MAX_LENGTH - len(input_ids))
+    thinking_budget = int(data.get("thinking_budget") or DEFAULT_THINKING_BUDGET)
+    stopping_criteria = [DeadlineCriteria(float(data.get("timeout") or DEFAULT_TIMEOUT))]
+    if stop_strings(data):
+        stopping_criteria.append(StopStringCriteria(tokenizer, stop_strings(data), enable_thinking=True))
+    return dict(
+        session_id=data.get("session_id"),
+        max_new_tokens=max_new_tokens,
+        thinking_budget=ThinkingBudget(tokenizer, thinking_budget) if thinking_budget < max_new_tokens else None,
+        stopping_criteria=stopping_criteria,
+        temperature=generation_config.temperature if generation_config.do_sample else 0.0,
+        top_p=generation_config.top_p or 1.0,
+        top_k=generation_config.top_k or 0,
         )
-    output = generated[0][len(model_inputs.input_ids[0]):].tolist()
+
+
+def split_output(output: list, stop: list = ()):
+    """按 </think> 把生成结果拆成 (思考内容, 回答内容, 完整内容)，回答截断在 stop 字符串之前"""
     try:
         # rindex finding 151668 (</think>)
         index = len(output) - output[::-1].index(151668)
@@ -53,12 +164,94 @@ def chat(data: dict = Body(...)):
         index = 0
 
     thinking_content = tokenizer.decode(output[:index], skip_special_tokens=True).strip("\n")
-    content = tokenizer.decode(output[index:], skip_special_tokens=True).strip("\n")
+    content = truncate_at_stop(tokenizer.decode(output[index:], skip_special_tokens=True), stop).strip("\n")
     full_content = tokenizer.decode(output, skip_special_tokens=True).strip("\n")
+    return thinking_content, content, full_content
+
+
+def next_history(data: dict, content: str) -> list:
+    """把本轮的问答追加到 history 里返回给前端，下一轮原样带回来即可"""
+    return data.get("history", []) + [
+        {"role": "user", "content": data.get("query")},
+        {"role": "assistant", "content": content},
+    ]
+
 
-    response = {'thinking content':thinking_content,'content':content,'full content':full_content}
+@app.post("/chat")
+async def chat(data: dict = Body(...)):
+    ensure_ready()
+    input_ids = build_input_ids(data)
+    params = generation_params(data, input_ids)
+    speculative_stats = None
+    if data.get("speculative") and speculative_decoder is not None:
+        # 投机解码总是贪心解码，单独在线程池里跑，不进共享的 decode 循环
+        result = GenerationRequest(
+            input_ids=input_ids, max_new_tokens=params["max_new_tokens"],
+            stopping_criteria=params["stopping_criteria"], thinking_budget=params["thinking_budget"],
+            )
+        stats = await asyncio.get_running_loop().run_in_executor(None, speculative_decoder.generate, result)
+        speculative_stats = stats.to_dict()
+    else:
+        # 不再在 handler 里直接 model.generate，而是提交给共享的 decode 循环，等待生成结束
+        result = await engine.generate(input_ids, **params)
+    thinking_content, content, full_content = split_output(result.output_ids, stop_strings(data))
+
+    response = {'thinking content':thinking_content,'content':content,'full content':full_content,
+                'finish_reason':result.finish_reason,'history':next_history(data, content)}
+    if speculative_stats is not None:
+        # 本次请求的草稿 token 接受率等统计
+        response['speculative'] = speculative_stats
     return JSONResponse(content=response)
 
+
+def sse_event(data: dict, event: str = None) -> str:
+    """按 server-sent events 格式编码一条消息"""
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+
+@app.post("/chat/stream")
+async def chat_stream(data: dict = Body(...)):
+    """
+    流式接口，返回 text/event-stream：
+        data: {"type": "thinking" | "content", "delta": "..."}   每个增量
+        event: done / data: {"finish_reason": "...", "history": [...]}   生成结束
+        event: error / data: {"error": "..."}                     生成出错
+    """
+    ensure_ready()
+    input_ids = build_input_ids(data)
+    request, tokens = engine.stream(input_ids, **generation_params(data, input_ids))
+    streamer = ThinkContentStreamer(tokenizer, enable_thinking=True)
+    # 回答部分按 stop 字符串截断，和 /chat 的 split_output 一致，stop 本身不会发给客户端
+    stop_filter = StopStringFilter(stop_strings(data))
+
+    def deltas(pieces):
+        for phase, delta in pieces:
+            if phase == "content":
+                delta = stop_filter.put(delta)
+            if delta:
+                yield sse_event({"type": phase, "delta": delta})
+
+    async def events():
+        try:
+            async for token in tokens:
+                for event in deltas(streamer.put(token)):
+                    yield event
+            for event in deltas(streamer.end()):
+                yield event
+            tail = stop_filter.end()
+            if tail:
+                yield sse_event({"type": "content", "delta": tail})
+            _, content, _ = split_output(request.output_ids, stop_strings(data))
+            yield sse_event({"finish_reason": request.finish_reason, "history": next_history(data, content)}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            # 客户端断开时 StreamingResponse 会关闭这个生成器，这里顺带关闭 token 迭代器以取消请求
+            await tokens.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 if __name__ == '__main__':
     uvicorn.run(app, host="127.0.0.1", port=8000)
     # 下面这是针对在jupyter notebook里启动uvicorn的
@@ -1,56 +1,335 @@
-import requests
+import asyncio
+import json
 import logging
-from typing import Optional, List, Dict, Mapping, Any
-import langchain
+import os
+import random
+import threading
+import time
+import uuid
+import weakref
+from typing import Optional, List, Dict, Mapping, Any, Iterator, AsyncIterator, Tuple
+import httpx
 from langchain.llms.base import LLM
-from langchain_community.cache import InMemoryCache
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import GenerationChunk
+from pydantic import Field
 
-from typing import ClassVar
+from llm_cache import SQLiteLLMCache, make_cache_key
 
 logging.basicConfig(level=logging.INFO)
-langchain.llm_cache = InMemoryCache()
+logger = logging.getLogger(__name__)
+
+# 回复缓存：持久化到 SQLite，key 包含历史对话，所有 ChatLLM 实例共用（不再使用全局的 InMemoryCache）
+_response_cache: Optional[SQLiteLLMCache] = None
+
+# 所有 ChatLLM 实例共用一个 keep-alive 连接池（同步/异步各一个），避免每次请求都重新建立连接
+_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+_client: Optional[httpx.Client] = None
+# AsyncClient 不能跨事件循环使用，按事件循环区分；弱引用，事件循环被回收时对应的 client 也随之释放
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _get_client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(limits=_POOL_LIMITS)
+        return _client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = httpx.AsyncClient(limits=_POOL_LIMITS)
+        return client
+
+
+def get_response_cache() -> SQLiteLLMCache:
+    global _response_cache
+    with _client_lock:
+        if _response_cache is None:
+            _response_cache = SQLiteLLMCache(
+                database_path=os.getenv("QWEN_LLM_CACHE_PATH", "llm_cache.sqlite"),
+                max_entries=int(os.getenv("QWEN_LLM_CACHE_ENTRIES", "100000")),
+                ttl=float(os.getenv("QWEN_LLM_CACHE_TTL", str(7 * 24 * 3600))),
+            )
+        return _response_cache
+
+
+def _should_retry(error: Exception) -> bool:
+    """连接失败、超时，以及 429/5xx 响应才重试"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
 
 
 class ChatLLM(LLM):
-    url: ClassVar[str] = "http://127.0.0.1:8000/chat"
-    history: ClassVar[list] = []
+    url: str = "http://127.0.0.1:8000/chat"
+    model_name: str = "Qwen3-0.6B"  # 后端加载的模型，作为缓存 key 的一部分
+    stream_url: str = "http://127.0.0.1:8000/chat/stream"
+    # 每个实例（即每个会话）单独的历史记录，不再是所有用户共享的类变量
+    history: List[Dict[str, str]] = Field(default_factory=list)
     api_key: Optional[str] = None
+    # 后端会在多轮对话之间复用该会话的 KV cache，默认每个实例一个新的会话
+    session_id: Optional[str] = Field(default_factory=lambda: uuid.uuid4().hex)
+    connect_timeout: float = 5.0
+    read_timeout: float = 300.0  # 生成可能比较慢，读超时要比连接超时长得多
+    max_retries: int = 3
+    backoff_base: float = 0.5  # 第 n 次重试前等待 backoff_base * 2**n 秒（带随机抖动）
+    use_response_cache: bool = True
 
     @property
     def _llm_type(self) -> str:
         return "qwen-3.0"  # 修改为对应模型名称
 
-    def _construct_query(self, prompt: str) -> Dict:
+    @property
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {
+            'Authorization': f'Bearer {self.api_key or ""}',
+            'Content-Type': 'application/json'
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+
+    def _construct_query(self, prompt: str, stop: Optional[List[str]] = None) -> str:
         query = {
             "history": self.history,
-            "query": prompt
+            "query": prompt,
+            "session_id": self.session_id
         }
-        import json
+        if stop:
+            query["stop"] = stop
         query = json.dumps(query)
         return query
 
-    @classmethod
-    def _post(self, url: str, query: Dict) -> Any:
-        key = ""
-        headers = {
-            'Authorization': f'Bearer {key}',
-            'Content-Type': 'application/json'
-        }
-        response = requests.post(url, headers=headers, data=query).json()
-        return response
+    def _post(self, url: str, query: str) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = _get_client().post(url, headers=self._headers, content=query, timeout=self._timeout)
+                response.raise_for_status()
+                return response.json()
+            except Exception as e:
+                if attempt >= self.max_retries or not _should_retry(e):
+                    raise
+                logger.warning(f"请求 {url} 失败（{e}），第 {attempt + 1} 次重试")
+                time.sleep(self._backoff(attempt))
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None, api_key: Optional[str] = None) -> str:
-        query = self._construct_query(prompt=prompt)
-        response = self._post(url=self.url, query=query)
+    async def _apost(self, url: str, query: str) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await _get_async_client().post(url, headers=self._headers, content=query, timeout=self._timeout)
+                response.raise_for_status()
+                return response.json()
+            except Exception as e:
+                if attempt >= self.max_retries or not _should_retry(e):
+                    raise
+                logger.warning(f"请求 {url} 失败（{e}），第 {attempt + 1} 次重试")
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _cache_key(self, prompt: str, stop: Optional[List[str]]) -> str:
+        identity = {**self._identifying_params, "llm_type": self._llm_type, "stop": stop or []}
+        return make_cache_key(prompt, self.history, identity)
+
+    def _cached_reply(self, prompt: str, key: str) -> Optional[str]:
+        """命中缓存时按后端的格式自己把这一轮追加到 history 里"""
+        if not self.use_response_cache:
+            return None
+        content = get_response_cache().get(key)
+        if content is not None:
+            self.history = self.history + [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": content},
+            ]
+        return content
+
+    def _cache_reply(self, key: str, content: str) -> None:
+        if self.use_response_cache and content:
+            get_response_cache().set(key, content)
+
+    def _handle_response(self, response: Dict) -> str:
         #print("后端返回：", response)  # 调试用，这个会返回所有：think，content，full content
         response_chat = response.get('content', '')  # 取 content 字段
-        ChatLLM.history = response.get('history', ChatLLM.history) # 如果没有 history 字段则保持原样
+        self.history = response.get('history', self.history) # 如果没有 history 字段则保持原样
         return response_chat
 
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        key = self._cache_key(prompt, stop)
+        cached = self._cached_reply(prompt, key)
+        if cached is not None:
+            return cached
+        query = self._construct_query(prompt=prompt, stop=stop)
+        response = self._post(url=self.url, query=query)
+        content = self._handle_response(response)
+        if response.get("finish_reason", "stop") == "stop":
+            self._cache_reply(key, content)
+        return content
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        key = self._cache_key(prompt, stop)
+        cached = self._cached_reply(prompt, key)
+        if cached is not None:
+            return cached
+        query = self._construct_query(prompt=prompt, stop=stop)
+        response = await self._apost(url=self.url, query=query)
+        content = self._handle_response(response)
+        if response.get("finish_reason", "stop") == "stop":
+            self._cache_reply(key, content)
+        return content
+
+    def _parse_sse(self, lines: Iterator[str]) -> Iterator[Tuple[str, str]]:
+        """
+        解析 /chat/stream 返回的 server-sent events，逐个产出 (type, delta)，
+        最后产出 ("done", finish_reason)。这里按行喂入，同步和异步的流式接口共用
+        """
+        event = None
+        for line in lines:
+            if not line:  # 空行表示一条事件结束
+                event = None
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            payload = json.loads(line[len("data:"):].strip())
+            if event == "error":
+                raise RuntimeError(payload.get("error", "stream failed"))
+            if event == "done":
+                self.history = payload.get('history', self.history)
+                yield "done", payload.get("finish_reason")
+                return
+            yield payload["type"], payload["delta"]
+
+    def stream_events(self, prompt: str, stop: Optional[List[str]] = None) -> Iterator[Tuple[str, str]]:
+        """
+        调用后端的 /chat/stream，逐个产出 (type, delta)，type 为 "thinking" 或 "content"。
+        只有在还没收到任何内容之前失败才会重试，避免重复输出
+        """
+        key = self._cache_key(prompt, stop)
+        cached = self._cached_reply(prompt, key)
+        if cached is not None:
+            yield "content", cached
+            return
+        query = self._construct_query(prompt=prompt, stop=stop)
+        headers = {**self._headers, 'Accept': 'text/event-stream'}
+        received = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                with _get_client().stream("POST", self.stream_url, headers=headers, content=query, timeout=self._timeout) as response:
+                    response.raise_for_status()
+                    content = ""
+                    for phase, delta in self._parse_sse(response.iter_lines()):
+                        received = True
+                        if phase == "done":
+                            # 只缓存正常结束的回答，被截断（length/deadline）的不缓存
+                            if delta == "stop":
+                                self._cache_reply(key, content.strip("\n"))
+                            return
+                        if phase == "content":
+                            content += delta
+                        yield phase, delta
+                    return
+            except Exception as e:
+                if received or attempt >= self.max_retries or not _should_retry(e):
+                    raise
+                logger.warning(f"请求 {self.stream_url} 失败（{e}），第 {attempt + 1} 次重试")
+                time.sleep(self._backoff(attempt))
+
+    async def astream_events(self, prompt: str, stop: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, str]]:
+        """stream_events 的异步版本"""
+        key = self._cache_key(prompt, stop)
+        cached = self._cached_reply(prompt, key)
+        if cached is not None:
+            yield "content", cached
+            return
+        query = self._construct_query(prompt=prompt, stop=stop)
+        headers = {**self._headers, 'Accept': 'text/event-stream'}
+        received = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with _get_async_client().stream("POST", self.stream_url, headers=headers, content=query, timeout=self._timeout) as response:
+                    response.raise_for_status()
+                    lines, content = [], ""
+                    async for line in response.aiter_lines():
+                        lines.append(line)
+                        if line:
+                            continue
+                        # 收到空行说明一条事件完整了，交给 _parse_sse 解析
+                        for phase, delta in self._parse_sse(iter(lines)):
+                            received = True
+                            if phase == "done":
+                                if delta == "stop":
+                                    self._cache_reply(key, content.strip("\n"))
+                                return
+                            if phase == "content":
+                                content += delta
+                            yield phase, delta
+                        lines = []
+                    return
+            except Exception as e:
+                if received or attempt >= self.max_retries or not _should_retry(e):
+                    raise
+                logger.warning(f"请求 {self.stream_url} 失败（{e}），第 {attempt + 1} 次重试")
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        # 和 _call 一样只把 content 作为模型输出，需要思考过程时直接用 stream_events
+        for phase, delta in self.stream_events(prompt, stop=stop):
+            if phase != "content":
+                continue
+            chunk = GenerationChunk(text=delta)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        async for phase, delta in self.astream_events(prompt, stop=stop):
+            if phase != "content":
+                continue
+            chunk = GenerationChunk(text=delta)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
         _param_dict = {
-            "url": self.url
+            "url": self.url,
+            "model_name": self.model_name
         }
         return _param_dict
 
@@ -60,4 +339,4 @@ if __name__ == "__main__":
     while True:
         user_input   = input("我: ")
         response = llm(user_input)
-        print(f"ChatGLM: {response}")
\ No newline at end of file
+        print(f"ChatGLM: {response}")
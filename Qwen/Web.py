@@ -1,3 +1,7 @@
+import os
+import threading
+import time
+
 import gradio as gr
 from Front import ChatLLM #引用Front.py里面我们定义的ChatLLM
 
@@ -14,13 +18,37 @@ from Front import ChatLLM #引用Front.py里面我们定义的ChatLLM
 # demo.launch()
 
 
+# 每个浏览器会话一个 ChatLLM（各自的历史记录和后端 KV cache），底层共用同一个连接池
+# session_hash -> (ChatLLM, 上次使用的时间)；超过 SESSION_IDLE_SECONDS 没用过的会话会被清理
+SESSION_IDLE_SECONDS = float(os.getenv("QWEN_SESSION_IDLE_SECONDS", "3600"))
+sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session_llm(session_hash: str) -> ChatLLM:
+    now = time.monotonic()
+    with _sessions_lock:
+        for key in [k for k, (_, used) in sessions.items() if now - used > SESSION_IDLE_SECONDS]:
+            del sessions[key]
+        entry = sessions.get(session_hash)
+        # 先查再建，不会每条消息都构造一个用不上的 ChatLLM
+        llm = entry[0] if entry is not None else ChatLLM()
+        sessions[session_hash] = (llm, now)
+        return llm
+
+
 # 流式处理
-def stream_translate(messages,history):
-    llm = ChatLLM()
-    response = llm(messages)
-    # for chunk in response.split():
-    #     yield chunk + " "
-    return response
+def stream_translate(messages, history, request: gr.Request):
+    llm = get_session_llm(request.session_hash)
+    # 边生成边刷新：思考过程放在引用块里，回答内容在下面
+    thinking, content = "", ""
+    for phase, delta in llm.stream_events(messages):
+        if phase == "thinking":
+            thinking += delta
+        else:
+            content += delta
+        quoted = "\n".join("> " + line for line in thinking.split("\n")) if thinking else ""
+        yield f"{quoted}\n\n{content}" if quoted else content
 gr.ChatInterface(
     stream_translate,
     type="messages",
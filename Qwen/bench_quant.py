@@ -0,0 +1,134 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   量化模式对比测试   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+对比全精度模型和 CPU 量化模型：
+    - 困惑度（perplexity）：在同一批文本上计算，量化后不应明显升高
+    - 回答一致性：同样的 prompt 贪心解码，和全精度模型的输出逐 token 比较
+    - 速度和内存：生成的 tokens/sec，以及进程的峰值 RSS
+
+每种模式在单独的子进程里跑，这样 RSS 不会互相干扰：
+    python bench_quant.py --model_name /path/to/Qwen3-0.6B --modes auto int8 int4
+"""
+import argparse
+import json
+import math
+import resource
+import subprocess
+import sys
+import time
+
+DEFAULT_TEXTS = [
+    "今天天气很好，我们一起去公园散步吧。",
+    "The quick brown fox jumps over the lazy dog while the sun sets behind the hills.",
+    "大型语言模型通过预测下一个词来生成文本，训练数据的质量直接影响模型效果。",
+    "def fibonacci(n):\n    return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)",
+]
+DEFAULT_PROMPTS = [
+    "用一句话介绍一下你自己。",
+    "What is the capital of France?",
+    "1+1等于几？",
+]
+
+
+def parse_args():
+    parse = argparse.ArgumentParser(description="量化模式对比")
+    parse.add_argument("--model_name", type=str, required=True, help="模型目录")
+    parse.add_argument("--modes", type=str, nargs="+", default=["auto", "int8", "int4"], help="要对比的模式，第一个作为基准")
+    parse.add_argument("--max_new_tokens", type=int, default=64, help="回答一致性和速度测试的生成长度")
+    parse.add_argument("--max_ppl_increase", type=float, default=5.0, help="困惑度相对基准最多升高多少（百分比），超过则校验失败")
+    parse.add_argument("--min_agreement", type=float, default=0.5, help="贪心输出和基准的平均一致比例下限")
+    parse.add_argument("--worker", type=str, default=None, help="内部使用：在子进程里测试某一种模式")
+    return parse.parse_args()
+
+
+def peak_rss_mb() -> float:
+    # Linux 下 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(args) -> dict:
+    import torch
+    from model_loader import load_model
+
+    mode = None if args.worker == "auto" else args.worker
+    start = time.perf_counter()
+    model, tokenizer = load_model(args.model_name, quantization=mode)
+    load_seconds = time.perf_counter() - start
+
+    with torch.inference_mode():
+        # 困惑度：所有文本的平均每 token 负对数似然
+        total_nll, total_tokens = 0.0, 0
+        for text in DEFAULT_TEXTS:
+            input_ids = tokenizer(text, return_tensors="pt").input_ids.to(model.device)
+            loss = model(input_ids=input_ids, labels=input_ids).loss
+            n = input_ids.shape[1] - 1
+            total_nll += float(loss) * n
+            total_tokens += n
+
+        # 贪心解码，记录输出和速度
+        outputs, generated, decode_seconds = [], 0, 0.0
+        for prompt in DEFAULT_PROMPTS:
+            text = tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True, enable_thinking=False
+            )
+            model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+            start = time.perf_counter()
+            output = model.generate(**model_inputs, max_new_tokens=args.max_new_tokens, do_sample=False)
+            decode_seconds += time.perf_counter() - start
+            new_tokens = output[0][model_inputs.input_ids.shape[1]:].tolist()
+            generated += len(new_tokens)
+            outputs.append(new_tokens)
+
+    return {
+        "mode": args.worker,
+        "perplexity": math.exp(total_nll / total_tokens),
+        "tokens_per_second": generated / decode_seconds,
+        "load_seconds": load_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "outputs": outputs,
+    }
+
+
+def token_agreement(reference: list, candidate: list) -> float:
+    """从开头开始和基准输出一致的 token 比例（第一次分叉之后都算不一致）"""
+    same = 0
+    for a, b in zip(reference, candidate):
+        if a != b:
+            break
+        same += 1
+    return same / max(len(reference), 1)
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = []
+    for mode in args.modes:
+        command = [sys.executable, __file__, "--model_name", args.model_name,
+                   "--max_new_tokens", str(args.max_new_tokens), "--worker", mode]
+        completed = subprocess.run(command, capture_output=True, text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    baseline = results[0]
+    print(f"{'mode':<8}{'ppl':>10}{'Δppl%':>9}{'exact':>8}{'agree':>8}{'tok/s':>9}{'RSS MB':>10}{'load s':>9}  check")
+    failed = False
+    for result in results:
+        ppl_delta = (result["perplexity"] / baseline["perplexity"] - 1) * 100
+        exact = sum(a == b for a, b in zip(baseline["outputs"], result["outputs"])) / len(baseline["outputs"])
+        agree = sum(token_agreement(a, b) for a, b in zip(baseline["outputs"], result["outputs"])) / len(baseline["outputs"])
+        ok = ppl_delta <= args.max_ppl_increase and agree >= args.min_agreement
+        failed = failed or not ok
+        print(
+            f"{result['mode']:<8}{result['perplexity']:>10.3f}{ppl_delta:>9.2f}{exact:>8.2f}{agree:>8.2f}"
+            f"{result['tokens_per_second']:>9.2f}{result['peak_rss_mb']:>10.0f}{result['load_seconds']:>9.1f}"
+            f"  {'ok' if ok else 'FAIL'}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   连续批处理推理引擎   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+连续批处理（continuous batching）推理引擎。
+
+原来的 Back.py 每个 HTTP 请求单独跑一次 model.generate(...)，并发请求只能排队，
+这里改成一个后台线程里的共享 decode 循环：
+    - 新请求先进入等待队列，每一步 decode 之前都会把等待中的请求批量 prefill 后加入正在运行的 batch
+    - 每一步 decode 对 batch 里所有序列同时做一次前向，每个序列只喂入上一步采样出的那个 token
+    - 生成结束（EOS / 达到长度上限）的序列在当前步就从 batch 里移除，腾出位置给新请求
+    - 不同长度的序列统一左侧 padding，用 attention_mask 屏蔽 padding，position_ids 由 mask 累加得到
+
+HTTP 层只需要 submit 一个请求然后 await 它的结果。
+"""
+import asyncio
+import logging
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+# KV cache 统一用 legacy 格式保存：每一层一个 (key, value)，形状都是 [batch, heads, seq_len, head_dim]
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+@dataclass
+class GenerationRequest:
+    """一个等待生成/正在生成的序列"""
+    input_ids: List[int]
+    max_new_tokens: int
+    temperature: float = 0.6
+    top_p: float = 0.95
+    top_k: int = 20
+    output_ids: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    future: Future = field(default_factory=Future)
+    # 流式输出时每生成一个 token 就回调一次（在 decode 线程里调用）
+    on_token: Optional[Callable[[int], None]] = None
+    # 客户端断开等情况下置为 True，decode 循环会在下一步把它移出 batch
+    cancelled: bool = False
+    # 多轮对话的会话 id，设置后会复用/保存该会话的 KV cache
+    session_id: Optional[str] = None
+    # 本次请求复用了多少个 prompt token 的 KV cache
+    cached_tokens: int = 0
+    # 额外的结束条件（stop 字符串、墙钟时间上限等），见 stopping.py
+    stopping_criteria: List[Any] = field(default_factory=list)
+    # 思考 token 预算（stopping.ThinkingBudget），超出时强制插入 </think>
+    thinking_budget: Optional[Any] = None
+    # 下一步直接喂给模型、不经过采样的 token
+    forced_tokens: Deque[int] = field(default_factory=deque)
+
+
+def _to_legacy(past_key_values) -> LegacyCache:
+    """把模型返回的 Cache 对象转成 legacy tuple，方便在 batch 维度上拼接/裁剪"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple(past_key_values)
+
+
+def _from_legacy(cache: LegacyCache) -> DynamicCache:
+    return DynamicCache.from_legacy_cache(cache)
+
+
+def _left_pad_cache(cache: LegacyCache, pad: int) -> LegacyCache:
+    """在序列维度左侧补 pad 个全零位置（对应的 attention_mask 为 0，不会被注意到）"""
+    if pad == 0:
+        return cache
+    padded = []
+    for key, value in cache:
+        key_pad = key.new_zeros(key.shape[0], key.shape[1], pad, key.shape[3])
+        value_pad = value.new_zeros(value.shape[0], value.shape[1], pad, value.shape[3])
+        padded.append((torch.cat([key_pad, key], dim=2), torch.cat([value_pad, value], dim=2)))
+    return tuple(padded)
+
+
+def merge_batches(
+    cache_a: LegacyCache, mask_a: torch.Tensor, cache_b: LegacyCache, mask_b: torch.Tensor
+) -> Tuple[LegacyCache, torch.Tensor]:
+    """把两个 batch 的 KV cache 和 attention_mask 对齐长度后在 batch 维度拼接"""
+    length = max(mask_a.shape[1], mask_b.shape[1])
+    pad_a = length - mask_a.shape[1]
+    pad_b = length - mask_b.shape[1]
+    cache_a = _left_pad_cache(cache_a, pad_a)
+    cache_b = _left_pad_cache(cache_b, pad_b)
+    mask_a = torch.cat([mask_a.new_zeros(mask_a.shape[0], pad_a), mask_a], dim=1)
+    mask_b = torch.cat([mask_b.new_zeros(mask_b.shape[0], pad_b), mask_b], dim=1)
+    cache = tuple(
+        (torch.cat([ka, kb], dim=0), torch.cat([va, vb], dim=0))
+        for (ka, va), (kb, vb) in zip(cache_a, cache_b)
+    )
+    return cache, torch.cat([mask_a, mask_b], dim=0)
+
+
+def select_batch(
+    cache: LegacyCache, mask: torch.Tensor, keep: List[int]
+) -> Tuple[LegacyCache, torch.Tensor]:
+    """只保留 keep 里的序列，并去掉所有序列都是 padding 的前导列"""
+    index = torch.tensor(keep, device=mask.device)
+    mask = mask.index_select(0, index)
+    # 找到第一个至少有一个序列不是 padding 的位置
+    used = mask.any(dim=0).nonzero()
+    start = int(used[0]) if len(used) else mask.shape[1]
+    mask = mask[:, start:]
+    cache = tuple(
+        (key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+        for key, value in cache
+    )
+    return cache, mask
+
+
+def sequence_view(cache: LegacyCache, mask: torch.Tensor, row: int) -> LegacyCache:
+    """batch 中某一条序列的 KV cache（去掉左侧 padding），返回的是视图"""
+    start = int((mask[row] == 0).sum())
+    return tuple((key[row:row + 1, :, start:], value[row:row + 1, :, start:]) for key, value in cache)
+
+
+def extract_sequence(cache: LegacyCache, mask: torch.Tensor, row: int) -> LegacyCache:
+    """和 sequence_view 一样，但复制一份，以免一直引用整个 batch 的 KV"""
+    return tuple((key.clone(), value.clone()) for key, value in sequence_view(cache, mask, row))
+
+
+def sample_token(logits: torch.Tensor, temperature: float, top_p: float, top_k: int) -> int:
+    """对单个序列最后一个位置的 logits 采样，temperature<=0 时退化为贪心"""
+    if temperature <= 0:
+        return int(torch.argmax(logits))
+    logits = logits.float() / temperature
+    if top_k and top_k > 0:
+        top_k = min(top_k, logits.shape[-1])
+        kth = torch.topk(logits, top_k).values[-1]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    probs = torch.softmax(logits, dim=-1)
+    if top_p < 1.0:
+        sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+        cumulative = torch.cumsum(sorted_probs, dim=-1)
+        # 保留累计概率刚好超过 top_p 的最小集合
+        remove = cumulative - sorted_probs > top_p
+        sorted_probs = sorted_probs.masked_fill(remove, 0.0)
+        choice = torch.multinomial(sorted_probs / sorted_probs.sum(), 1)
+        return int(sorted_idx[choice])
+    return int(torch.multinomial(probs, 1))
+
+
+class ContinuousBatchingEngine:
+    """
+    在一个后台线程里运行共享 decode 循环的推理引擎。
+
+    Args:
+        model: 已加载的 CausalLM 模型
+        tokenizer: 对应的 tokenizer（用来取 pad/eos token）
+        max_batch_size: 同时参与 decode 的最大序列数
+        session_cache: 可选的 SessionKVCache，用于多轮对话之间复用 KV cache
+        prefix_cache: 可选的 RadixKVCache，所有请求共享的前缀 KV cache（system prompt、模板开头等）
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 16, session_cache=None, prefix_cache=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.session_cache = session_cache
+        self.prefix_cache = prefix_cache
+
+        eos = model.generation_config.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        pad = tokenizer.pad_token_id
+        self.pad_token_id = pad if pad is not None else next(iter(self.eos_token_ids))
+
+        self._pending: "queue.Queue[GenerationRequest]" = queue.Queue()
+        self._running: List[GenerationRequest] = []
+        self._admitting: List[GenerationRequest] = []  # 正在 prefill、还没并入 batch 的请求
+        self._cache: Optional[LegacyCache] = None
+        self._mask: Optional[torch.Tensor] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------ 对外接口
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="qwen-decode-loop", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, input_ids: List[int], max_new_tokens: int, **sampling) -> GenerationRequest:
+        """提交一个请求，返回的 GenerationRequest.future 会在生成结束后 set_result(自身)"""
+        request = GenerationRequest(input_ids=list(input_ids), max_new_tokens=max_new_tokens, **sampling)
+        self._pending.put(request)
+        return request
+
+    async def generate(self, input_ids: List[int], max_new_tokens: int, **sampling) -> GenerationRequest:
+        """异步版本：给 FastAPI 的 async handler 用"""
+        request = self.submit(input_ids, max_new_tokens, **sampling)
+        return await asyncio.wrap_future(request.future)
+
+    def stream(
+        self, input_ids: List[int], max_new_tokens: int, **sampling
+    ) -> Tuple[GenerationRequest, AsyncIterator[int]]:
+        """
+        流式版本（需要在事件循环里调用）：返回请求本身和一个逐 token 产出的异步迭代器。
+        迭代结束后可以从 request.finish_reason 拿到结束原因；调用方提前退出时会取消对应的请求。
+        """
+        loop = asyncio.get_running_loop()
+        tokens: "asyncio.Queue[Optional[int]]" = asyncio.Queue()
+        request = self.submit(
+            input_ids,
+            max_new_tokens,
+            on_token=lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token),
+            **sampling,
+        )
+        # future 完成时放入 None 作为结束标记（和 on_token 在同一线程按顺序调度，不会乱序）
+        request.future.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, None))
+
+        async def iterate() -> AsyncIterator[int]:
+            try:
+                while True:
+                    token = await tokens.get()
+                    if token is None:
+                        break
+                    yield token
+                # 如果 decode 循环出错，这里把异常抛给调用方
+                request.future.result()
+            finally:
+                if not request.future.done():
+                    request.cancelled = True
+
+        return request, iterate()
+
+    # ------------------------------------------------------------------ decode 循环
+
+    def _loop(self) -> None:
+        with torch.inference_mode():
+            while not self._stop.is_set():
+                try:
+                    self._admit()
+                    if self._running:
+                        self._decode_step()
+                except Exception as e:
+                    # 出错时让当前 batch 里的请求都失败返回，引擎本身继续服务后续请求
+                    logger.exception("decode loop failed")
+                    for request in self._running + self._admitting:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    self._running, self._admitting, self._cache, self._mask = [], [], None, None
+
+    def _admit(self) -> None:
+        """把等待队列里的请求 prefill 后并入正在运行的 batch"""
+        new_requests: List[GenerationRequest] = []
+        # batch 为空时阻塞等待，避免空转
+        if not self._running:
+            try:
+                new_requests.append(self._pending.get(timeout=0.1))
+            except queue.Empty:
+                return
+        while len(self._running) + len(new_requests) < self.max_batch_size:
+            try:
+                new_requests.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if not new_requests:
+            return
+
+        self._admitting = new_requests
+        # 能复用 KV cache（会话缓存或共享前缀，取匹配更长的那个）的请求单独 prefill 剩余部分，
+        # 其余请求一起批量 prefill
+        fresh: List[GenerationRequest] = []
+        for request in new_requests:
+            length, prefix, handle = 0, None, None
+            if self.session_cache is not None and request.session_id is not None:
+                length, prefix = self.session_cache.lookup(request.session_id, request.input_ids)
+            if self.prefix_cache is not None:
+                handle = self.prefix_cache.lookup(request.input_ids)
+                if handle.length > length:
+                    length, prefix = handle.length, handle.cache
+            if prefix is None:
+                fresh.append(request)
+                continue
+            request.cached_tokens = length
+            try:
+                prefilled = self._prefill_with_prefix(request, prefix)
+            finally:
+                if handle is not None:
+                    self.prefix_cache.release(handle)
+            self._join(*prefilled)
+        if fresh:
+            self._join(*self._prefill(fresh))
+        self._admitting = []
+
+    def _join(self, requests: List[GenerationRequest], cache: LegacyCache, mask: torch.Tensor, logits) -> None:
+        """对刚 prefill 完的一组请求采样第一个 token，然后并入正在运行的 batch"""
+        if self.prefix_cache is not None:
+            # prompt 的 KV 放进共享前缀树，之后相同前缀的请求（不管哪个会话）都能复用
+            for i, request in enumerate(requests):
+                self.prefix_cache.insert(request.input_ids, sequence_view(cache, mask, i))
+        keep = [i for i, request in enumerate(requests) if not self._append_token(request, logits[i], cache, mask, i)]
+        if not keep:
+            return
+        if len(keep) < len(requests):
+            requests = [requests[i] for i in keep]
+            cache, mask = select_batch(cache, mask, keep)
+
+        if self._running:
+            self._cache, self._mask = merge_batches(self._cache, self._mask, cache, mask)
+        else:
+            self._cache, self._mask = cache, mask
+        self._running.extend(requests)
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        """左侧 padding 后对一组新请求做一次批量前向"""
+        device = self.model.device
+        length = max(len(r.input_ids) for r in requests)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(requests), length), dtype=torch.long)
+        for i, request in enumerate(requests):
+            n = len(request.input_ids)
+            input_ids[i, length - n:] = torch.tensor(request.input_ids, dtype=torch.long)
+            mask[i, length - n:] = 1
+        input_ids, mask = input_ids.to(device), mask.to(device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        return requests, _to_legacy(outputs.past_key_values), mask, outputs.logits[:, -1, :]
+
+    def _prefill_with_prefix(self, request: GenerationRequest, prefix: LegacyCache):
+        """已经有前 cached_tokens 个 token 的 KV cache 时，只 prefill 剩下的 token"""
+        device = self.model.device
+        start = request.cached_tokens
+        input_ids = torch.tensor([request.input_ids[start:]], dtype=torch.long, device=device)
+        mask = torch.ones((1, len(request.input_ids)), dtype=torch.long, device=device)
+        position_ids = torch.arange(start, len(request.input_ids), device=device).unsqueeze(0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(prefix),
+            use_cache=True,
+        )
+        return [request], _to_legacy(outputs.past_key_values), mask, outputs.logits[:, -1, :]
+
+    def _decode_step(self) -> None:
+        """batch 内每个序列喂入上一步采样出的 token，前向一次并采样下一个 token"""
+        device = self.model.device
+        input_ids = torch.tensor([[r.output_ids[-1]] for r in self._running], dtype=torch.long, device=device)
+        mask = torch.cat([self._mask, self._mask.new_ones(len(self._running), 1)], dim=1)
+        position_ids = mask.sum(dim=-1, keepdim=True) - 1
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(self._cache),
+            use_cache=True,
+        )
+        self._cache, self._mask = _to_legacy(outputs.past_key_values), mask
+
+        logits = outputs.logits[:, -1, :]
+        keep = [
+            i for i, request in enumerate(self._running)
+            if not self._append_token(request, logits[i], self._cache, self._mask, i)
+        ]
+        if len(keep) < len(self._running):
+            self._running = [self._running[i] for i in keep]
+            if keep:
+                self._cache, self._mask = select_batch(self._cache, self._mask, keep)
+            else:
+                self._cache, self._mask = None, None
+
+    def _append_token(
+        self, request: GenerationRequest, logits: torch.Tensor, cache: LegacyCache, mask: torch.Tensor, row: int
+    ) -> bool:
+        """采样并追加一个 token，如果序列因此结束则返回 True 并完成 future"""
+        if request.cancelled:
+            request.finish_reason = "cancelled"
+            request.future.set_result(request)
+            return True
+        if request.forced_tokens:
+            token = request.forced_tokens.popleft()
+        else:
+            token = sample_token(logits, request.temperature, request.top_p, request.top_k)
+        request.output_ids.append(token)
+        if request.on_token is not None:
+            request.on_token(token)
+        if request.thinking_budget is not None:
+            request.forced_tokens.extend(request.thinking_budget(request.output_ids))
+
+        if token in self.eos_token_ids:
+            request.finish_reason = "stop"
+        elif len(request.output_ids) >= request.max_new_tokens:
+            request.finish_reason = "length"
+        else:
+            request.finish_reason = next(
+                (reason for reason in (c(request.output_ids) for c in request.stopping_criteria) if reason), None
+            )
+            if request.finish_reason is None:
+                return False
+        self._save_session(request, cache, mask, row)
+        request.future.set_result(request)
+        return True
+
+    def _save_session(self, request: GenerationRequest, cache: LegacyCache, mask: torch.Tensor, row: int) -> None:
+        """序列结束时把它的 KV cache 存进会话缓存（最后采样的 token 还没有喂给模型，不在 cache 里）"""
+        if self.session_cache is None or request.session_id is None:
+            return
+        token_ids = request.input_ids + request.output_ids[:-1]
+        self.session_cache.store(request.session_id, token_ids, extract_sequence(cache, mask, row))
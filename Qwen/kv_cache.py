@@ -0,0 +1,235 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   多轮对话 KV cache 复用   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+按会话（session_id）缓存上一轮结束时的 past_key_values 以及对应的 token 序列。
+
+下一轮请求到来时，取缓存 token 和新 prompt 的最长公共前缀，这部分直接复用缓存的 KV，
+只需要 prefill 剩下的部分。Qwen3 的 chat template 在渲染历史轮次时会去掉 <think> 内容，
+所以公共前缀一般停在上一轮 assistant 回复的开头：每轮只需要 prefill 上一轮回复 + 新的用户消息，
+而不是整段对话。
+
+所有缓存按 LRU 淘汰，总占用不超过给定的显存/内存预算。
+"""
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+
+from engine import LegacyCache
+
+
+def cache_nbytes(cache: LegacyCache) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in cache)
+
+
+def slice_cache(cache: LegacyCache, length: int) -> LegacyCache:
+    """只保留前 length 个位置的 KV（切片是视图，不会复制）"""
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in cache)
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class SessionKVCache:
+    """
+    Args:
+        max_bytes: 所有会话的 KV cache 总字节数上限，超过后按最久未使用淘汰
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[List[int], LegacyCache, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, session_id: str, input_ids: Sequence[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """
+        返回 (可复用的前缀长度, 对应的 KV cache)；没有可复用的缓存时返回 (0, None)。
+        至少留一个 token 给 prefill，这样才能拿到最后一个位置的 logits。
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return 0, None
+            self._entries.move_to_end(session_id)
+            token_ids, cache, _ = entry
+        length = min(common_prefix_length(token_ids, input_ids), len(input_ids) - 1)
+        if length <= 0:
+            return 0, None
+        return length, slice_cache(cache, length)
+
+    def store(self, session_id: str, token_ids: List[int], cache: LegacyCache) -> None:
+        """保存某个会话最新的 token 序列和 KV cache（batch 维度为 1），覆盖旧的"""
+        nbytes = cache_nbytes(cache)
+        with self._lock:
+            self._pop(session_id)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[session_id] = (list(token_ids), cache, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._pop(session_id)
+
+    def _pop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+
+#****************************************************************************************************************************************************************
+#************************************************************************   跨会话共享前缀（radix tree）   ************************************************************************
+#****************************************************************************************************************************************************************
+
+
+class _RadixNode:
+    """radix tree 的一个节点：tokens 是从父节点到这里的那一段边，cache 是这一段 token 的 KV（batch 维度为 1）"""
+
+    __slots__ = ("tokens", "cache", "nbytes", "children", "parent", "ref_count", "last_access")
+
+    def __init__(self, tokens: Tuple[int, ...], cache: Optional[LegacyCache], parent: Optional["_RadixNode"]):
+        self.tokens = tokens
+        self.cache = cache
+        self.nbytes = cache_nbytes(cache) if cache is not None else 0
+        self.children: dict = {}  # 子节点第一个 token -> 子节点
+        self.parent = parent
+        self.ref_count = 0
+        self.last_access = 0
+
+
+class PrefixHandle:
+    """
+    lookup 的结果：复用的前缀长度、拼好的 KV cache，以及匹配路径上最深的节点。
+    从该节点到根的整条路径都被引用（不会被淘汰）；节点被切分时新节点继承引用计数，所以 release 时沿 parent 回溯即可。
+    """
+
+    def __init__(self, length: int, cache: Optional[LegacyCache], node: Optional[_RadixNode]):
+        self.length = length
+        self.cache = cache
+        self.node = node
+
+
+class RadixKVCache:
+    """
+    按 token 前缀组织的共享 KV cache，不区分会话：chat template 的开头、相同的 system prompt、
+    相同的 RAG 指令等，只要 token 前缀相同就能复用。
+
+    每个节点只保存自己那一段边上 token 的 KV，查找时沿路径把各段拼起来；
+    正在被使用的节点有引用计数，不会被淘汰；超过预算时从最久未使用、且没有被引用的叶子节点开始淘汰。
+
+    Args:
+        max_bytes: 所有节点 KV cache 的总字节数上限
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._root = _RadixNode((), None, None)
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, input_ids: Sequence[int]) -> PrefixHandle:
+        """
+        查找 input_ids 在树中的最长匹配前缀（至少留一个 token 给 prefill）。
+        返回的 handle 用完之后需要调用 release，否则路径上的节点一直不会被淘汰。
+        """
+        limit = len(input_ids) - 1
+        with self._lock:
+            self._clock += 1
+            node, length = self._root, 0
+            deepest, blocks = None, []
+            while length < limit:
+                child = node.children.get(input_ids[length])
+                if child is None:
+                    break
+                matched = common_prefix_length(child.tokens, input_ids[length:limit])
+                child.ref_count += 1
+                child.last_access = self._clock
+                deepest = child
+                blocks.append(child.cache if matched == len(child.tokens) else slice_cache(child.cache, matched))
+                length += matched
+                if matched < len(child.tokens):
+                    break
+                node = child
+        if not blocks:
+            return PrefixHandle(0, None, None)
+        cache = tuple(
+            (torch.cat([block[layer][0] for block in blocks], dim=2), torch.cat([block[layer][1] for block in blocks], dim=2))
+            for layer in range(len(blocks[0]))
+        )
+        return PrefixHandle(length, cache, deepest)
+
+    def release(self, handle: PrefixHandle) -> None:
+        with self._lock:
+            node = handle.node
+            while node is not None and node is not self._root:
+                node.ref_count -= 1
+                node = node.parent
+        handle.node = None
+
+    def insert(self, token_ids: Sequence[int], cache: LegacyCache) -> None:
+        """插入一条 token 序列及其 KV cache（batch 维度为 1，长度等于 len(token_ids)），已存在的部分不会重复保存"""
+        token_ids = tuple(token_ids)
+        with self._lock:
+            self._clock += 1
+            node, length = self._root, 0
+            while length < len(token_ids):
+                child = node.children.get(token_ids[length])
+                if child is None:
+                    # 剩下的部分作为一个新的叶子节点，复制一份 KV，避免引用整条序列的大 tensor
+                    block = tuple(
+                        (k[:, :, length:].clone(), v[:, :, length:].clone()) for k, v in cache
+                    )
+                    leaf = _RadixNode(token_ids[length:], block, node)
+                    leaf.last_access = self._clock
+                    node.children[token_ids[length]] = leaf
+                    self.total_bytes += leaf.nbytes
+                    break
+                matched = common_prefix_length(child.tokens, token_ids[length:])
+                if matched < len(child.tokens):
+                    child = self._split(child, matched)
+                child.last_access = self._clock
+                node, length = child, length + matched
+            self._evict()
+
+    def _split(self, node: _RadixNode, at: int) -> _RadixNode:
+        """把 node 的边在 at 处切开，返回新的前半段节点"""
+        head_cache = tuple((k[:, :, :at].clone(), v[:, :, :at].clone()) for k, v in node.cache)
+        tail_cache = tuple((k[:, :, at:].clone(), v[:, :, at:].clone()) for k, v in node.cache)
+        head = _RadixNode(node.tokens[:at], head_cache, node.parent)
+        head.ref_count, head.last_access = node.ref_count, node.last_access
+        node.parent.children[node.tokens[0]] = head
+
+        self.total_bytes -= node.nbytes
+        node.tokens, node.cache, node.parent = node.tokens[at:], tail_cache, head
+        node.nbytes = cache_nbytes(tail_cache)
+        head.children[node.tokens[0]] = node
+        self.total_bytes += head.nbytes + node.nbytes
+        return head
+
+    def _evict(self) -> None:
+        """从最久未使用、没有被引用的叶子开始淘汰，直到总占用不超过预算"""
+        while self.total_bytes > self.max_bytes:
+            leaves = []
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                if node.children:
+                    stack.extend(node.children.values())
+                elif node is not self._root and node.ref_count == 0:
+                    leaves.append(node)
+            if not leaves:
+                return
+            victim = min(leaves, key=lambda n: n.last_access)
+            del victim.parent.children[victim.tokens[0]]
+            self.total_bytes -= victim.nbytes
@@ -0,0 +1,171 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   持久化的回复缓存   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+替代 Front.py 里全局的 InMemoryCache：
+    - 缓存 key 是 (prompt, history, 模型标识, 生成参数) 规范化 JSON 的 sha256，多轮对话里不会串答案
+    - 数据保存在 SQLite 文件里，重启后依然有效；进程内再放一层小的 LRU，热点问题不用查库
+    - 条目数上限 + TTL，超出时按最近最少使用淘汰
+    - 统计命中/未命中/淘汰次数
+
+同时实现了 LangChain 的 BaseCache 接口，也可以直接设置为 langchain.llm_cache 使用。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+
+def make_cache_key(prompt: str, history: Sequence[Dict[str, str]], identity: Dict[str, Any]) -> str:
+    """规范化（排序 key、去掉多余空白）之后取 sha256，内容相同的请求一定得到相同的 key"""
+    payload = json.dumps(
+        {"prompt": prompt, "history": list(history), "identity": identity},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Args:
+        database_path: SQLite 文件路径
+        max_entries: 最多保存多少条回复，超过后淘汰最久没有被命中的
+        ttl: 条目的有效期（秒），None 表示不过期
+        memory_entries: 进程内 LRU 的大小
+    """
+
+    def __init__(
+        self,
+        database_path: str = "llm_cache.sqlite",
+        max_entries: int = 100000,
+        ttl: Optional[float] = 7 * 24 * 3600,
+        memory_entries: int = 1024,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, created)
+        # 内存命中的访问时间先记在这里，淘汰前（或攒够一批时）批量写回数据库
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(database_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_created ON llm_cache(created)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        self._last_purge = 0.0
+
+    # ------------------------------------------------------------------ 按 key 读写（ChatLLM 直接使用）
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                # 内存命中不立即写库，访问时间攒起来批量更新，否则热点条目在库里反而最先被淘汰
+                self._touched[key] = now
+                if len(self._touched) >= self.memory_entries:
+                    self._flush_touched()
+                return entry[0]
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                if row is not None:
+                    self._delete(key)
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._size += 0 if exists else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._remember(key, value, now)
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": self._size}
+
+    # ------------------------------------------------------------------ LangChain BaseCache 接口
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self.get(make_cache_key(prompt, [], {"llm_string": llm_string}))
+        return loads(value) if value is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.set(make_cache_key(prompt, [], {"llm_string": llm_string}), dumps(list(return_val)))
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._memory.clear()
+            self._touched.clear()
+            self._size = 0
+
+    # ------------------------------------------------------------------ 内部实现（调用方持有锁）
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key: str, value: str, created: float) -> None:
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE llm_cache SET accessed = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _delete(self, key: str) -> None:
+        self._size -= self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,)).rowcount
+        self._memory.pop(key, None)
+        self.evictions += 1
+
+    def _evict(self) -> None:
+        """过期条目每分钟清理一次；超出条目数上限时按访问时间删掉最旧的部分"""
+        now = time.time()
+        if self.ttl is not None and now - self._last_purge > 60:
+            self._last_purge = now
+            removed = self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,)).rowcount
+            self._size -= removed
+            self.evictions += removed
+        if self._size > self.max_entries:
+            self._flush_touched()
+            victims: List[tuple] = self._conn.execute(
+                "SELECT key FROM llm_cache ORDER BY accessed LIMIT ?", (self._size - self.max_entries,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+            for (key,) in victims:
+                self._memory.pop(key, None)
+            self._size -= len(victims)
+            self.evictions += len(victims)
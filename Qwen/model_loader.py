@@ -0,0 +1,243 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   模型加载（支持 CPU 量化）   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+加载模型和 tokenizer，支持几种精度：
+    - None / "auto"  原来的方式：torch_dtype="auto", device_map="auto"
+    - "int8"         CPU 上的动态 int8 量化：Linear 层权重存成 int8，激活在运行时按 batch 动态量化，
+                     用的是 torch 自带的 quantize_dynamic（fbgemm/qnnpack int8 matmul）
+    - "int4"         CPU 上的 weight-only int4：Linear 权重按组（group_size 个一组）量化成 4bit，
+                     两个权重打包进一个 uint8，前向时再反量化成 float 计算。主要是省内存，速度不一定比 int8 快
+
+量化模式一定在 CPU 上以 float32 加载后再做量化。
+
+冷启动优化（cache_dir 不为空时）：第一次启动时把权重转换成单个 safetensors 文件放到 cache_dir，
+之后直接 mmap 这个文件，参数 tensor 就是文件映射的只读内存，不需要反序列化/复制。
+多个 uvicorn worker 映射同一个文件时共用操作系统 page cache 里的同一份权重。
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+from typing import Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = (None, "auto", "int8", "int4")
+
+
+class Int4WeightOnlyLinear(nn.Module):
+    """
+    weight-only int4 的 Linear：每 group_size 个输入通道共用一组 scale / zero point（非对称量化）。
+    """
+
+    def __init__(self, linear: nn.Linear, group_size: int = 128):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        weight = linear.weight.detach().float()
+        if self.in_features % group_size != 0:
+            group_size = self.in_features
+        self.group_size = group_size
+
+        groups = weight.reshape(self.out_features, self.in_features // group_size, group_size)
+        w_min = groups.amin(dim=-1, keepdim=True)
+        w_max = groups.amax(dim=-1, keepdim=True)
+        scale = ((w_max - w_min) / 15).clamp(min=1e-8)
+        q = torch.clamp(torch.round((groups - w_min) / scale), 0, 15).to(torch.uint8)
+        q = q.reshape(self.out_features, self.in_features)
+        # 相邻两个 4bit 权重打包进一个字节
+        packed = q[:, 0::2] | (q[:, 1::2] << 4)
+
+        self.register_buffer("packed_weight", packed.contiguous())
+        self.register_buffer("scale", scale.to(torch.float16))
+        self.register_buffer("w_min", w_min.to(torch.float16))
+        if linear.bias is not None:
+            self.register_buffer("bias", linear.bias.detach().float().clone())
+        else:
+            self.bias = None
+
+    def dequantize(self) -> torch.Tensor:
+        low = self.packed_weight & 0x0F
+        high = self.packed_weight >> 4
+        q = torch.stack([low, high], dim=-1).reshape(self.out_features, self.in_features)
+        groups = q.reshape(self.out_features, self.in_features // self.group_size, self.group_size).float()
+        weight = groups * self.scale.float() + self.w_min.float()
+        return weight.reshape(self.out_features, self.in_features)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return F.linear(x, self.dequantize().to(x.dtype), self.bias)
+
+
+def quantize_int4_weight_only(model: nn.Module, group_size: int = 128) -> nn.Module:
+    """把模型里所有 in_features 为偶数的 nn.Linear 替换成 Int4WeightOnlyLinear"""
+    for name, module in model.named_children():
+        if isinstance(module, nn.Linear) and module.in_features % 2 == 0:
+            setattr(model, name, Int4WeightOnlyLinear(module, group_size))
+        else:
+            quantize_int4_weight_only(module, group_size)
+    return model
+
+
+def quantize_int8_dynamic(model: nn.Module) -> nn.Module:
+    """torch 自带的动态 int8 量化，只作用于 nn.Linear"""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+# safetensors 头部里的 dtype 名称 -> torch dtype
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _source_fingerprint(model_name: str) -> str:
+    """源模型目录里每个文件的相对路径、大小和 mtime；同一路径下的权重被替换后结果会变。不是本地路径时为空"""
+    if os.path.isfile(model_name):
+        stat = os.stat(model_name)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    if not os.path.isdir(model_name):
+        return ""
+    entries = []
+    for root, dirs, files in os.walk(model_name):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            full = os.path.join(root, name)
+            stat = os.stat(full)
+            entries.append(f"{os.path.relpath(full, model_name)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "\n".join(entries)
+
+
+def _cache_path(model_name: str, cache_dir: str) -> str:
+    """每个源模型（路径 + 文件的大小/mtime）对应 cache_dir 下的一个子目录"""
+    source = f"{os.path.abspath(model_name)}\n{_source_fingerprint(model_name)}"
+    key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, key)
+
+
+def prepare_mmap_weights(model_name: str, cache_dir: str) -> str:
+    """
+    第一次调用时加载原始模型，把 config 和所有权重（共享的权重只存一份）写进 cache_dir，
+    之后直接返回已有的目录。写入先写临时文件再 rename，多个 worker 同时启动也不会读到写了一半的文件。
+    """
+    from modelscope import AutoModelForCausalLM
+    from safetensors.torch import save_model
+
+    path = _cache_path(model_name, cache_dir)
+    weights = os.path.join(path, "model.safetensors")
+    if os.path.exists(weights):
+        return path
+
+    os.makedirs(path, exist_ok=True)
+    logger.info(f"Converting {model_name} to mmap-able safetensors in {path}")
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", device_map="cpu")
+    model.config.save_pretrained(path)
+    tmp = f"{weights}.{os.getpid()}.tmp"
+    save_model(model, tmp)
+    os.replace(tmp, weights)
+    return path
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    按 safetensors 的格式（8 字节头长度 + JSON 头 + 原始数据）直接 mmap 文件，
+    返回的 tensor 和文件共用内存，不做任何复制。文件是只读映射，这些 tensor 不能原地修改。
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header_size = int.from_bytes(buffer[:8], "little")
+    header = json.loads(buffer[8:8 + header_size])
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=count, offset=base + start).reshape(info["shape"])
+    return tensors
+
+
+def load_mmap_model(path: str) -> nn.Module:
+    """先创建不分配参数内存的空模型，再把 mmap 出来的 tensor 直接作为参数"""
+    import warnings
+
+    from accelerate import init_empty_weights
+    from modelscope import AutoConfig, AutoModelForCausalLM
+
+    config = AutoConfig.from_pretrained(path)
+    # 只把参数放在 meta 设备上，rotary 的 inv_freq 之类的 buffer 仍然正常初始化
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=config.torch_dtype)
+    with warnings.catch_warnings():
+        # mmap 是只读的，torch.frombuffer 会提示 tensor 不可写，推理时不会写权重
+        warnings.simplefilter("ignore", UserWarning)
+        state_dict = mmap_safetensors(os.path.join(path, "model.safetensors"))
+    # 不能用 strict=True：save_model 对共享的权重（比如 tie_word_embeddings 时的 lm_head）只保存一份
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    if result.unexpected_keys:
+        raise RuntimeError(f"Unexpected keys in {path}: {result.unexpected_keys}")
+    # 重新绑定共享的权重，之后还留在 meta 设备上的参数就是缓存里真的缺少的
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"Missing keys in {path}: {missing}")
+    return model.eval()
+
+
+def load_model(
+    model_name: str, quantization: Optional[str] = None, cache_dir: Optional[str] = None
+) -> Tuple[nn.Module, object]:
+    """
+    Args:
+        model_name: 模型目录
+        quantization: None / "auto" / "int8" / "int4"
+        cache_dir: 不为空时使用 mmap 的 safetensors 缓存加速加载（见模块说明）
+
+    Returns:
+        (model, tokenizer)
+    """
+    from modelscope import AutoModelForCausalLM, AutoTokenizer
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}, expected one of {QUANTIZATION_MODES}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if quantization in (None, "auto"):
+        if cache_dir:
+            model = load_mmap_model(prepare_mmap_weights(model_name, cache_dir))
+            # 有 GPU 时搬到 GPU 上（这一步会复制），没有 GPU 时参数一直是 mmap 的
+            if torch.cuda.is_available():
+                model = model.to("cuda")
+            return model, tokenizer
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype="auto",
+            device_map="auto"
+        )
+        return model, tokenizer
+
+    # 量化模式：在 CPU 上以 float32 加载，再替换 Linear 层（量化后的权重是每个进程自己的）
+    if cache_dir:
+        model = load_mmap_model(prepare_mmap_weights(model_name, cache_dir)).float()
+    else:
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, device_map="cpu")
+    model.eval()
+    if quantization == "int8":
+        model = quantize_int8_dynamic(model)
+    else:
+        model = quantize_int4_weight_only(model)
+    logger.info(f"Loaded {model_name} with {quantization} quantization on CPU")
+    return model, tokenizer
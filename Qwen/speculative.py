@@ -0,0 +1,231 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   投机解码（speculative decoding）   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+用一个小的草稿模型（比如 Qwen3-0.6B）加速大模型的贪心解码：
+    1. 草稿模型逐个贪心地提出 k 个 token（小模型很快）
+    2. 目标模型把这 k 个 token 一次性做一次前向，得到每个位置上自己的贪心预测
+    3. 从头开始接受和目标模型预测一致的草稿 token，第一个不一致的位置换成目标模型的预测；
+       全部一致时还能白得一个 token（目标模型对第 k+1 个位置的预测）
+    4. 两个模型的 KV cache 都裁剪到被接受的长度，继续下一轮
+
+每一轮至少产出一个 token，而且每个 token 都是目标模型自己的贪心预测，
+所以输出和目标模型直接贪心解码完全一致，只是目标模型的前向次数变少了。
+两个模型必须使用同一个 tokenizer（Qwen3 各个尺寸的词表是一样的）。
+
+验证输出一致性：
+    python -m pytest tests/test_speculative.py      # 两个随机初始化的小模型，不需要权重
+    python speculative.py --target /path/to/Qwen3-8B --draft /path/to/Qwen3-0.6B
+"""
+import argparse
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import torch
+from transformers import DynamicCache
+
+from engine import GenerationRequest
+from kv_cache import common_prefix_length
+
+
+@dataclass
+class SpeculativeStats:
+    """单个请求的投机解码统计"""
+    proposed: int = 0         # 草稿模型一共提出了多少个 token
+    accepted: int = 0         # 其中被目标模型接受的个数
+    target_forwards: int = 0  # 目标模型前向次数（不含 prefill）
+    generated: int = 0        # 最终输出的 token 数
+    seconds: float = 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    @property
+    def tokens_per_forward(self) -> float:
+        return self.generated / self.target_forwards if self.target_forwards else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.acceptance_rate, 4),
+            "target_forwards": self.target_forwards,
+            "tokens_per_forward": round(self.tokens_per_forward, 3),
+            "generated": self.generated,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+class _Runner:
+    """一个模型加它自己的 KV cache。context 里 [0, cached) 部分已经在 cache 里，剩下的下次前向时喂入"""
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = DynamicCache()
+        self.cached = 0
+
+    def forward(self, token_ids: List[int]) -> torch.Tensor:
+        """喂入若干 token，返回每个位置的 logits [len, vocab]"""
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        outputs = self.model(input_ids=input_ids, past_key_values=self.cache, use_cache=True)
+        self.cache = outputs.past_key_values
+        self.cached += len(token_ids)
+        return outputs.logits[0]
+
+    def rollback(self, length: int) -> None:
+        if length < self.cached:
+            self.cache.crop(length)
+            self.cached = length
+
+
+class SpeculativeDecoder:
+    """
+    Args:
+        target: 目标模型（真正要用它的输出）
+        draft: 草稿模型，和目标模型共用 tokenizer
+        num_draft_tokens: 每一轮草稿模型提出的 token 数 k
+    """
+
+    def __init__(self, target, draft, num_draft_tokens: int = 4):
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens
+        eos = target.generation_config.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        # 两个模型的 lm_head 可能 pad 到不同的大小，只比较共同的部分
+        self.vocab_size = min(target.config.vocab_size, draft.config.vocab_size)
+        # 每个请求有自己的 KV cache，这里只是避免多个投机解码请求同时抢占显存
+        self._lock = threading.Lock()
+
+    def generate(self, request: GenerationRequest) -> SpeculativeStats:
+        """
+        同步地完成一个请求（忽略采样参数，始终贪心），结果写回 request.output_ids / finish_reason，
+        stopping_criteria、thinking_budget 和 on_token 的含义和 ContinuousBatchingEngine 里一样。
+        """
+        with self._lock, torch.inference_mode():
+            return self._generate(request)
+
+    def _generate(self, request: GenerationRequest) -> SpeculativeStats:
+        stats = SpeculativeStats()
+        start = time.perf_counter()
+        target, draft = _Runner(self.target), _Runner(self.draft)
+        context = list(request.input_ids)
+
+        # prefill：草稿模型先处理到倒数第二个 token，最后一个 token 留到第一轮提议时再喂
+        logits = target.forward(context)
+        draft.forward(context[:-1])
+        done = self._append(request, context, [self._argmax(logits[-1])])
+
+        while not done:
+            # 1. 草稿模型贪心地提出 k 个 token（剩余长度不足 k 时少提几个）
+            k = min(self.num_draft_tokens, request.max_new_tokens - len(request.output_ids))
+            proposal: List[int] = []
+            for _ in range(k):
+                logits = draft.forward(proposal[-1:] if proposal else context[draft.cached:])
+                proposal.append(self._argmax(logits[-1]))
+
+            # 2. 目标模型一次前向验证：pending 是上一轮已经确定、还没进 cache 的 token
+            pending = context[target.cached:]
+            logits = target.forward(pending + proposal)
+            stats.target_forwards += 1
+            predictions = [self._argmax(row) for row in logits[len(pending) - 1:]]
+
+            # 3. 接受和目标模型预测一致的前缀，再加上目标模型在第一个不一致位置（或末尾）的预测
+            accepted = 0
+            while accepted < len(proposal) and proposal[accepted] == predictions[accepted]:
+                accepted += 1
+            stats.proposed += len(proposal)
+            stats.accepted += accepted
+            new_tokens = proposal[:accepted] + [predictions[accepted]]
+
+            # 4. cache 只保留和最终 context 一致的部分（被接受的草稿 token），并且最后一个 token 不进 cache
+            base = len(context)
+            done = self._append(request, context, new_tokens)
+            valid = min(base + common_prefix_length(proposal, context[base:]), len(context) - 1)
+            target.rollback(valid)
+            draft.rollback(valid)
+
+        stats.generated = len(request.output_ids)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def _argmax(self, logits: torch.Tensor) -> int:
+        return int(torch.argmax(logits[:self.vocab_size]))
+
+    def _append(self, request: GenerationRequest, context: List[int], tokens: Sequence[int]) -> bool:
+        """逐个追加 token 并检查结束条件，返回是否结束；结束之后的 token 直接丢弃"""
+        for token in tokens:
+            context.append(token)
+            request.output_ids.append(token)
+            if request.on_token is not None:
+                request.on_token(token)
+            if token in self.eos_token_ids:
+                request.finish_reason = "stop"
+            elif len(request.output_ids) >= request.max_new_tokens:
+                request.finish_reason = "length"
+            else:
+                request.finish_reason = next(
+                    (reason for reason in (c(request.output_ids) for c in request.stopping_criteria) if reason), None
+                )
+            if request.finish_reason is not None:
+                return True
+            if request.thinking_budget is not None:
+                forced = request.thinking_budget(request.output_ids)
+                if forced:
+                    # 强制插入的 token 不经过验证，剩下的草稿 token 作废，下一轮从插入之后重新开始
+                    return self._append(request, context, forced)
+        return False
+
+
+def verify_against_greedy(target, draft, tokenizer, prompts: Sequence[str], max_new_tokens: int = 128,
+                          num_draft_tokens: int = 4) -> List[SpeculativeStats]:
+    """
+    对每个 prompt 分别用目标模型 generate(do_sample=False) 和投机解码生成，断言两者输出完全一致。
+    """
+    decoder = SpeculativeDecoder(target, draft, num_draft_tokens)
+    results = []
+    for prompt in prompts:
+        text = tokenizer.apply_chat_template(
+            [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True, enable_thinking=False
+        )
+        input_ids = tokenizer(text).input_ids
+        with torch.inference_mode():
+            output = target.generate(
+                torch.tensor([input_ids], device=target.device), max_new_tokens=max_new_tokens, do_sample=False,
+                top_p=None, top_k=None, temperature=None,
+            )
+        expected = output[0][len(input_ids):].tolist()
+
+        request = GenerationRequest(input_ids=input_ids, max_new_tokens=max_new_tokens)
+        stats = decoder.generate(request)
+        assert request.output_ids == expected, (
+            f"speculative output differs from greedy for {prompt!r}:\n"
+            f"{tokenizer.decode(request.output_ids)!r}\nvs\n{tokenizer.decode(expected)!r}"
+        )
+        results.append(stats)
+    return results
+
+
+def main():
+    from model_loader import load_model
+
+    parse = argparse.ArgumentParser(description="验证投机解码和目标模型贪心解码的输出一致")
+    parse.add_argument("--target", type=str, required=True, help="目标模型目录")
+    parse.add_argument("--draft", type=str, required=True, help="草稿模型目录")
+    parse.add_argument("--k", type=int, default=4, help="每轮草稿 token 数")
+    parse.add_argument("--max_new_tokens", type=int, default=128)
+    args = parse.parse_args()
+
+    target, tokenizer = load_model(args.target)
+    draft, _ = load_model(args.draft)
+    prompts = ["用一句话介绍一下你自己。", "What is the capital of France?", "写一个 Python 的快速排序。"]
+    for prompt, stats in zip(prompts, verify_against_greedy(target, draft, tokenizer, prompts, args.max_new_tokens, args.k)):
+        print(prompt, stats.to_dict())
+    print("ok: speculative output identical to greedy decoding")
+
+
+if __name__ == "__main__":
+    main()
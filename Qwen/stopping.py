@@ -0,0 +1,132 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   生成预算 / 提前停止   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+decode 循环每生成一个 token 都会依次检查请求上挂的 stopping criteria，
+任何一个返回结束原因（finish_reason）时该序列立即结束，并把原因返回给前端：
+    - "stop"      生成了 EOS，或者回答里出现了 stop 字符串
+    - "length"    达到 max_new_tokens（由引擎本身检查）
+    - "deadline"  超过了请求的墙钟时间上限
+
+ThinkingBudget 不会结束生成：思考部分超过预算时强制插入 </think>，让模型直接开始回答。
+"""
+import time
+from typing import List, Optional, Sequence
+
+from streaming import THINK_END_TOKEN_ID
+
+# Qwen3 官方给出的思考预算用完时的衔接文本，之后模型会直接输出回答
+THINKING_BUDGET_SUFFIX = (
+    "\n\nConsidering the limited time by the user, I have to give the solution "
+    "based on the thinking directly now.\n</think>\n\n"
+)
+
+
+class StoppingCriteria:
+    """和 transformers 的 StoppingCriteria 类似，不过按单个序列检查，返回结束原因而不是 bool"""
+
+    def __call__(self, output_ids: List[int]) -> Optional[str]:
+        raise NotImplementedError
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """请求的墙钟时间上限，从创建时开始计时（包含排队时间）"""
+
+    def __init__(self, timeout: float):
+        self.deadline = time.monotonic() + timeout
+
+    def __call__(self, output_ids: List[int]) -> Optional[str]:
+        return "deadline" if time.monotonic() >= self.deadline else None
+
+
+class StopStringCriteria(StoppingCriteria):
+    """
+    回答里出现任意一个 stop 字符串时结束。思考模式下只检查 </think> 之后的内容。
+    每一步只 decode 最后几个 token 组成的窗口，不会随输出变长而变慢。
+    """
+
+    def __init__(self, tokenizer, stop: Sequence[str], enable_thinking: bool = True):
+        self.tokenizer = tokenizer
+        self.stop = [s for s in stop if s]
+        self.in_answer = not enable_thinking
+        self.answer_start = 0
+        # 一个 token 至少对应一个字符，窗口取最长 stop 字符串的长度再多留几个 token
+        self.window = max((len(s) for s in self.stop), default=0) + 4
+
+    def __call__(self, output_ids: List[int]) -> Optional[str]:
+        if not self.stop:
+            return None
+        if not self.in_answer:
+            if output_ids[-1] == THINK_END_TOKEN_ID:
+                self.in_answer = True
+                self.answer_start = len(output_ids)
+            return None
+        tail = output_ids[max(self.answer_start, len(output_ids) - self.window):]
+        text = self.tokenizer.decode(tail, skip_special_tokens=True)
+        return "stop" if any(s in text for s in self.stop) else None
+
+
+class ThinkingBudget:
+    """
+    思考部分的 token 预算。超过预算仍然没有 </think> 时，返回需要强制喂给模型的 token，
+    把思考收尾并切换到回答。每个请求单独一个实例（有状态）。
+    """
+
+    def __init__(self, tokenizer, budget: int):
+        self.budget = budget
+        self.suffix_ids = tokenizer.encode(THINKING_BUDGET_SUFFIX, add_special_tokens=False)
+        self.closed = False
+
+    def __call__(self, output_ids: List[int]) -> List[int]:
+        if self.closed:
+            return []
+        if output_ids[-1] == THINK_END_TOKEN_ID:
+            self.closed = True
+            return []
+        if len(output_ids) >= self.budget:
+            self.closed = True
+            return list(self.suffix_ids)
+        return []
+
+
+def truncate_at_stop(text: str, stop: Sequence[str]) -> str:
+    """把回答截断在第一个 stop 字符串之前（和 OpenAI 接口一样，不包含 stop 字符串本身）"""
+    positions = [text.find(s) for s in stop if s and s in text]
+    return text[:min(positions)] if positions else text
+
+
+class StopStringFilter:
+    """
+    流式输出时的 stop 字符串处理，和 truncate_at_stop 结果一致：
+        留住最长 stop 字符串长度 - 1 个字符的尾巴（stop 可能跨两个增量），出现 stop 后截断并不再输出
+    """
+
+    def __init__(self, stop: Sequence[str]):
+        self.stop = [s for s in stop if s]
+        self.hold = max((len(s) for s in self.stop), default=1) - 1
+        self.buffer = ""
+        self.stopped = False
+
+    def put(self, delta: str) -> str:
+        """传入一段增量，返回现在可以发给客户端的部分"""
+        if self.stopped:
+            return ""
+        if not self.stop:
+            return delta
+        self.buffer += delta
+        truncated = truncate_at_stop(self.buffer, self.stop)
+        if len(truncated) < len(self.buffer):
+            self.stopped = True
+            self.buffer = ""
+            return truncated
+        cut = len(self.buffer) - self.hold
+        if cut <= 0:
+            return ""
+        text, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return text
+
+    def end(self) -> str:
+        """生成结束，返回留住的尾巴"""
+        text = "" if self.stopped else self.buffer
+        self.buffer = ""
+        return text
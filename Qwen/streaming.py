@@ -0,0 +1,64 @@
+#****************************************************************************************************************************************************************
+#************************************************************************   流式解码（思考/回答分流）   ************************************************************************
+#****************************************************************************************************************************************************************
+"""
+参考 transformers 的 TextIteratorStreamer：逐 token 增量解码，只输出已经可以完整显示的文本。
+额外做的一件事是按 </think>（token id 151668）把输出切成 thinking / content 两个阶段，
+一旦出现 </think> 就立刻切换阶段，而不是等全部生成完之后再切分。
+"""
+from typing import List, Tuple
+
+THINK_END_TOKEN_ID = 151668  # </think>
+
+
+class ThinkContentStreamer:
+    """
+    Args:
+        tokenizer: 用来 decode 的 tokenizer
+        enable_thinking: 是否为思考模式；不是思考模式时所有输出都属于 content
+    """
+
+    def __init__(self, tokenizer, enable_thinking: bool = True):
+        self.tokenizer = tokenizer
+        self.phase = "thinking" if enable_thinking else "content"
+        self.token_cache: List[int] = []
+        self.print_len = 0  # 当前阶段已经输出的字符数
+        self.started = False  # 当前阶段是否已经输出过非空文本（用来去掉开头的换行）
+
+    def put(self, token_id: int) -> List[Tuple[str, str]]:
+        """喂入一个 token，返回这一步可以输出的 (phase, delta) 列表"""
+        if token_id == THINK_END_TOKEN_ID and self.phase == "thinking":
+            deltas = self._flush()
+            self.phase = "content"
+            self.token_cache, self.print_len, self.started = [], 0, False
+            return deltas
+
+        self.token_cache.append(token_id)
+        text = self.tokenizer.decode(self.token_cache, skip_special_tokens=True)
+        # 末尾是不完整的 UTF-8 字符时先不输出，等后面的 token 补全
+        if text.endswith("�"):
+            return []
+        deltas = self._emit(text)
+        # 和 TextStreamer 一样，遇到换行就清空缓存，避免每一步都重新 decode 整个阶段的文本
+        if text.endswith("\n"):
+            self.token_cache, self.print_len = [], 0
+        return deltas
+
+    def end(self) -> List[Tuple[str, str]]:
+        """生成结束时输出剩余内容"""
+        return self._flush()
+
+    def _flush(self) -> List[Tuple[str, str]]:
+        if not self.token_cache:
+            return []
+        text = self.tokenizer.decode(self.token_cache, skip_special_tokens=True)
+        return self._emit(text)
+
+    def _emit(self, text: str) -> List[Tuple[str, str]]:
+        delta = text[self.print_len:]
+        self.print_len = len(text)
+        if not self.started:
+            # 和非流式接口的 strip("\n") 保持一致，去掉每个阶段开头的换行
+            delta = delta.lstrip("\n")
+            self.started = bool(delta)
+        return [(self.phase, delta)] if delta else []
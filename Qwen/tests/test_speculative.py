@@ -0,0 +1,76 @@
+"""投机解码和目标模型贪心解码输出一致性的测试，用两个随机初始化的小模型，不需要下载权重"""
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import GenerationRequest  # noqa: E402
+from speculative import SpeculativeDecoder  # noqa: E402
+
+MAX_NEW_TOKENS = 40
+PROMPTS = [[1, 5, 9, 13, 2], [7, 7, 7], list(range(3, 40, 3))]
+
+
+def tiny_model(seed: int):
+    torch.manual_seed(seed)
+    config = transformers.Qwen2Config(
+        vocab_size=96, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=256,
+    )
+    model = transformers.Qwen2ForCausalLM(config).eval()
+    # 随机模型没有真正的 eos，固定长度生成，两边都只会因为 max_new_tokens 结束
+    model.generation_config.eos_token_id = None
+    model.generation_config.pad_token_id = 0
+    return model
+
+
+@pytest.fixture(scope="module")
+def target():
+    return tiny_model(0)
+
+
+@pytest.fixture(scope="module")
+def draft():
+    return tiny_model(1)
+
+
+def greedy(model, input_ids):
+    with torch.inference_mode():
+        output = model.generate(
+            torch.tensor([input_ids]), max_new_tokens=MAX_NEW_TOKENS, min_new_tokens=MAX_NEW_TOKENS,
+            do_sample=False, top_p=None, top_k=None, temperature=None,
+        )
+    return output[0][len(input_ids):].tolist()
+
+
+def speculative(target, draft, input_ids, k):
+    request = GenerationRequest(input_ids=list(input_ids), max_new_tokens=MAX_NEW_TOKENS)
+    stats = SpeculativeDecoder(target, draft, num_draft_tokens=k).generate(request)
+    return request, stats
+
+
+@pytest.mark.parametrize("k", [1, 2, 4, 7])
+def test_matches_greedy_with_rejections(target, draft, k):
+    """草稿模型和目标模型不同：会出现提前拒绝，输出仍然和贪心解码一致"""
+    rejected = 0
+    for input_ids in PROMPTS:
+        request, stats = speculative(target, draft, input_ids, k)
+        assert request.output_ids == greedy(target, input_ids)
+        assert request.finish_reason == "length"
+        rejected += stats.proposed - stats.accepted
+    assert rejected > 0
+
+
+@pytest.mark.parametrize("k", [1, 3, 5])
+def test_matches_greedy_when_all_accepted(target, k):
+    """草稿模型就是目标模型：每一轮全部接受，并且每次目标模型前向产出多于一个 token"""
+    for input_ids in PROMPTS:
+        request, stats = speculative(target, target, input_ids, k)
+        assert request.output_ids == greedy(target, input_ids)
+        assert stats.accepted == stats.proposed
+        assert stats.tokens_per_forward > 1